@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BloodReport, AllergyInfo, HealthRecommendation, HabitProgress, ProgressStreak
+from .models import BloodReport, AllergyInfo, HealthRecommendation, HabitProgress, ProgressStreak, IngestionJob
 
 @admin.register(BloodReport)
 class BloodReportAdmin(admin.ModelAdmin):
@@ -33,3 +33,10 @@ class HabitProgressAdmin(admin.ModelAdmin):
 class ProgressStreakAdmin(admin.ModelAdmin):
     list_display = ['user', 'current_streak', 'longest_streak', 'total_habits_completed']
     list_filter = ['user']
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'blood_report', 'status', 'attempts', 'updated_at']
+    list_filter = ['status']
+    readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,242 @@
+"""
+Trend statistics over a user's (or a cohort's) parameter history.
+
+Series are read straight from the packed ``ParameterSeries`` buffers into
+NumPy and concatenated into one flat batch with a segment per series, so
+every statistic is a handful of array operations (``bincount`` and
+``reduceat`` over the segments) rather than a Python loop per reading:
+
+  * ``slope_per_year``: least-squares slope, units per year
+  * ``rate_of_change``: change since the previous report, units per 30 days
+  * ``change_pct``: change since the previous report, percent
+  * ``out_of_range_streak``: consecutive latest readings outside the range,
+    and ``longest_out_of_range_streak`` over the whole history
+  * ``zscore``: latest reading against the user's earlier readings
+
+A user's results are cached per (user, data version); the version is the
+count and newest ``updated_at`` of their series plus the catalog version,
+so any write or range change yields a fresh key.
+"""
+from collections import namedtuple
+
+import numpy as np
+from django.core.cache import cache
+
+from .catalog import get_catalog
+from .models import ParameterSeries
+
+
+TRENDS_CACHE_KEY = "analyzer:trends:{user_id}:{version}"
+TRENDS_TIMEOUT = 24 * 3600
+
+DAY = 86400.0
+
+# Fitted change over the history, as a share of the reference range width,
+# below which a trend counts as stable
+STABLE_SHARE = 0.05
+
+
+TrendStats = namedtuple(
+    "TrendStats",
+    [
+        "count", "first_at", "last_at", "latest", "previous", "slope_per_year",
+        "rate_of_change", "change_pct", "direction", "out_of_range_streak",
+        "longest_out_of_range_streak", "baseline_mean", "zscore",
+    ],
+)
+
+SeriesBatch = namedtuple("SeriesBatch", ["keys", "parameter_ids", "times", "values", "starts", "lengths"])
+
+
+def load_batch(rows):
+    """
+    Flat batch from ``(key, parameter_id, timestamps, values)`` rows, where
+    the last two are packed ``array('d')`` buffers. Empty series are skipped.
+    """
+    keys, parameter_ids, times, values, lengths = [], [], [], [], []
+    for key, parameter_id, packed_times, packed_values in rows:
+        series_values = np.frombuffer(bytes(packed_values), dtype=np.float64)
+        if not len(series_values):
+            continue
+        keys.append(key)
+        parameter_ids.append(parameter_id)
+        times.append(np.frombuffer(bytes(packed_times), dtype=np.float64))
+        values.append(series_values)
+        lengths.append(len(series_values))
+
+    lengths = np.array(lengths, dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(lengths) else lengths
+    return SeriesBatch(
+        keys=keys,
+        parameter_ids=np.array(parameter_ids, dtype=np.int64),
+        times=np.concatenate(times) / DAY if times else np.empty(0),
+        values=np.concatenate(values) if values else np.empty(0),
+        starts=starts,
+        lengths=lengths,
+    )
+
+
+def _ranges(parameter_ids, catalog):
+    """Per-segment reference limits, NaN where a limit is missing"""
+    low = np.full(len(parameter_ids), np.nan)
+    high = np.full(len(parameter_ids), np.nan)
+    for i, parameter_id in enumerate(parameter_ids):
+        normal_min, normal_max = catalog.reference_range(int(parameter_id))
+        if normal_min is not None:
+            low[i] = normal_min
+        if normal_max is not None:
+            high[i] = normal_max
+    return low, high
+
+
+def _segment_mean(segments, values, counts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.bincount(segments, values, minlength=len(counts)) / counts
+
+
+def compute_trends(batch, catalog):
+    """``{key: TrendStats}`` for every series in ``batch``, in one vectorized pass"""
+    n_series = len(batch.keys)
+    if not n_series:
+        return {}
+
+    t, v, starts, n = batch.times, batch.values, batch.starts, batch.lengths
+    ends = starts + n
+    last = ends - 1
+    has_previous = n >= 2
+    previous_index = np.where(has_previous, last - 1, last)
+    segments = np.repeat(np.arange(n_series), n)
+    low, high = _ranges(batch.parameter_ids, catalog)
+
+    # Least-squares slope per segment
+    mean_t = _segment_mean(segments, t, n)
+    mean_v = _segment_mean(segments, v, n)
+    dt = t - mean_t[segments]
+    var_t = np.bincount(segments, dt * dt, minlength=n_series)
+    cov = np.bincount(segments, dt * (v - mean_v[segments]), minlength=n_series)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(var_t > 0, cov / var_t, np.nan) * 365.25
+
+    # Change since the previous report
+    latest, previous = v[last], v[previous_index]
+    gap_days = t[last] - t[previous_index]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = np.where(has_previous & (gap_days > 0), (latest - previous) / gap_days * 30, np.nan)
+        change_pct = np.where(has_previous & (previous != 0), (latest - previous) / np.abs(previous) * 100, np.nan)
+
+    # Direction: fitted change over the history against the range width
+    span_years = (t[last] - t[starts]) / 365.25
+    width = np.where(np.isnan(high - low), np.abs(mean_v), high - low)
+    fitted_change = np.nan_to_num(slope) * span_years
+    threshold = STABLE_SHARE * width
+    direction = np.where(fitted_change > threshold, "rising", np.where(fitted_change < -threshold, "falling", "stable"))
+
+    # Out-of-range runs: a run restarts at every in-range reading and at
+    # every segment start
+    out = (v < np.nan_to_num(low[segments], nan=-np.inf)) | (v > np.nan_to_num(high[segments], nan=np.inf))
+    out_int = out.astype(np.int64)
+    running = np.cumsum(out_int)
+    is_start = np.zeros(len(v), dtype=bool)
+    is_start[starts] = True
+    base = np.maximum.accumulate(np.where(~out | is_start, running - out_int, 0))
+    run_length = running - base
+    longest = np.maximum.reduceat(run_length, starts)
+    trailing = run_length[last]
+
+    # Latest reading against the baseline of earlier readings
+    earlier = np.ones(len(v), dtype=bool)
+    earlier[last] = False
+    baseline_n = n - 1
+    baseline_mean = _segment_mean(segments[earlier], v[earlier], baseline_n)
+    deviation = v[earlier] - baseline_mean[segments[earlier]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        baseline_var = np.bincount(segments[earlier], deviation * deviation, minlength=n_series) / (baseline_n - 1)
+        baseline_std = np.sqrt(baseline_var)
+        zscore = np.where((baseline_n >= 2) & (baseline_std > 0), (latest - baseline_mean) / baseline_std, np.nan)
+
+    def column(array, valid=None):
+        """Plain Python values, None where NaN or not ``valid``"""
+        missing = np.isnan(array) if array.dtype.kind == "f" else np.zeros(len(array), dtype=bool)
+        if valid is not None:
+            missing |= ~valid
+        return [None if gone else x for x, gone in zip(array.tolist(), missing.tolist())]
+
+    # Converting whole columns at once is much cheaper than per element
+    columns = zip(
+        n.tolist(),
+        (t[starts] * DAY).tolist(),
+        (t[last] * DAY).tolist(),
+        latest.tolist(),
+        column(previous, has_previous),
+        column(slope),
+        column(rate),
+        column(change_pct),
+        column(direction, has_previous),
+        trailing.tolist(),
+        longest.tolist(),
+        column(baseline_mean),
+        column(zscore),
+    )
+    return {key: TrendStats(*row) for key, row in zip(batch.keys, columns)}
+
+
+def _data_version(user_id, catalog):
+    # A plain column read compiles far faster than COUNT/MAX aggregates
+    stamps = list(ParameterSeries.objects.filter(user_id=user_id).values_list("updated_at", flat=True))
+    latest = max(stamps).timestamp() if stamps else 0
+    return f"{catalog.version}:{len(stamps)}:{latest}"
+
+
+def user_trends(user_id, catalog=None):
+    """``{parameter_id: TrendStats}`` for the user, cached per data version"""
+    catalog = catalog or get_catalog()
+    key = TRENDS_CACHE_KEY.format(user_id=user_id, version=_data_version(user_id, catalog))
+    trends = cache.get(key)
+    if trends is None:
+        rows = (
+            ParameterSeries.objects
+            .filter(user_id=user_id)
+            .order_by("parameter_id")
+            .values_list("parameter_id", "parameter_id", "timestamps", "values")
+        )
+        trends = compute_trends(load_batch(rows), catalog)
+        cache.set(key, trends, TRENDS_TIMEOUT)
+    return trends
+
+
+def cohort_trends(parameter_id, user_ids=None, catalog=None):
+    """``{user_id: TrendStats}`` for one parameter across users (all by default)"""
+    catalog = catalog or get_catalog()
+    rows = ParameterSeries.objects.filter(parameter_id=parameter_id)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    rows = rows.order_by("user_id").values_list("user_id", "parameter_id", "timestamps", "values")
+    return compute_trends(load_batch(rows.iterator(chunk_size=1000)), catalog)
+
+
+def describe_trend(name, unit, stats):
+    """One line for LLM prompts, or None with too little history"""
+    if stats.count < 2:
+        return None
+    parts = [f"{stats.direction} over {stats.count} reports"]
+    if stats.slope_per_year is not None:
+        parts[0] += f" ({stats.slope_per_year:+.3g} {unit} per year)"
+    if stats.change_pct is not None:
+        parts.append(f"{stats.change_pct:+.0f}% since the previous report")
+    if stats.zscore is not None and abs(stats.zscore) >= 2:
+        parts.append(f"latest is {abs(stats.zscore):.1f} SD {'above' if stats.zscore > 0 else 'below'} their usual")
+    if stats.out_of_range_streak >= 2:
+        parts.append(f"out of range on the last {stats.out_of_range_streak} reports")
+    return f"- {name}: " + "; ".join(parts)
+
+
+def trends_prompt(user_id, catalog=None):
+    """Trend lines for the user's parameters, empty with no history"""
+    catalog = catalog or get_catalog()
+    lines = []
+    for parameter_id, stats in user_trends(user_id, catalog).items():
+        entry = catalog.by_id.get(parameter_id)
+        line = entry and describe_trend(entry.name, entry.unit, stats)
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,142 @@
+"""
+Process-wide, read-only view of the BloodParameter table.
+
+Parsing, the dashboard and the PDF report all need parameter names, units,
+aliases and reference ranges. Instead of querying and re-splitting
+``common_names`` on every request, the catalog is loaded once per process
+into immutable structures.
+
+Changes to BloodParameter bump a version stamp kept in the shared Django
+cache once they commit (see ``analyzer.signals``); every process compares
+its copy against that stamp and reloads when another worker has changed the
+table.
+"""
+import threading
+import time
+import uuid
+from collections import namedtuple
+from types import MappingProxyType
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import BloodParameter
+
+
+VERSION_CACHE_KEY = "analyzer:parameter_catalog_version"
+
+# Seconds between checks of the shared version stamp
+VERSION_CHECK_INTERVAL = 2.0
+
+
+ParameterEntry = namedtuple(
+    "ParameterEntry",
+    ["id", "name", "category", "unit", "normal_min", "normal_max", "aliases"],
+)
+
+
+class ParameterCatalog:
+    """Immutable snapshot of all blood parameters"""
+
+    def __init__(self, entries, version):
+        self.version = version
+        self.parameters = tuple(entries)
+        self.by_id = MappingProxyType({entry.id: entry for entry in self.parameters})
+        self.by_name = MappingProxyType({entry.name: entry for entry in self.parameters})
+        # (alias, parameter_id) pairs; the parameter name counts as an alias
+        self.alias_index = tuple(
+            (alias, entry.id) for entry in self.parameters for alias in entry.aliases
+        )
+
+    def reference_range(self, parameter_id):
+        entry = self.by_id.get(parameter_id)
+        if entry is None:
+            return None, None
+        return entry.normal_min, entry.normal_max
+
+    def status(self, parameter_id, value):
+        """'Low', 'High' or 'Normal' against the reference range"""
+        normal_min, normal_max = self.reference_range(parameter_id)
+        if normal_min is not None and value < normal_min:
+            return "Low"
+        if normal_max is not None and value > normal_max:
+            return "High"
+        return "Normal"
+
+    def __iter__(self):
+        return iter(self.parameters)
+
+    def __len__(self):
+        return len(self.parameters)
+
+
+def _load(version):
+    entries = []
+    for param in BloodParameter.objects.order_by("id"):
+        aliases = [param.name.lower()]
+        aliases += [alias for alias in param.aliases() if alias and alias not in aliases]
+        entries.append(ParameterEntry(
+            id=param.id,
+            name=param.name,
+            category=param.category,
+            unit=param.unit,
+            normal_min=param.normal_min,
+            normal_max=param.normal_max,
+            aliases=tuple(aliases),
+        ))
+    return ParameterCatalog(entries, version)
+
+
+_lock = threading.Lock()
+_catalog = None
+_checked_at = 0.0
+
+
+def _shared_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        # Another process may have set it first; theirs wins
+        if not cache.add(VERSION_CACHE_KEY, version, timeout=None):
+            version = cache.get(VERSION_CACHE_KEY, version)
+    return version
+
+
+def get_catalog():
+    """Current catalog, reloaded only when the shared version changes"""
+    global _catalog, _checked_at
+
+    catalog = _catalog
+    now = time.monotonic()
+    if catalog is not None and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return catalog
+
+    version = _shared_version()
+    if catalog is not None and catalog.version == version:
+        _checked_at = now
+        return catalog
+
+    with _lock:
+        if _catalog is None or _catalog.version != version:
+            _catalog = _load(version)
+        _checked_at = now
+        return _catalog
+
+
+def invalidate_catalog():
+    """Drop the local copy and tell every other process to reload"""
+    global _catalog
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+    with _lock:
+        _catalog = None
+
+
+def catalog_changed():
+    """
+    Drop this process's copy now and bump the shared stamp once the change
+    commits, so no process reloads the old rows under the new version
+    """
+    global _catalog
+    with _lock:
+        _catalog = None
+    transaction.on_commit(invalidate_catalog)
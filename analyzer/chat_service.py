@@ -0,0 +1,229 @@
+"""
+Chat context per report.
+
+The system prompt for a report only changes when its values (or the
+parameter catalog) change, so it is built once, when values are written,
+and kept in the shared cache. A chat message then costs one cache read
+instead of a query per value, and every message of a conversation sends
+the same prompt prefix.
+
+With ``CHAT_MEMORY_ENABLED`` the prompt also carries the last
+``CHAT_HISTORY_TURNS`` turns plus a rolling summary of everything older
+(``ChatSummary``), so it stays bounded however long the chat gets.
+"""
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from . import llm_gateway
+from .analytics import trends_prompt
+from .catalog import get_catalog
+from .llm_gateway import LLMError
+from .models import BloodReportValue, ChatMessage, ChatSummary
+
+
+CONTEXT_CACHE_KEY = "analyzer:chat_context:{report_id}:{catalog_version}"
+CONTEXT_TIMEOUT = 7 * 24 * 3600
+
+
+def _context_key(report_id, catalog):
+    return CONTEXT_CACHE_KEY.format(report_id=report_id, catalog_version=catalog.version)
+
+
+def _format_range(normal_min, normal_max):
+    if normal_min is None and normal_max is None:
+        return ""
+    if normal_min is None:
+        return f"ref < {normal_max:g}"
+    if normal_max is None:
+        return f"ref > {normal_min:g}"
+    return f"ref {normal_min:g}-{normal_max:g}"
+
+
+def build_chat_context(report_id, catalog=None):
+    """
+    Compact metrics block, out-of-range flags and system prompt for a report.
+
+    Names and ranges come from the in-memory catalog, so this is a single
+    query however many values the report has.
+    """
+    catalog = catalog or get_catalog()
+    rows = (
+        BloodReportValue.objects
+        .filter(report_id=report_id)
+        .order_by("parameter_id")
+        .values_list("parameter_id", "value", "unit")
+    )
+
+    lines, flags = [], {}
+    for parameter_id, value, unit in rows:
+        entry = catalog.by_id.get(parameter_id)
+        if entry is None:
+            continue
+        status = catalog.status(parameter_id, value)
+        if status != "Normal":
+            flags[entry.name] = status
+        details = [status.lower(), _format_range(entry.normal_min, entry.normal_max)]
+        lines.append(
+            f"- {entry.name}: {value:g} {unit or entry.unit} ({'; '.join(d for d in details if d)})"
+        )
+    metrics = "\n".join(lines) or "- No values were extracted"
+
+    prompt = f"""You are a helpful medical lab assistant.
+The patient's blood report results are:
+{metrics}
+Rules:
+1. Answer based ONLY on these results.
+2. If they ask for a diagnosis, tell them to consult a doctor.
+3. Keep answers concise and supportive."""
+
+    return {"metrics": metrics, "flags": flags, "prompt": prompt}
+
+
+def get_chat_context(report_id):
+    """Cached chat context, built on a miss"""
+    catalog = get_catalog()
+    key = _context_key(report_id, catalog)
+    context = cache.get(key)
+    if context is None:
+        context = build_chat_context(report_id, catalog)
+        cache.set(key, context, CONTEXT_TIMEOUT)
+    return context
+
+
+def refresh_chat_context(report_id):
+    """Rebuild the cached context once the current transaction commits"""
+    def rebuild():
+        catalog = get_catalog()
+        cache.set(_context_key(report_id, catalog), build_chat_context(report_id, catalog), CONTEXT_TIMEOUT)
+
+    transaction.on_commit(rebuild)
+
+
+def invalidate_chat_context(report_id):
+    """
+    Drop the cached context now and again once the current transaction
+    commits, in case another request rebuilt it from the old rows meanwhile
+    """
+    key = _context_key(report_id, get_catalog())
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def chat_prompt(report):
+    """System prompt grounding the assistant in the report's values"""
+    return get_chat_context(report.id)["prompt"]
+
+
+def _speaker(message):
+    return "Assistant" if message.is_bot else "User"
+
+
+def recent_messages(report, turns=None):
+    """The last ``turns`` question/answer pairs, oldest first"""
+    turns = settings.CHAT_HISTORY_TURNS if turns is None else turns
+    newest = ChatMessage.objects.filter(blood_report=report).order_by('-created_at', '-id')[:turns * 2]
+    return list(reversed(newest))
+
+
+def conversation_contents(report, user_query):
+    """Model contents for a new question: system prompt, trends, memory, question"""
+    contents = [chat_prompt(report)]
+    trends = trends_prompt(report.user_id) if report.user_id else ""
+    if trends:
+        contents.append(f"Trends across the patient's reports:\n{trends}")
+    if settings.CHAT_MEMORY_ENABLED:
+        summary = ChatSummary.objects.filter(blood_report=report).values_list('summary', flat=True).first()
+        if summary:
+            contents.append(f"Summary of the earlier conversation:\n{summary}")
+        history = recent_messages(report)
+        if history:
+            contents.append("Recent conversation:\n" + "\n".join(
+                f"{_speaker(message)}: {message.message}" for message in history
+            ))
+    contents.append(user_query)
+    return contents
+
+
+def update_summary(report):
+    """
+    Fold messages that dropped out of the history window into the rolling
+    summary. Runs only once ``CHAT_SUMMARY_BATCH_TURNS`` turns have piled
+    up, so the summarization call is amortized over several messages.
+    """
+    if not settings.CHAT_MEMORY_ENABLED:
+        return
+    summary, _ = ChatSummary.objects.get_or_create(blood_report=report)
+    pending = ChatMessage.objects.filter(blood_report=report)
+    if summary.summarized_until_id:
+        pending = pending.filter(id__gt=summary.summarized_until_id)
+
+    pending_ids = list(pending.order_by('-created_at', '-id').values_list('id', flat=True))
+    older_ids = pending_ids[settings.CHAT_HISTORY_TURNS * 2:]
+    if len(older_ids) < settings.CHAT_SUMMARY_BATCH_TURNS * 2:
+        return
+
+    older = list(ChatMessage.objects.filter(id__in=older_ids).order_by('created_at', 'id'))
+    transcript = "\n".join(f"{_speaker(message)}: {message.message}" for message in older)
+    prompt = f"""
+    Update the running summary of a conversation about a blood report.
+    Keep every fact, number and open question; drop small talk.
+    Under 120 words.
+
+    CURRENT SUMMARY:
+    {summary.summary or "(none)"}
+
+    NEW MESSAGES:
+    {transcript}
+    """
+    try:
+        summary.summary = llm_gateway.generate(prompt).strip()
+    except LLMError:
+        return  # retried after the next message
+    summary.summarized_until = older[-1]
+    summary.save(update_fields=['summary', 'summarized_until', 'updated_at'])
+
+
+def encode_cursor(message):
+    raw = f"{message.created_at.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """``(created_at, id)`` from a cursor; raises ValueError if malformed"""
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (UnicodeError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def history_page(report, cursor=None, limit=20):
+    """
+    One page of messages older than ``cursor``, oldest first, and the cursor
+    for the page before it (None at the start of the conversation).
+
+    Keyset pagination on (created_at, id) keeps every page an index range
+    scan, however deep the user scrolls.
+    """
+    messages = ChatMessage.objects.filter(blood_report=report)
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+        )
+    page = list(messages.order_by('-created_at', '-id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return list(reversed(page[:limit])), next_cursor
+
+
+def save_exchange(user, report, user_query, bot_response):
+    """Store the question and the assembled answer"""
+    ChatMessage.objects.bulk_create([
+        ChatMessage(user=user, blood_report=report, message=user_query, is_bot=False),
+        ChatMessage(user=user, blood_report=report, message=bot_response, is_bot=True),
+    ])
@@ -1,113 +1,99 @@
+import json
+
 from django.conf import settings
-from google import genai
-import PyPDF2
-from PIL import Image
-import pytesseract
+from analyzer.utils.pdf_extractor import iter_pdf_text
+from . import llm_gateway
+from .llm_cache import cached_generate
+from .ocr_service import ocr_document
 
 
-client = genai.Client(api_key=settings.GEMINI_API_KEY)
 MODEL_NAME = settings.MODEL_NAME
 
 
-def extract_text_from_pdf(pdf_file):
-    """Extract text from PDF blood report"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
-        return text.strip()
-    except Exception as e:
-        return f"Error extracting PDF: {str(e)}"
+def generate_text(contents, model=None):
+    """Gemini response text for ``contents``, served from the local cache when possible"""
+    model = model or MODEL_NAME
+    return cached_generate(
+        model,
+        contents,
+        lambda: llm_gateway.generate(contents, model=model),
+    )
 
 
-def extract_text_from_image(image_file):
-    """Extract text from image using Gemini Vision"""
-    try:
-        image = Image.open(image_file)
-
-        # prompt = """
-        # This is a blood test report.
-        # Extract all test parameters with:
-        # - Test name
-        # - Value
-        # - Unit
-        # - Reference range
-        # - Status (if mentioned)
-        # """
+def generate_json(contents, schema, model=None):
+    """Like ``generate_text`` but constrained to a JSON response matching ``schema``"""
+    model = model or MODEL_NAME
+    config = {"response_mime_type": "application/json", "response_schema": schema}
+    # The schema is part of the request, so it is part of the cache key too
+    key = [*([contents] if isinstance(contents, str) else contents), json.dumps(schema, sort_keys=True)]
+    return cached_generate(
+        model,
+        key,
+        lambda: llm_gateway.generate(contents, model=model, config=config),
+    )
 
-        # response = client.models.generate_content(
-        #     model=MODEL_NAME,
-        #     contents=[prompt, image]
-        # )
-        pytesseract.pytesseract.tesseract_cmd = r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe"
 
-        text = pytesseract.image_to_string(image)
+def extract_text_from_pdf(pdf_file):
+    """
+    Extract text from PDF blood report. Errors propagate so the ingestion
+    job can retry instead of saving them as report text.
+    """
+    return "\n".join(text for text in iter_pdf_text(pdf_file) if text).strip()
 
-        return text
 
-    except Exception as e:
-        return f"Error extracting from image: {str(e)}"
+def extract_text_from_image(image_file):
+    """Extract text from image using the OCR worker pool; errors propagate"""
+    text, _ = ocr_document(image_file)
+    return text
 
 
 def analyze_blood_report(extracted_text, allergies_dict):
-    """Analyze blood report and generate recommendations"""
-    try:
-        allergy_info = "User Allergies:\n"
-
-        if allergies_dict.get("user_mentioned"):
-            allergy_info += f"- Specific allergies: {allergies_dict['user_mentioned']}\n"
+    """
+    Analyze blood report and generate recommendations.
 
-        common_allergies = [
-            a.replace("_", " ").title()
-            for a, has_it in allergies_dict.get("common", {}).items()
-            if has_it
-        ]
+    Raises ``LLMError`` when the model is unavailable, so no error text is
+    ever saved as a recommendation.
+    """
+    allergy_info = "User Allergies:\n"
 
-        if common_allergies:
-            allergy_info += f"- Common allergies: {', '.join(common_allergies)}\n"
-        else:
-            allergy_info += "- No common allergies reported\n"
+    if allergies_dict.get("user_mentioned"):
+        allergy_info += f"- Specific allergies: {allergies_dict['user_mentioned']}\n"
 
-        prompt = f"""
-        You are a healthcare AI assistant.
-        Keep everything SHORT, SIMPLE, and POINT-WISE.
+    common_allergies = [
+        a.replace("_", " ").title()
+        for a, has_it in allergies_dict.get("common", {}).items()
+        if has_it
+    ]
 
-        BLOOD TEST REPORT:
-        {extracted_text}
+    if common_allergies:
+        allergy_info += f"- Common allergies: {', '.join(common_allergies)}\n"
+    else:
+        allergy_info += "- No common allergies reported\n"
 
-        {allergy_info}
+    prompt = f"""
+    You are a healthcare AI assistant.
+    Keep everything SHORT, SIMPLE, and POINT-WISE.
 
-        RULES:
-        - One line per point
-        - Max 10 words per line
-        - No medical diagnosis
-        - Avoid all allergens
+    BLOOD TEST REPORT:
+    {extracted_text}
 
-        SECTIONS REQUIRED:
+    {allergy_info}
 
-        1. DETAILED ANALYSIS (5–7 points)
-        2. FOODS TO EAT (12 items)
-        3. FOODS TO AVOID (12 items)
-        4. DAILY HABITS (10 items)
-        """
+    RULES:
+    - One line per point, starting with "- "
+    - Max 10 words per line
+    - No medical diagnosis
+    - Avoid all allergens
 
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt
-        )
+    SECTIONS REQUIRED:
 
-        return parse_gemini_response(response.text)
+    1. DETAILED ANALYSIS (5–7 points)
+    2. FOODS TO EAT (12 items)
+    3. FOODS TO AVOID (12 items)
+    4. DAILY HABITS (10 items, each as "Habit: description")
+    """
 
-    except Exception as e:
-        return {
-            "detailed_analysis": f"Error: {str(e)}",
-            "foods_to_eat": "",
-            "foods_to_avoid": "",
-            "daily_habits": ""
-        }
+    return parse_gemini_response(generate_text(prompt))
 
 
 def parse_gemini_response(response_text):
@@ -144,22 +130,143 @@ def parse_gemini_response(response_text):
 
 
 def get_quick_summary(extracted_text):
-    """Generate short summary of blood report"""
+    """Generate short summary of blood report; raises ``LLMError`` on failure"""
+    prompt = f"""
+    Give a 3–4 sentence summary.
+    Highlight critical abnormalities only.
+
+    REPORT:
+    {extracted_text}
+    """
+
+    return generate_text(prompt).strip()
+
+
+SECTION_NAMES = ["detailed_analysis", "foods_to_eat", "foods_to_avoid", "daily_habits"]
+
+_POINT_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
+
+# The habit tracker keys each habit by the name before the colon
+_HABIT_LIST = {
+    "type": "ARRAY",
+    "items": {"type": "STRING", "description": "Habit: description, e.g. 'Morning walk: 30 minutes daily'"},
+}
+
+REPORT_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "parameters": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "value": {"type": "NUMBER"},
+                },
+                "required": ["name", "value"],
+            },
+        },
+        "summary": {"type": "STRING"},
+        **{name: _POINT_LIST for name in SECTION_NAMES},
+        "daily_habits": _HABIT_LIST,
+    },
+    "required": ["parameters", "summary", *SECTION_NAMES],
+}
+
+
+def analyze_report_structured(extracted_text, parameter_names):
+    """
+    One JSON-mode call replacing normalize_text, get_quick_summary and the
+    allergy-independent part of analyze_blood_report.
+
+    Returns the validated result of ``parse_report_analysis``; raises
+    ``ValueError`` when the response does not match the schema.
+    """
+    prompt = f"""
+    You are a healthcare AI assistant reading a blood test report.
+    Keep everything SHORT, SIMPLE, and POINT-WISE.
+
+    1. parameters: every result found for these parameters, using exactly
+       these names: {", ".join(parameter_names)}.
+       Keep only the number (drop units and '<' or '>' signs).
+    2. summary: 3-4 sentences, highlight critical abnormalities only.
+    3. detailed_analysis: 5-7 points.
+    4. foods_to_eat: 12 items.
+    5. foods_to_avoid: 12 items.
+    6. daily_habits: 10 items, each as "Habit: description".
+
+    RULES:
+    - Max 10 words per point
+    - No medical diagnosis
+    """
+    return parse_report_analysis(
+        generate_json([prompt, extracted_text], REPORT_ANALYSIS_SCHEMA)
+    )
+
+
+ALLERGEN_SCREEN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"unsafe": {"type": "ARRAY", "items": {"type": "INTEGER"}}},
+    "required": ["unsafe"],
+}
+
+
+def find_allergen_lines(lines, allergies):
+    """
+    Indices of ``lines`` naming something that contains, or is commonly made
+    with, any of ``allergies``. For allergies the local keyword filter does
+    not know; raises ``LLMError`` when the model is unavailable and
+    ``ValueError`` on a malformed response.
+    """
+    prompt = f"""
+    The user is allergic or intolerant to: {", ".join(allergies)}.
+    Below are numbered diet and lifestyle recommendations.
+    Return in "unsafe" the number of every line that names a food, drink,
+    supplement or habit containing or commonly made with any of these,
+    including close relatives (e.g. mixed berries for strawberries).
+    When unsure, include the line.
+    """
+    numbered = "\n".join(f"{i}. {line}" for i, line in enumerate(lines))
     try:
-        prompt = f"""
-        Give a 3–4 sentence summary.
-        Highlight critical abnormalities only.
+        unsafe = json.loads(generate_json([prompt, numbered], ALLERGEN_SCREEN_SCHEMA))["unsafe"]
+        return {int(i) for i in unsafe if 0 <= int(i) < len(lines)}
+    except (TypeError, ValueError, KeyError):
+        raise ValueError("Allergen screen response is malformed")
 
-        REPORT:
-        {extracted_text}
-        """
 
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt
-        )
+def parse_report_analysis(response_text):
+    """
+    Validate a ``REPORT_ANALYSIS_SCHEMA`` response.
 
-        return response.text
+    Returns ``{"parameters": {name: float}, "summary": str, <section>: str}``
+    with sections as "- point" lines, the format ``parse_gemini_response``
+    produces and the PDF, habit tracker and templates read.
+    """
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError):
+        raise ValueError("Analysis response is not valid JSON")
+    if not isinstance(data, dict):
+        raise ValueError("Analysis response is not a JSON object")
+
+    summary = data.get("summary")
+    if not isinstance(summary, str) or not summary.strip():
+        raise ValueError("Analysis response has no summary")
+
+    parameters = {}
+    for item in data.get("parameters") or []:
+        if not isinstance(item, dict) or not isinstance(item.get("name"), str):
+            continue
+        try:
+            parameters[item["name"].strip()] = float(item.get("value"))
+        except (TypeError, ValueError):
+            continue
 
-    except Exception as e:
-        return f"Unable to generate summary: {str(e)}"
+    result = {"parameters": parameters, "summary": summary.strip()}
+    for name in SECTION_NAMES:
+        points = data.get(name) or []
+        if isinstance(points, str):
+            points = points.splitlines()
+        points = [point.strip().lstrip("-•* ").strip() for point in points if isinstance(point, str)]
+        result[name] = "".join(f"- {point}\n" for point in points if point)
+    return result
@@ -0,0 +1,259 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .chat_service import refresh_chat_context
+from .models import BloodReport, BloodReportValue, IngestionJob
+from .gemini_service import extract_text_from_pdf, extract_text_from_image
+from .recommendation_service import ensure_analysis
+from .series_service import record_points
+from analyzer.utils.report_parser import EXTRACTOR_VERSION, ensure_summary, extract_values_from_text
+
+
+PDF_EXTENSIONS = ['pdf']
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png']
+SUPPORTED_EXTENSIONS = PDF_EXTENSIONS + IMAGE_EXTENSIONS
+
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower()
+
+
+def file_sha256(uploaded_file):
+    """Hash an uploaded file chunk by chunk without reading it into memory"""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+# Older extractors saved their errors as report text
+LEGACY_ERROR_PREFIX = "Error extracting"
+
+
+def find_cached_report(content_hash, exclude_id=None):
+    """
+    Most recent report with the same file contents parsed by the current
+    extractor from successfully extracted text
+    """
+    if not content_hash:
+        return None
+    return (
+        BloodReport.objects
+        .filter(content_hash=content_hash, extractor_version=EXTRACTOR_VERSION)
+        .exclude(id=exclude_id)
+        .exclude(extracted_text="")
+        .exclude(extracted_text__startswith=LEGACY_ERROR_PREFIX)
+        .order_by('-uploaded_at')
+        .first()
+    )
+
+
+@transaction.atomic
+def reuse_cached_extraction(blood_report, cached_report):
+    """Copy extracted text and values from an identical, already parsed report"""
+    blood_report.extracted_text = cached_report.extracted_text
+    blood_report.normalized_text = cached_report.normalized_text
+    blood_report.extractor_version = cached_report.extractor_version
+    blood_report.summary = cached_report.summary
+    blood_report.summary_version = cached_report.summary_version
+    blood_report.summary_source_hash = cached_report.summary_source_hash
+    blood_report.analysis = cached_report.analysis
+    blood_report.save(update_fields=[
+        'extracted_text', 'normalized_text', 'extractor_version',
+        'summary', 'summary_version', 'summary_source_hash', 'analysis',
+    ])
+
+    BloodReportValue.objects.filter(report=blood_report).delete()
+    copied = BloodReportValue.objects.bulk_create([
+        BloodReportValue(
+            report=blood_report,
+            parameter_id=value.parameter_id,
+            value=value.value,
+            unit=value.unit,
+            source=value.source,
+        )
+        for value in BloodReportValue.objects.filter(report=cached_report)
+    ])
+    record_points(blood_report, {value.parameter_id: (value.value, value.unit) for value in copied})
+    refresh_chat_context(blood_report.id)
+
+
+def enqueue_report(blood_report):
+    """Queue an uploaded report for background extraction"""
+    return IngestionJob.objects.create(
+        blood_report=blood_report,
+        max_attempts=settings.INGESTION_MAX_ATTEMPTS,
+    )
+
+
+def enqueue_analysis(blood_report):
+    """Queue the allergy-independent analysis so it is ready by step 3"""
+    return IngestionJob.objects.create(
+        blood_report=blood_report,
+        kind=IngestionJob.KIND_ANALYZE,
+        max_attempts=settings.INGESTION_MAX_ATTEMPTS,
+    )
+
+
+def latest_job(blood_report):
+    """Newest extraction job; the analysis prefetch does not hold up the user"""
+    return (
+        blood_report.ingestion_jobs
+        .filter(kind=IngestionJob.KIND_EXTRACT)
+        .order_by('-created_at', '-id')
+        .first()
+    )
+
+
+def is_ingesting(blood_report):
+    """True while the newest job for the report has not finished"""
+    job = latest_job(blood_report)
+    return job is not None and not job.is_finished
+
+
+def requeue_stale_jobs(stale_after=None):
+    """Hand jobs left behind by a crashed worker back to the queue"""
+    stale_after = stale_after or settings.INGESTION_STALE_AFTER
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = IngestionJob.objects.filter(
+        status__in=IngestionJob.ACTIVE_STATUSES,
+        locked_at__lt=cutoff,
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=IngestionJob.STATUS_FAILED,
+        last_error="Worker stopped responding",
+        locked_at=None,
+    )
+    requeued = stale.update(status=IngestionJob.STATUS_QUEUED, locked_at=None)
+    return requeued + failed
+
+
+def claim_next_job():
+    """
+    Atomically claim the oldest runnable job.
+
+    The conditional UPDATE makes the claim safe across several worker
+    processes without relying on row locks, which SQLite does not have.
+    """
+    now = timezone.now()
+    candidates = (
+        IngestionJob.objects
+        .filter(status=IngestionJob.STATUS_QUEUED, run_after__lte=now)
+        .order_by('run_after', 'id')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = IngestionJob.objects.filter(
+            id=job_id, status=IngestionJob.STATUS_QUEUED
+        ).update(
+            status=IngestionJob.STATUS_EXTRACTING,
+            attempts=F('attempts') + 1,
+            locked_at=now,
+            updated_at=now,
+        )
+        if claimed:
+            return IngestionJob.objects.select_related('blood_report').get(id=job_id)
+    return None
+
+
+def extract_report_text(report_file):
+    """
+    Run PDF text extraction or image OCR depending on the file type.
+    Raises ``ValueError`` when no text comes out, so the job is retried.
+    """
+    text = _extract_report_text(report_file)
+    if not text or not text.strip():
+        raise ValueError("No text could be extracted from the report")
+    return text
+
+
+def _extract_report_text(report_file):
+    extension = file_extension(report_file.name)
+    if extension in PDF_EXTENSIONS:
+        try:
+            # A local path lets extraction workers open the PDF themselves
+            return extract_text_from_pdf(report_file.path)
+        except NotImplementedError:
+            pass  # remote storage, fall back to reading the file
+
+    with report_file.open('rb') as f:
+        if extension in PDF_EXTENSIONS:
+            return extract_text_from_pdf(f)
+        if extension in IMAGE_EXTENSIONS:
+            return extract_text_from_image(f)
+    raise ValueError(f"Unsupported file format: {extension}")
+
+
+def _set_status(job, status, **fields):
+    job.status = status
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=['status', 'updated_at', *fields])
+
+
+def _handle_failure(job, error):
+    if job.attempts < job.max_attempts:
+        delay = settings.INGESTION_RETRY_DELAY * 2 ** (job.attempts - 1)
+        _set_status(
+            job,
+            IngestionJob.STATUS_QUEUED,
+            last_error=str(error),
+            locked_at=None,
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+    else:
+        _set_status(job, IngestionJob.STATUS_FAILED, last_error=str(error), locked_at=None)
+
+
+def run_analysis_job(job):
+    """Prefetch the recommendations analysis for a claimed ``analyze`` job"""
+    _set_status(job, IngestionJob.STATUS_ANALYZING)
+    try:
+        # The recommendations page may have produced it in the meantime
+        job.blood_report.refresh_from_db(fields=['analysis'])
+        ensure_analysis(job.blood_report)
+    except Exception as e:
+        _handle_failure(job, e)
+        return job
+
+    _set_status(job, IngestionJob.STATUS_DONE, last_error="", locked_at=None)
+    return job
+
+
+def run_job(job):
+    """Extract text and parse values for a claimed job"""
+    if job.kind == IngestionJob.KIND_ANALYZE:
+        return run_analysis_job(job)
+
+    blood_report = job.blood_report
+    try:
+        # An identical file may have finished parsing while this job was queued
+        cached_report = find_cached_report(blood_report.content_hash, exclude_id=blood_report.id)
+        if cached_report:
+            reuse_cached_extraction(blood_report, cached_report)
+            if not blood_report.analysis:
+                enqueue_analysis(blood_report)
+            _set_status(job, IngestionJob.STATUS_DONE, last_error="", locked_at=None)
+            return job
+
+        blood_report.extracted_text = extract_report_text(blood_report.report_file)
+        blood_report.save(update_fields=['extracted_text'])
+
+        _set_status(job, IngestionJob.STATUS_PARSING)
+        extract_values_from_text(blood_report)
+        # Covered by the consolidated analysis unless it is off or failed
+        ensure_summary(blood_report)
+        if not blood_report.analysis:
+            enqueue_analysis(blood_report)
+    except Exception as e:
+        _handle_failure(job, e)
+        return job
+
+    _set_status(job, IngestionJob.STATUS_DONE, last_error="", locked_at=None)
+    return job
@@ -0,0 +1,334 @@
+"""
+LLM backends behind the gateway.
+
+``settings.LLM_BACKEND`` is the dotted path of the class the gateway uses:
+
+  * ``GeminiBackend``: the real model through the shared genai client
+  * ``FakeBackend``: deterministic, in-process stand-in for load tests
+  * ``HTTPBackend``: the same fake served over HTTP by
+    ``manage.py run_fake_llm_server``, so the network hop is measured too
+
+A backend has an async ``generate(contents, model, config)`` returning the
+response text, an async generator ``stream(contents, model, config)``
+yielding it in chunks, ``is_retryable(error)`` telling the gateway whether
+to retry, and a ``cache_namespace`` keeping its responses apart from other
+backends' in the LLM response cache.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+
+import httpx
+from django.conf import settings
+from django.utils.module_loading import import_string
+from google.genai import errors as genai_errors
+
+from .llm_client import get_client
+
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class BackendError(Exception):
+    """An HTTP-style failure reported by a fake backend"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _is_retryable(error):
+    if isinstance(error, (BackendError, genai_errors.APIError)):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class GeminiBackend:
+    """Calls Gemini through the shared client's async API"""
+
+    # Keys stay as they were before backends were pluggable
+    cache_namespace = ""
+
+    async def generate(self, contents, model, config=None):
+        response = await get_client().aio.models.generate_content(
+            model=model, contents=contents, config=config
+        )
+        return response.text
+
+    async def stream(self, contents, model, config=None):
+        chunks = await get_client().aio.models.generate_content_stream(
+            model=model, contents=contents, config=config
+        )
+        async for chunk in chunks:
+            if chunk.text:
+                yield chunk.text
+
+    def is_retryable(self, error):
+        return _is_retryable(error)
+
+
+FOODS_TO_EAT = [
+    "Spinach and leafy greens", "Lentils and beans", "Oats for breakfast",
+    "Fresh citrus fruits", "Greek yogurt", "Brown rice", "Sweet potatoes",
+    "Broccoli", "Pumpkin seeds", "Beetroot", "Bananas", "Chickpeas",
+    "Quinoa", "Berries", "Tofu", "Carrots",
+]
+FOODS_TO_AVOID = [
+    "Sugary soft drinks", "Deep-fried snacks", "Processed meats",
+    "Excess salt", "White bread", "Packaged sweets", "Energy drinks",
+    "Alcohol", "Instant noodles", "Margarine", "Fast food burgers",
+    "Excess caffeine", "Pastries", "Chips",
+]
+DAILY_HABITS = [
+    "Hydration: drink 8 glasses of water", "Walking: 30 minutes daily", "Sleep: 7 to 8 hours",
+    "Breakfast: within an hour of waking", "Stairs: take them instead of lifts",
+    "Stretching: 10 minutes a day", "Screen curfew: none in the hour before bed",
+    "Fruit: one with every meal", "Breathing: 5 minutes of deep breaths",
+    "No late snacks: stop eating after dinner", "Outdoors: some daylight every day",
+    "Regular meals: keep the same meal times",
+]
+
+
+class FakeLLM:
+    """
+    Deterministic responses shaped like the real model's for every prompt the
+    app sends, plus simulated latency, errors and throttling.
+
+    Response text depends only on the prompt; latency and faults come from a
+    seeded generator so a run is reproducible.
+    """
+
+    def __init__(self, latency=None, error_rate=None, throttle_rate=None, seed=None):
+        self.latency = settings.LLM_FAKE_LATENCY if latency is None else latency
+        self.error_rate = settings.LLM_FAKE_ERROR_RATE if error_rate is None else error_rate
+        self.throttle_rate = settings.LLM_FAKE_THROTTLE_RATE if throttle_rate is None else throttle_rate
+        self._rng = random.Random(settings.LLM_FAKE_SEED if seed is None else seed)
+        self._lock = threading.Lock()
+
+    def next_delay(self):
+        with self._lock:
+            return self.latency * (0.5 + self._rng.random())
+
+    def next_fault(self):
+        """A BackendError to raise for this call, or None"""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            return BackendError(429, "Resource exhausted (simulated)")
+        if roll < self.throttle_rate + self.error_rate:
+            return BackendError(503, "Service unavailable (simulated)")
+        return None
+
+    def respond(self, contents, config=None):
+        parts = [contents] if isinstance(contents, str) else list(contents)
+        prompt = "\n".join(str(part) for part in parts)
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        # Report text follows the instructions, so later parts win
+        values = {}
+        for part in parts:
+            values.update(_report_values(str(part)))
+
+        if config and config.get("response_mime_type") == "application/json":
+            if "unsafe" in config.get("response_schema", {}).get("properties", {}):
+                return json.dumps({"unsafe": _allergen_lines(parts)})
+            return json.dumps(_structured_analysis(values, rng))
+        lowered = prompt.lower()
+        if "'parameter:value'" in lowered:
+            return "\n".join(f"{name}:{value:g}" for name, value in values.items())
+        if "sections required" in lowered:
+            return _sections_text(values, rng)
+        if "sentence summary" in lowered:
+            return _summary(values)
+        return _chat_answer(values, rng)
+
+
+def _report_values(text):
+    """Parameter values in the prompt, read with the local parser"""
+    from analyzer.catalog import get_catalog
+    from analyzer.utils.report_parser import clean_text, get_alias_matcher
+
+    catalog = get_catalog()
+    found = get_alias_matcher(catalog.alias_index).find_values(clean_text(text))
+    return {catalog.by_id[pid].name: value for pid, value in found.items()}
+
+
+def _allergen_lines(parts):
+    """Numbered lines of an allergen screen sharing a word stem with an allergy"""
+    prompt, numbered = str(parts[0]), str(parts[1])
+    listed = prompt.split("intolerant to:", 1)[-1].split("\n", 1)[0]
+    words = [word.strip(".").lower() for word in listed.replace(",", " ").split()]
+    stems = [word[:5] for word in words if len(word) >= 4]
+    unsafe = []
+    for line in numbered.splitlines():
+        number, _, text = line.partition(". ")
+        if number.isdigit() and any(stem in text.lower() for stem in stems):
+            unsafe.append(int(number))
+    return unsafe
+
+
+def _abnormal(values):
+    from analyzer.catalog import get_catalog
+
+    catalog = get_catalog()
+    flagged = []
+    for name, value in values.items():
+        entry = catalog.by_name.get(name)
+        status = catalog.status(entry.id, value) if entry else "Normal"
+        if status != "Normal":
+            flagged.append((name, status))
+    return flagged
+
+
+def _analysis_points(values):
+    points = [f"{name} is {status.lower()}, monitor it" for name, status in _abnormal(values)]
+    points += [f"{name} is within the normal range" for name in values][:7 - len(points)]
+    return (points or ["No results could be read from the report"])[:7]
+
+
+def _summary(values):
+    flagged = _abnormal(values)
+    if not flagged:
+        return (
+            f"{len(values)} results were read from the report. "
+            "All of them are within their reference ranges. "
+            "Keep up your current routine and recheck as advised."
+        )
+    listed = ", ".join(f"{name} ({status.lower()})" for name, status in flagged)
+    return (
+        f"{len(values)} results were read from the report. "
+        f"Values outside the reference range: {listed}. "
+        "Discuss these results with your doctor."
+    )
+
+
+def _structured_analysis(values, rng):
+    return {
+        "parameters": [{"name": name, "value": value} for name, value in values.items()],
+        "summary": _summary(values),
+        "detailed_analysis": _analysis_points(values),
+        "foods_to_eat": rng.sample(FOODS_TO_EAT, 12),
+        "foods_to_avoid": rng.sample(FOODS_TO_AVOID, 12),
+        "daily_habits": rng.sample(DAILY_HABITS, 10),
+    }
+
+
+def _sections_text(values, rng):
+    sections = [
+        ("1. DETAILED ANALYSIS", _analysis_points(values)),
+        ("2. FOODS TO EAT", rng.sample(FOODS_TO_EAT, 12)),
+        ("3. FOODS TO AVOID", rng.sample(FOODS_TO_AVOID, 12)),
+        ("4. DAILY HABITS", rng.sample(DAILY_HABITS, 10)),
+    ]
+    return "\n\n".join(
+        heading + "\n" + "\n".join(f"- {point}" for point in points)
+        for heading, points in sections
+    )
+
+
+def _chat_answer(values, rng):
+    flagged = _abnormal(values)
+    if flagged:
+        name, status = rng.choice(flagged)
+        return (
+            f"Your {name} is {status.lower()} compared to the reference range. "
+            "Diet and lifestyle can help, but please consult a doctor for advice."
+        )
+    return "Your results look within normal ranges. Please consult a doctor for medical advice."
+
+
+class FakeBackend:
+    """In-process fake; no network, no quota"""
+
+    cache_namespace = "fake"
+
+    def __init__(self, **options):
+        self.fake = FakeLLM(**options)
+
+    async def generate(self, contents, model, config=None):
+        await asyncio.sleep(self.fake.next_delay())
+        fault = self.fake.next_fault()
+        if fault:
+            raise fault
+        return await self._respond(contents, config)
+
+    async def _respond(self, contents, config):
+        # Reading the parameter catalog may hit the database, which Django
+        # does not allow on an event loop
+        return await asyncio.to_thread(self.fake.respond, contents, config)
+
+    async def stream(self, contents, model, config=None):
+        delay = self.fake.next_delay()
+        # Time to first token is a fraction of the full response time
+        await asyncio.sleep(delay * 0.2)
+        fault = self.fake.next_fault()
+        if fault:
+            raise fault
+        words = split_words(await self._respond(contents, config))
+        for word in words:
+            await asyncio.sleep(delay * 0.8 / len(words))
+            yield word
+
+    def is_retryable(self, error):
+        return _is_retryable(error)
+
+
+def split_words(text):
+    """Chunks of ``text`` that join back to it exactly, one word each"""
+    words = text.split(" ")
+    return [word + " " for word in words[:-1]] + words[-1:]
+
+
+class HTTPBackend:
+    """Client for ``manage.py run_fake_llm_server`` (or anything speaking its protocol)"""
+
+    def __init__(self, url=None):
+        self.url = (url or settings.LLM_HTTP_URL).rstrip("/")
+        self.cache_namespace = f"http:{self.url}"
+        self._client = None
+
+    def _http(self):
+        # Created lazily on the gateway's event loop, then reused for pooling
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=settings.LLM_TIMEOUT,
+                limits=httpx.Limits(max_connections=settings.LLM_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def generate(self, contents, model, config=None):
+        response = await self._http().post(
+            f"{self.url}/generate",
+            json={"model": model, "contents": contents, "config": config},
+        )
+        if response.status_code != 200:
+            raise _response_error(response)
+        return response.json()["text"]
+
+    async def stream(self, contents, model, config=None):
+        request = {"model": model, "contents": contents, "config": config, "stream": True}
+        async with self._http().stream("POST", f"{self.url}/generate", json=request) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise _response_error(response)
+            # One JSON object per line, each holding the next chunk
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)["text"]
+
+    def is_retryable(self, error):
+        return _is_retryable(error)
+
+
+def _response_error(response):
+    try:
+        message = response.json().get("error", "")
+    except ValueError:
+        message = response.text
+    return BackendError(response.status_code, message)
+
+
+def get_backend():
+    """Instance of the backend class named by ``settings.LLM_BACKEND``"""
+    return import_string(settings.LLM_BACKEND)()
@@ -0,0 +1,219 @@
+"""
+Persistent cache of LLM responses.
+
+Gemini calls take seconds and cost money, yet the same prompt is sent again
+on every reload of the allergy page, on retries and for re-uploaded reports.
+Responses are stored in a local SQLite file keyed by backend, model name
+and a hash of the whitespace-normalized prompt, so identical requests from
+any process become a local lookup, and fake backends never answer for the
+real model.
+
+Entries expire after ``LLM_CACHE_TTL`` seconds; when the stored responses
+exceed ``LLM_CACHE_MAX_BYTES`` the least recently used ones are evicted.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from . import llm_gateway
+from .llm_gateway import LLMError
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Recompute the stored size and evict at most once per this many writes
+EVICTION_CHECK_EVERY = 20
+
+# Expired entries are kept this many TTLs as a fallback for LLM outages
+STALE_KEEP_FACTOR = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+"""
+
+
+def normalize_prompt(contents):
+    """Collapse whitespace so indentation changes in prompt templates still hit"""
+    if isinstance(contents, str):
+        contents = [contents]
+    return "\x1e".join(_WHITESPACE.sub(" ", str(part)).strip() for part in contents)
+
+
+def cache_key(model, contents):
+    digest = hashlib.sha256(normalize_prompt(contents).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+class LLMCache:
+    """SQLite-backed response cache with TTL and an LRU size budget"""
+
+    def __init__(self, path, ttl, max_bytes):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads or forked processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, model, contents, stale=False):
+        """
+        Cached response text, or None on a miss.
+
+        Expired entries count as misses unless ``stale`` is set; they are
+        kept for a while (``STALE_KEEP_FACTOR``) so they can still serve as
+        a fallback while the LLM is unavailable.
+        """
+        key = cache_key(model, contents)
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None or (now - row[1] > self.ttl and not stale):
+            self._count(hit=False)
+            return None
+
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count(hit=True)
+        return row[0]
+
+    def set(self, model, contents, response):
+        key = cache_key(model, contents)
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, str(model), response, len(response.encode("utf-8")), now, now),
+        )
+
+        with self._lock:
+            self._writes += 1
+            check = self._writes % EVICTION_CHECK_EVERY == 1
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Drop long-expired entries, then the least recently used ones over the size budget"""
+        conn = self._connection()
+        cutoff = time.time() - self.ttl * STALE_KEEP_FACTOR
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        excess, stale_keys = total - self.max_bytes, []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            stale_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+        return len(stale_keys)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM responses")
+
+    def stats(self):
+        """Hit/miss counters of this process plus the size of the shared store"""
+        entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Process-wide cache instance, or None when caching is disabled"""
+    global _cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache(
+                    settings.LLM_CACHE_PATH,
+                    ttl=settings.LLM_CACHE_TTL,
+                    max_bytes=settings.LLM_CACHE_MAX_BYTES,
+                )
+    return _cache
+
+
+def cached_generate(model, contents, generate):
+    """
+    Return the cached response for ``(model, contents)`` from the gateway's
+    current backend or call ``generate()``.
+
+    Only successful responses are stored. When ``generate`` raises
+    ``LLMError`` an expired entry is served if one is left, otherwise the
+    error propagates.
+    """
+    cache = get_llm_cache()
+    # Backends without a namespace are not cached at all
+    namespace = getattr(llm_gateway.get_gateway().backend, "cache_namespace", None)
+    if cache is None or namespace is None:
+        return generate()
+    if namespace:
+        model = f"{namespace}|{model}"
+
+    response = cache.get(model, contents)
+    if response is not None:
+        return response
+
+    try:
+        response = generate()
+    except LLMError:
+        response = cache.get(model, contents, stale=True)
+        if response is None:
+            raise
+        return response
+
+    if response:
+        cache.set(model, contents, response)
+    return response
@@ -0,0 +1,49 @@
+"""
+Shared Gemini client.
+
+A ``genai.Client`` owns an HTTP connection pool, so building one per call
+throws away TCP/TLS connections that could be reused, and building one at
+import time makes every process that imports the views read credentials
+first. Instead the client is created on first use and then shared by all
+threads of the process.
+"""
+import os
+import threading
+
+import httpx
+from django.conf import settings
+from google import genai
+from google.genai import types
+
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def _http_options():
+    limits = httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+    )
+    return types.HttpOptions(
+        timeout=int(settings.LLM_TIMEOUT * 1000),  # milliseconds
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+    )
+
+
+def get_client():
+    """The process-wide Gemini client, created on first use"""
+    global _client, _client_pid
+    pid = os.getpid()
+    # A forked worker must not reuse its parent's open connections
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = genai.Client(
+                    api_key=settings.GEMINI_API_KEY,
+                    http_options=_http_options(),
+                )
+                _client_pid = pid
+    return _client
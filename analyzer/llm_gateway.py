@@ -0,0 +1,364 @@
+"""
+Async gateway in front of every LLM call.
+
+A slow or failing Gemini used to block each Django worker inside
+``generate_content`` and turn errors into "Error: ..." strings that were
+saved as recommendations. All calls now go through one gateway per process
+that runs on its own event loop thread and applies, in order:
+
+    circuit breaker -> token bucket -> concurrency semaphore -> call with
+    deadline -> jittered exponential backoff on retryable errors
+
+Failures surface as ``LLMError`` so callers can serve cached or degraded
+results instead of persisting error text. The backend comes from
+``settings.LLM_BACKEND`` (see ``analyzer.llm_backends``), so the gateway
+can be exercised against a local fake.
+"""
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .llm_backends import get_backend
+
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """An LLM call failed after retries, timed out or was refused"""
+
+
+class LLMTimeoutError(LLMError):
+    pass
+
+
+class CircuitOpenError(LLMError):
+    """The backend failed repeatedly; calls fail fast until the cooldown ends"""
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average with bursts up to ``capacity``"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Opens after ``threshold`` consecutive failures and rejects calls for
+    ``cooldown`` seconds; then lets a single probe through (half-open) and
+    closes again if it succeeds. A probe that ends without a verdict, e.g.
+    cancelled when a client disconnects, must call ``release_probe``.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def before_call(self):
+        """Raise ``CircuitOpenError``, or return True if this call is the probe"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError("LLM backend is unavailable, try again shortly")
+            self.state = self.HALF_OPEN
+            return True
+        if self.state == self.HALF_OPEN:
+            # A probe is already in flight
+            raise CircuitOpenError("LLM backend is unavailable, try again shortly")
+        return False
+
+    def release_probe(self):
+        """The probe ended without a result; let the next call probe instead"""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic() - self.cooldown
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logger.warning("LLM circuit opened after %d failure(s)", self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LLMGateway:
+    def __init__(self, backend, max_concurrency, rate, burst, max_retries,
+                 backoff_base, backoff_max, timeout, deadline, breaker):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.deadline = deadline
+        self.breaker = breaker
+        self._rate = rate
+        self._burst = burst
+        self._max_concurrency = max_concurrency
+        # Created on first use so they bind to the loop the gateway runs on
+        self._semaphore = None
+        self._bucket = None
+
+    def _limits(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._bucket = TokenBucket(self._rate, self._burst)
+        return self._semaphore, self._bucket
+
+    def _backoff(self, attempt):
+        # Full jitter keeps retries from many workers from arriving in waves
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def generate(self, contents, model=None, config=None, deadline=None):
+        """Response text for ``contents``; raises ``LLMError`` on failure"""
+        model = model or settings.MODEL_NAME
+        semaphore, bucket = self._limits()
+        give_up_at = time.monotonic() + (deadline or self.deadline)
+
+        attempt = 0
+        probe = False
+        try:
+            while True:
+                probe = self.breaker.before_call()
+                try:
+                    # Waiting for a token must not hold one of the concurrency slots
+                    await bucket.acquire()
+                    async with semaphore:
+                        remaining = give_up_at - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        text = await asyncio.wait_for(
+                            self.backend.generate(contents, model, config),
+                            timeout=min(self.timeout, remaining),
+                        )
+                except Exception as e:
+                    await self._retry_or_raise(e, attempt, give_up_at, deadline)
+                    attempt += 1
+                    continue
+
+                self.breaker.record_success()
+                return text
+        finally:
+            # Cancellation is a BaseException and skips the handlers above
+            if probe:
+                self.breaker.release_probe()
+
+    async def stream(self, contents, model=None, config=None, deadline=None):
+        """
+        Yield the response in chunks as the backend produces them.
+
+        Failures before the first chunk are retried like ``generate``; once
+        text has been yielded an error ends the stream with ``LLMError``.
+        """
+        model = model or settings.MODEL_NAME
+        semaphore, bucket = self._limits()
+        give_up_at = time.monotonic() + (deadline or self.deadline)
+
+        attempt = 0
+        probe = False
+        try:
+            while True:
+                probe = self.breaker.before_call()
+                started = False
+                try:
+                    await bucket.acquire()
+                    async with semaphore:
+                        chunks = self.backend.stream(contents, model, config).__aiter__()
+                        while True:
+                            remaining = give_up_at - time.monotonic()
+                            if remaining <= 0:
+                                raise asyncio.TimeoutError()
+                            try:
+                                chunk = await asyncio.wait_for(
+                                    chunks.__anext__(), timeout=min(self.timeout, remaining)
+                                )
+                            except StopAsyncIteration:
+                                break
+                            started = True
+                            yield chunk
+                except Exception as e:
+                    if started:
+                        if self.backend.is_retryable(e):
+                            self.breaker.record_failure()
+                        raise LLMError(f"Response stream broke off: {e}") from e
+                    await self._retry_or_raise(e, attempt, give_up_at, deadline)
+                    attempt += 1
+                    continue
+
+                self.breaker.record_success()
+                return
+        finally:
+            # Cancelled or closed early by the consumer
+            if probe:
+                self.breaker.release_probe()
+
+    async def _retry_or_raise(self, error, attempt, give_up_at, deadline):
+        """Sleep before the next attempt, or raise ``LLMError`` if there is none"""
+        retryable = self.backend.is_retryable(error)
+        # Only transient errors say anything about backend health
+        if retryable:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        delay = self._backoff(attempt)
+        out_of_time = time.monotonic() + delay >= give_up_at
+        if not retryable or attempt >= self.max_retries or out_of_time:
+            if isinstance(error, asyncio.TimeoutError):
+                limit = deadline or self.deadline
+                raise LLMTimeoutError(f"LLM call did not finish within {limit:g}s") from error
+            raise LLMError(str(error) or error.__class__.__name__) from error
+        logger.info("LLM call failed (%s), retry %d in %.1fs", error, attempt + 1, delay)
+        await asyncio.sleep(delay)
+
+
+def create_gateway(backend=None):
+    return LLMGateway(
+        backend=backend or get_backend(),
+        max_concurrency=settings.LLM_MAX_CONCURRENCY,
+        rate=settings.LLM_RATE_LIMIT,
+        burst=settings.LLM_RATE_BURST,
+        max_retries=settings.LLM_MAX_RETRIES,
+        backoff_base=settings.LLM_BACKOFF_BASE,
+        backoff_max=settings.LLM_BACKOFF_MAX,
+        timeout=settings.LLM_TIMEOUT,
+        deadline=settings.LLM_DEADLINE,
+        breaker=CircuitBreaker(settings.LLM_BREAKER_THRESHOLD, settings.LLM_BREAKER_COOLDOWN),
+    )
+
+
+_gateway = None
+_loop = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _start():
+    """Gateway and its event loop thread for this process"""
+    global _gateway, _loop, _pid
+    pid = os.getpid()
+    if _gateway is None or _pid != pid:
+        with _lock:
+            if _gateway is None or _pid != pid:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True).start()
+                _gateway, _loop, _pid = create_gateway(), loop, pid
+    return _gateway, _loop
+
+
+def get_gateway():
+    return _start()[0]
+
+
+def set_backend(backend):
+    """Swap the backend of the running gateway, e.g. for a fake in tests"""
+    get_gateway().backend = backend
+
+
+def generate(contents, model=None, config=None, deadline=None):
+    """Blocking call for sync code; limits are shared with every other thread"""
+    gateway, loop = _start()
+    future = asyncio.run_coroutine_threadsafe(
+        gateway.generate(contents, model, config, deadline), loop
+    )
+    return future.result()
+
+
+async def agenerate(contents, model=None, config=None, deadline=None):
+    """Awaitable call for async views running on another event loop"""
+    gateway, loop = _start()
+    future = asyncio.run_coroutine_threadsafe(
+        gateway.generate(contents, model, config, deadline), loop
+    )
+    return await asyncio.wrap_future(future)
+
+
+_DONE = object()
+
+
+async def _pump(gateway, put, contents, model, config, deadline):
+    """Run a gateway stream on its loop, handing chunks (then _DONE or an error) to ``put``"""
+    try:
+        async for chunk in gateway.stream(contents, model, config, deadline):
+            put(chunk)
+    except Exception as e:
+        put(e if isinstance(e, LLMError) else LLMError(str(e)))
+    else:
+        put(_DONE)
+
+
+def stream(contents, model=None, config=None, deadline=None):
+    """Sync generator of response chunks; raises ``LLMError`` on failure"""
+    gateway, loop = _start()
+    chunks = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        _pump(gateway, chunks.put, contents, model, config, deadline), loop
+    )
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, LLMError):
+                raise chunk
+            yield chunk
+    finally:
+        # Stops generation when the consumer goes away early
+        future.cancel()
+
+
+async def astream(contents, model=None, config=None, deadline=None):
+    """Async generator of response chunks for views running on another event loop"""
+    gateway, loop = _start()
+    caller_loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def put(chunk):
+        caller_loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+
+    future = asyncio.run_coroutine_threadsafe(
+        _pump(gateway, put, contents, model, config, deadline), loop
+    )
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, LLMError):
+                raise chunk
+            yield chunk
+    finally:
+        future.cancel()
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from analyzer.models import BloodReport
+from analyzer.utils.report_parser import ensure_summary, summary_is_current
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the stored summary for reports that have none or whose "
+        "summary is out of date (text changed or SUMMARY_VERSION bumped)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            help="Comma-separated user ids to limit the run to",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            help="Stop after generating this many summaries",
+        )
+
+    def handle(self, *args, **options):
+        reports = (
+            BloodReport.objects
+            .exclude(extracted_text="")
+            .only("id", "extracted_text", "summary", "summary_version", "summary_source_hash")
+            .order_by("id")
+        )
+        if options["users"]:
+            reports = reports.filter(user_id__in=[int(u) for u in options["users"].split(",")])
+
+        generated = current = failed = 0
+        for report in reports.iterator(chunk_size=500):
+            if summary_is_current(report):
+                current += 1
+                continue
+            if ensure_summary(report):
+                generated += 1
+            else:
+                failed += 1
+            if options["limit"] and generated >= options["limit"]:
+                break
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Summaries: {generated} generated, {current} already current, {failed} failed"
+        ))
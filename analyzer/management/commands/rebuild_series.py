@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from analyzer.series_service import rebuild_series
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-user parameter series behind the dashboard charts from stored values"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            help="Comma-separated user ids to rebuild (default: everyone)",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options["users"]:
+            user_ids = [int(u) for u in options["users"].split(",")]
+
+        started = time.monotonic()
+        written = rebuild_series(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {written} series in {time.monotonic() - started:.1f}s"
+        ))
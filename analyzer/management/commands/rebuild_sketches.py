@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from analyzer.percentile_service import rebuild_sketches
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-parameter quantile sketches behind reading percentiles from stored values"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--parameters",
+            help="Comma-separated parameter ids to rebuild (default: all)",
+        )
+
+    def handle(self, *args, **options):
+        parameter_ids = None
+        if options["parameters"]:
+            parameter_ids = [int(p) for p in options["parameters"].split(",")]
+
+        started = time.monotonic()
+        written = rebuild_sketches(parameter_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {written} sketches in {time.monotonic() - started:.1f}s"
+        ))
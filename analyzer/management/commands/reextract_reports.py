@@ -0,0 +1,268 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from datetime import datetime, time as day_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from analyzer.catalog import get_catalog
+from analyzer.models import BloodReport
+from analyzer.utils.report_parser import parse_values, save_values
+
+
+DEFAULT_CHECKPOINT = "reextract_checkpoint.json"
+
+
+def _init_worker():
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+
+
+def _reextract_chunk(report_ids, parameter_ids, allow_llm):
+    """
+    Re-parse the stored text of a chunk of reports; runs inside pool workers.
+
+    Returns ``(last_id, processed, skipped, errors, found)`` where ``errors``
+    lists ``(report_id, message)`` for reports that failed and ``found``
+    counts how many reports yielded a value for each parameter.
+    """
+    catalog = get_catalog()
+    targeted = parameter_ids is not None
+    processed = skipped = 0
+    errors = []
+    found = Counter()
+
+    # user and uploaded_at are read when the series are updated
+    reports = BloodReport.objects.filter(id__in=report_ids).only(
+        "id", "user", "uploaded_at", "extracted_text", "normalized_text", "extractor_version"
+    )
+    for report in reports:
+        if not report.extracted_text:
+            skipped += 1
+            continue
+        try:
+            values, report.normalized_text = parse_values(
+                report.extracted_text, catalog, allow_llm=allow_llm
+            )
+            if targeted:
+                values = {pid: v for pid, v in values.items() if pid in parameter_ids}
+            # A partial run must not mark the report as fully re-extracted.
+            # Values the parser no longer finds were bad matches: drop them
+            save_values(
+                report, values, catalog,
+                update_report=not targeted,
+                replace=parameter_ids if targeted else True,
+            )
+        except Exception as e:
+            # Reported by the command, which owns stderr and verbosity
+            errors.append((report.id, str(e)))
+            continue
+        processed += 1
+        found.update(values.keys())
+
+    return max(report_ids), processed, skipped, errors, found
+
+
+def _reextract_task(task):
+    return _reextract_chunk(*task)
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Re-run value extraction on stored report text, in parallel and resumably"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--parameters",
+            nargs="+",
+            metavar="NAME",
+            help="Only recompute these parameters (names as in load_parameters)",
+        )
+        parser.add_argument(
+            "--users",
+            nargs="+",
+            metavar="USERNAME",
+            help="Only reports uploaded by these users",
+        )
+        parser.add_argument("--since", help="Only reports uploaded on or after YYYY-MM-DD")
+        parser.add_argument("--until", help="Only reports uploaded on or before YYYY-MM-DD")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes (1 runs in-process)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=200,
+            help="Reports per task handed to a worker",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=DEFAULT_CHECKPOINT,
+            help="File recording the last finished report id",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore an existing checkpoint and start from the first report",
+        )
+        parser.add_argument(
+            "--no-llm",
+            action="store_true",
+            help="Never escalate to LLM normalization, use the local parser only",
+        )
+
+    def _report_filter(self, options):
+        reports = BloodReport.objects.all()
+        if options["users"]:
+            reports = reports.filter(user__username__in=options["users"])
+        if options["since"]:
+            since = datetime.combine(_parse_date(options["since"]), day_time.min)
+            reports = reports.filter(uploaded_at__gte=timezone.make_aware(since))
+        if options["until"]:
+            until = datetime.combine(_parse_date(options["until"]), day_time.max)
+            reports = reports.filter(uploaded_at__lte=timezone.make_aware(until))
+        return reports
+
+    def _target_parameters(self, catalog, names):
+        if not names:
+            return None
+        unknown = [name for name in names if name not in catalog.by_name]
+        if unknown:
+            raise CommandError(f"Unknown parameters: {', '.join(unknown)}")
+        return frozenset(catalog.by_name[name].id for name in names)
+
+    def _run_filters(self, options):
+        """Options that decide which reports and values a run covers"""
+        return {
+            "parameters": sorted(options["parameters"] or []),
+            "users": sorted(options["users"] or []),
+            "since": options["since"],
+            "until": options["until"],
+        }
+
+    def _load_checkpoint(self, path, restart, filters):
+        if restart or not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            checkpoint = json.load(f)
+        # Resuming with other filters would skip their reports below last_id
+        if checkpoint.get("filters") != filters:
+            raise CommandError(
+                f"{path} was written by a run with different filters "
+                f"({json.dumps(checkpoint.get('filters'))}); rerun with the same "
+                "--parameters/--users/--since/--until, or pass --restart"
+            )
+        return checkpoint.get("last_id", 0)
+
+    def _save_checkpoint(self, path, last_id, filters):
+        # Write-then-rename so a crash never leaves a truncated checkpoint
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"last_id": last_id, "filters": filters, "updated_at": timezone.now().isoformat()}, f)
+        os.replace(tmp_path, path)
+
+    def _iter_chunks(self, reports, start_after, chunk_size):
+        """Keyset-paginate report ids so the whole table is never loaded at once"""
+        last_id = start_after
+        while True:
+            ids = list(
+                reports.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
+    def handle(self, *args, **options):
+        catalog = get_catalog()
+        if not len(catalog):
+            raise CommandError("No blood parameters found, run load_parameters first.")
+
+        parameter_ids = self._target_parameters(catalog, options["parameters"])
+        allow_llm = not options["no_llm"]
+        reports = self._report_filter(options)
+        checkpoint = options["checkpoint"]
+        filters = self._run_filters(options)
+
+        start_after = self._load_checkpoint(checkpoint, options["restart"], filters)
+        total = reports.filter(id__gt=start_after).count()
+        if start_after:
+            self.stdout.write(f"Resuming after report {start_after}.")
+        self.stdout.write(f"{total} report(s) to re-extract with {options['workers']} worker(s).")
+        if not total:
+            return
+
+        tasks = (
+            (ids, parameter_ids, allow_llm)
+            for ids in self._iter_chunks(reports, start_after, options["chunk_size"])
+        )
+
+        processed = skipped = failed = 0
+        found = Counter()
+        started = time.monotonic()
+        pool = None
+        if options["workers"] > 1:
+            # Workers open their own connections on first use
+            connections.close_all()
+            pool = multiprocessing.Pool(options["workers"], initializer=_init_worker)
+            results = pool.imap(_reextract_task, tasks)
+        else:
+            results = (_reextract_chunk(*task) for task in tasks)
+
+        try:
+            # imap yields in submission order, so the checkpoint only ever
+            # covers ids whose chunks (and every chunk before them) finished
+            for last_id, done, skip, errors, chunk_found in results:
+                processed += done
+                skipped += skip
+                failed += len(errors)
+                found.update(chunk_found)
+                for report_id, error in errors:
+                    self.stderr.write(f"Report {report_id}: {error}")
+                self._save_checkpoint(checkpoint, last_id, filters)
+
+                elapsed = max(time.monotonic() - started, 1e-9)
+                seen = processed + skipped + failed
+                self.stdout.write(
+                    f"{seen}/{total} reports ({seen / elapsed:.1f} reports/s)"
+                )
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted, rerun to resume from the checkpoint.")
+            return
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(
+            f"Re-extracted {processed} report(s) in {elapsed:.1f}s "
+            f"({processed / elapsed:.1f} reports/s), {skipped} without text, {failed} failed."
+        )
+
+        if processed:
+            self.stdout.write("Miss rate per parameter:")
+            for param in catalog:
+                if parameter_ids is not None and param.id not in parameter_ids:
+                    continue
+                miss_rate = 1 - found[param.id] / processed
+                self.stdout.write(f"  {param.name:<15} {miss_rate:6.1%}")
+
+        # The run is complete; the next one starts from scratch
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
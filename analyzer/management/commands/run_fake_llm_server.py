@@ -0,0 +1,119 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from analyzer.llm_backends import FakeLLM, split_words
+
+
+def make_handler(fake, quiet):
+    class FakeLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != "/generate":
+                self._send(404, {"error": "Not found"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length))
+                contents = request["contents"]
+            except (ValueError, KeyError):
+                self._send(400, {"error": "Expected JSON with 'contents'"})
+                return
+
+            delay = fake.next_delay()
+            streaming = request.get("stream", False)
+            time.sleep(delay * 0.2 if streaming else delay)
+            fault = fake.next_fault()
+            if fault:
+                self._send(fault.code, {"error": str(fault)})
+                return
+
+            text = fake.respond(contents, request.get("config"))
+            if streaming:
+                self._stream(split_words(text), delay * 0.8)
+            else:
+                self._send(200, {"text": text})
+
+        def _stream(self, chunks, duration):
+            """Chunked response with one JSON line per chunk"""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in chunks:
+                time.sleep(duration / len(chunks))
+                line = (json.dumps({"text": chunk}) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, format, *args):
+            if not quiet:
+                super().log_message(format, *args)
+
+    return FakeLLMHandler
+
+
+class Command(BaseCommand):
+    help = "Serve the fake LLM over HTTP for offline load tests (use with LLM_BACKEND=HTTPBackend)"
+
+    def add_arguments(self, parser):
+        default_url = urlparse(settings.LLM_HTTP_URL)
+        parser.add_argument("--host", default=default_url.hostname or "127.0.0.1")
+        parser.add_argument("--port", type=int, default=default_url.port or 8765)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=settings.LLM_FAKE_LATENCY,
+            help="Mean response time in seconds",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=settings.LLM_FAKE_ERROR_RATE,
+            help="Share of requests answered with 503",
+        )
+        parser.add_argument(
+            "--throttle-rate",
+            type=float,
+            default=settings.LLM_FAKE_THROTTLE_RATE,
+            help="Share of requests answered with 429",
+        )
+        parser.add_argument("--seed", type=int, default=settings.LLM_FAKE_SEED)
+        parser.add_argument("--quiet", action="store_true", help="Do not log each request")
+
+    def handle(self, *args, **options):
+        fake = FakeLLM(
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            throttle_rate=options["throttle_rate"],
+            seed=options["seed"],
+        )
+        server = ThreadingHTTPServer(
+            (options["host"], options["port"]), make_handler(fake, options["quiet"])
+        )
+        self.stdout.write(
+            f"Fake LLM listening on http://{options['host']}:{options['port']} "
+            f"(latency {options['latency']}s, errors {options['error_rate']:.0%}, "
+            f"throttled {options['throttle_rate']:.0%})"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write("Fake LLM stopped.")
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from analyzer.ingestion_service import claim_next_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Process queued blood report ingestion jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Ingestion worker started.")
+        try:
+            while True:
+                close_old_connections()
+                requeue_stale_jobs()
+
+                job = claim_next_job()
+                if job is None:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                started = time.monotonic()
+                run_job(job)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"[{job.status.upper()}] Report {job.blood_report_id} "
+                    f"(attempt {job.attempts}, {elapsed:.1f}s)"
+                )
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write("Ingestion worker stopped.")
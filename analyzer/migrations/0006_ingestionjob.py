@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0005_chatmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('extracting', 'Extracting text'), ('parsing', 'Parsing values'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=12)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('last_error', models.TextField(blank=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text='Earliest time a worker may pick this job up')),
+                ('locked_at', models.DateTimeField(blank=True, help_text='When a worker claimed this job', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('blood_report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_jobs', to='analyzer.bloodreport')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='analyzer_in_status_9181e9_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0006_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloodreport',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of the uploaded file', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='bloodreport',
+            name='extractor_version',
+            field=models.PositiveIntegerField(blank=True, help_text='Parser version that produced the values', null=True),
+        ),
+        migrations.AddField(
+            model_name='bloodreport',
+            name='normalized_text',
+            field=models.TextField(blank=True, help_text='Parser input after normalization'),
+        ),
+    ]
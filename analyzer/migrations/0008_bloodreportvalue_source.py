@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0007_bloodreport_extraction_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloodreportvalue',
+            name='source',
+            field=models.CharField(choices=[('local', 'Local parser'), ('llm', 'LLM normalization')], default='llm', help_text='Extraction tier that produced this value', max_length=10),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:41
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_values(apps, schema_editor):
+    """Keep only the newest value per (report, parameter) before adding the constraint"""
+    BloodReportValue = apps.get_model('analyzer', 'BloodReportValue')
+    duplicates = (
+        BloodReportValue.objects
+        .values('report_id', 'parameter_id')
+        .annotate(count=Count('id'), keep_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        BloodReportValue.objects.filter(
+            report_id=row['report_id'],
+            parameter_id=row['parameter_id'],
+        ).exclude(id=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0008_bloodreportvalue_source'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_values, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bloodreportvalue',
+            constraint=models.UniqueConstraint(fields=('report', 'parameter'), name='unique_report_parameter'),
+        ),
+    ]
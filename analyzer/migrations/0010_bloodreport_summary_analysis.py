@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0009_bloodreportvalue_unique_report_parameter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloodreport',
+            name='analysis',
+            field=models.JSONField(blank=True, default=dict, help_text='Allergy-independent LLM analysis sections'),
+        ),
+        migrations.AddField(
+            model_name='bloodreport',
+            name='summary',
+            field=models.TextField(blank=True, help_text='Short LLM summary produced at ingestion'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0010_bloodreport_summary_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='chatmessage',
+            options={'ordering': ['created_at', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['blood_report', 'created_at', 'id'], name='analyzer_ch_blood_r_adb13e_idx'),
+        ),
+        migrations.AddField(
+            model_name='chatsummary',
+            name='blood_report',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='chat_summary', to='analyzer.bloodreport'),
+        ),
+        migrations.AddField(
+            model_name='chatsummary',
+            name='summarized_until',
+            field=models.ForeignKey(blank=True, help_text='Newest message folded into the summary', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='analyzer.chatmessage'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:56
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def stamp_existing_summaries(apps, schema_editor):
+    """Summaries stored so far came from the report's current text with prompt version 1"""
+    BloodReport = apps.get_model('analyzer', 'BloodReport')
+    for report in BloodReport.objects.exclude(summary='').only('id', 'extracted_text'):
+        BloodReport.objects.filter(id=report.id).update(
+            summary_version=1,
+            summary_source_hash=hashlib.sha256(report.extracted_text.encode('utf-8')).hexdigest(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0011_chat_memory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloodreport',
+            name='summary_source_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the extracted text the summary was made from', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='bloodreport',
+            name='summary_version',
+            field=models.PositiveIntegerField(blank=True, help_text='Summary prompt version that produced the summary', null=True),
+        ),
+        migrations.RunPython(stamp_existing_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0012_bloodreport_summary_stamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='kind',
+            field=models.CharField(choices=[('extract', 'Extract text and values'), ('analyze', 'Prefetch recommendations analysis')], default='extract', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='ingestionjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('extracting', 'Extracting text'), ('parsing', 'Parsing values'), ('analyzing', 'Analyzing report'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=12),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:00
+
+from array import array
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_series(apps, schema_editor):
+    """Same result as series_service.rebuild_series, with the historical models"""
+    BloodReportValue = apps.get_model('analyzer', 'BloodReportValue')
+    ParameterSeries = apps.get_model('analyzer', 'ParameterSeries')
+    rows = (
+        BloodReportValue.objects
+        .filter(report__user__isnull=False)
+        .order_by('report__user_id', 'parameter_id', 'report__uploaded_at', 'report_id')
+        .values_list('report__user_id', 'parameter_id', 'report_id', 'report__uploaded_at', 'value', 'unit')
+        .iterator(chunk_size=2000)
+    )
+    series = {}
+    for user_id, parameter_id, report_id, uploaded_at, value, unit in rows:
+        report_ids, timestamps, values, _ = series.get((user_id, parameter_id), (array('q'), array('d'), array('d'), unit))
+        report_ids.append(report_id)
+        timestamps.append(uploaded_at.timestamp())
+        values.append(value)
+        series[user_id, parameter_id] = (report_ids, timestamps, values, unit)
+    ParameterSeries.objects.bulk_create([
+        ParameterSeries(
+            user_id=user_id,
+            parameter_id=parameter_id,
+            unit=unit,
+            report_ids=report_ids.tobytes(),
+            timestamps=timestamps.tobytes(),
+            values=values.tobytes(),
+        )
+        for (user_id, parameter_id), (report_ids, timestamps, values, unit) in series.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('analyzer', '0013_ingestionjob_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit', models.CharField(blank=True, max_length=20)),
+                ('report_ids', models.BinaryField(default=bytes, help_text="array('q') of report ids")),
+                ('timestamps', models.BinaryField(default=bytes, help_text="array('d') of upload times, Unix seconds")),
+                ('values', models.BinaryField(default=bytes, help_text="array('d') of readings")),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('parameter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='analyzer.bloodparameter')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameter_series', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='parameterseries',
+            constraint=models.UniqueConstraint(fields=('user', 'parameter'), name='unique_user_parameter_series'),
+        ),
+        migrations.RunPython(build_series, migrations.RunPython.noop),
+    ]
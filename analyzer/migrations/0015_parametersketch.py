@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from analyzer.utils.quantile_sketch import KLLSketch
+
+
+def build_sketches(apps, schema_editor):
+    """Same result as percentile_service.rebuild_sketches, with the historical models"""
+    BloodReportValue = apps.get_model('analyzer', 'BloodReportValue')
+    ParameterSketch = apps.get_model('analyzer', 'ParameterSketch')
+    rows = (
+        BloodReportValue.objects
+        .filter(report__user__isnull=False)
+        .values_list('parameter_id', 'value')
+        .iterator(chunk_size=5000)
+    )
+    sketches = {}
+    for parameter_id, value in rows:
+        if parameter_id not in sketches:
+            sketches[parameter_id] = KLLSketch(settings.QUANTILE_SKETCH_K)
+        sketches[parameter_id].update(value)
+    ParameterSketch.objects.bulk_create([
+        ParameterSketch(parameter_id=parameter_id, sketch=sketch.to_bytes(), count=sketch.count)
+        for parameter_id, sketch in sketches.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0014_parameterseries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sketch', models.BinaryField(default=bytes, help_text='Serialized utils.quantile_sketch.KLLSketch')),
+                ('count', models.PositiveBigIntegerField(default=0, help_text='Readings summarized')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('parameter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sketch', to='analyzer.bloodparameter')),
+            ],
+        ),
+        migrations.RunPython(build_sketches, migrations.RunPython.noop),
+    ]
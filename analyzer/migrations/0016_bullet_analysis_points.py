@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:20
+
+from django.db import migrations
+
+
+SECTIONS = ['detailed_analysis', 'foods_to_eat', 'foods_to_avoid', 'daily_habits']
+
+
+def as_bullets(text):
+    """Prefix each point with "- " when none of them has a bullet yet"""
+    lines = [line.strip() for line in (text or '').splitlines() if line.strip()]
+    if not lines or any(line.startswith('-') for line in lines):
+        return text
+    return ''.join(f'- {line}\n' for line in lines)
+
+
+def bullet_stored_points(apps, schema_editor):
+    """
+    Sections saved by the structured analysis had bare points, which the
+    PDF, habit tracker and templates skip
+    """
+    BloodReport = apps.get_model('analyzer', 'BloodReport')
+    HealthRecommendation = apps.get_model('analyzer', 'HealthRecommendation')
+
+    for report in BloodReport.objects.exclude(analysis={}).only('id', 'analysis').iterator(chunk_size=500):
+        analysis = {
+            name: as_bullets(text) if name in SECTIONS else text
+            for name, text in report.analysis.items()
+        }
+        if analysis != report.analysis:
+            report.analysis = analysis
+            report.save(update_fields=['analysis'])
+
+    for recommendation in HealthRecommendation.objects.iterator(chunk_size=500):
+        changed = [name for name in SECTIONS if as_bullets(getattr(recommendation, name)) != getattr(recommendation, name)]
+        for name in changed:
+            setattr(recommendation, name, as_bullets(getattr(recommendation, name)))
+        if changed:
+            recommendation.save(update_fields=changed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0015_parametersketch'),
+    ]
+
+    operations = [
+        migrations.RunPython(bullet_stored_points, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0016_bullet_analysis_points'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parameterseries',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped on every write, for optimistic locking'),
+        ),
+    ]
@@ -8,6 +8,13 @@ class BloodReport(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     report_file = models.FileField(upload_to='blood_reports/')
     extracted_text = models.TextField(blank=True)
+    normalized_text = models.TextField(blank=True, help_text="Parser input after normalization")
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text="SHA-256 of the uploaded file")
+    extractor_version = models.PositiveIntegerField(null=True, blank=True, help_text="Parser version that produced the values")
+    summary = models.TextField(blank=True, help_text="Short LLM summary produced at ingestion")
+    summary_version = models.PositiveIntegerField(null=True, blank=True, help_text="Summary prompt version that produced the summary")
+    summary_source_hash = models.CharField(max_length=64, blank=True, help_text="SHA-256 of the extracted text the summary was made from")
+    analysis = models.JSONField(default=dict, blank=True, help_text="Allergy-independent LLM analysis sections")
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
@@ -40,10 +47,28 @@ class BloodParameter(models.Model):
         return self.name
 
 class BloodReportValue(models.Model):
+    SOURCE_LOCAL = "local"
+    SOURCE_LLM = "llm"
+    SOURCE_CHOICES = [
+        (SOURCE_LOCAL, "Local parser"),
+        (SOURCE_LLM, "LLM normalization"),
+    ]
+
     report = models.ForeignKey(BloodReport, on_delete=models.CASCADE)
     parameter = models.ForeignKey(BloodParameter, on_delete=models.CASCADE)
     value = models.FloatField()
     unit = models.CharField(max_length=20, blank=True)
+    source = models.CharField(
+        max_length=10,
+        choices=SOURCE_CHOICES,
+        default=SOURCE_LLM,
+        help_text="Extraction tier that produced this value"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['report', 'parameter'], name='unique_report_parameter'),
+        ]
 
     def __str__(self):
         return f"{self.parameter.name}: {self.value}"
@@ -111,4 +136,104 @@ class ChatMessage(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ['created_at']
\ No newline at end of file
+        ordering = ['created_at', 'id']
+        # Keyset pagination and "last N turns" both walk this index
+        indexes = [models.Index(fields=['blood_report', 'created_at', 'id'])]
+
+
+class ParameterSeries(models.Model):
+    """
+    One user's readings of one parameter as packed arrays, in upload order.
+    Maintained by series_service; rebuild with ``manage.py rebuild_series``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='parameter_series')
+    parameter = models.ForeignKey(BloodParameter, on_delete=models.CASCADE)
+    unit = models.CharField(max_length=20, blank=True)
+    report_ids = models.BinaryField(default=bytes, help_text="array('q') of report ids")
+    timestamps = models.BinaryField(default=bytes, help_text="array('d') of upload times, Unix seconds")
+    values = models.BinaryField(default=bytes, help_text="array('d') of readings")
+    version = models.PositiveIntegerField(default=0, help_text="Bumped on every write, for optimistic locking")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'parameter'], name='unique_user_parameter_series'),
+        ]
+
+    def __str__(self):
+        return f"{self.parameter_id} series for user {self.user_id}"
+
+
+class ParameterSketch(models.Model):
+    """
+    KLL quantile sketch of every user reading of one parameter.
+    Maintained by percentile_service; rebuild with ``manage.py rebuild_sketches``.
+    """
+    parameter = models.OneToOneField(BloodParameter, on_delete=models.CASCADE, related_name='sketch')
+    sketch = models.BinaryField(default=bytes, help_text="Serialized utils.quantile_sketch.KLLSketch")
+    count = models.PositiveBigIntegerField(default=0, help_text="Readings summarized")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.parameter_id} sketch of {self.count} readings"
+
+
+class ChatSummary(models.Model):
+    """Rolling summary of chat turns that no longer fit in the prompt window"""
+    blood_report = models.OneToOneField(BloodReport, on_delete=models.CASCADE, related_name='chat_summary')
+    summary = models.TextField(blank=True)
+    summarized_until = models.ForeignKey(
+        ChatMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        help_text="Newest message folded into the summary"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Chat summary for Report {self.blood_report_id}"
+
+class IngestionJob(models.Model):
+    """Background work for an uploaded report: extraction, then the analysis prefetch"""
+    KIND_EXTRACT = "extract"
+    KIND_ANALYZE = "analyze"
+    KIND_CHOICES = [
+        (KIND_EXTRACT, "Extract text and values"),
+        (KIND_ANALYZE, "Prefetch recommendations analysis"),
+    ]
+
+    STATUS_QUEUED = "queued"
+    STATUS_EXTRACTING = "extracting"
+    STATUS_PARSING = "parsing"
+    STATUS_ANALYZING = "analyzing"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_EXTRACTING, "Extracting text"),
+        (STATUS_PARSING, "Parsing values"),
+        (STATUS_ANALYZING, "Analyzing report"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    ]
+    ACTIVE_STATUSES = [STATUS_EXTRACTING, STATUS_PARSING, STATUS_ANALYZING]
+
+    blood_report = models.ForeignKey(BloodReport, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=KIND_EXTRACT)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Earliest time a worker may pick this job up")
+    locked_at = models.DateTimeField(null=True, blank=True, help_text="When a worker claimed this job")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    def __str__(self):
+        return f"Job {self.id} for Report {self.blood_report_id} ({self.status})"
@@ -0,0 +1,158 @@
+"""
+OCR worker pool.
+
+Keeping Tesseract loaded requires ``tesserocr``: each worker then holds a
+warm ``PyTessBaseAPI`` (language data stays in memory) for its whole life.
+Without it workers fall back to ``pytesseract``, which starts a tesseract
+process per image, so the pool only adds parallelism. The pool logs which
+backend it uses when it starts.
+"""
+import io
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytesseract
+from PIL import Image
+from django.conf import settings
+
+from analyzer.utils.image_preprocess import preprocess_for_ocr
+
+try:
+    import tesserocr
+except ImportError:  # optional, see requirements.txt
+    tesserocr = None
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+# Per-process engine state, set by _init_worker
+_initialized = False
+_api = None
+_lang = "eng"
+
+
+def _init_worker(tesseract_cmd, lang, tessdata_path):
+    global _initialized, _api, _lang
+    _initialized = True
+    _lang = lang
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    if tesserocr is not None:
+        kwargs = {"lang": lang}
+        if tessdata_path:
+            kwargs["path"] = tessdata_path
+        _api = tesserocr.PyTessBaseAPI(**kwargs)
+
+
+def _to_image(image):
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (bytes, bytearray)):
+        image = io.BytesIO(image)
+    return Image.open(image)
+
+
+def _ocr(image):
+    try:
+        image = _to_image(image)
+        if _api is not None:
+            _api.SetImage(image)
+            return _api.GetUTF8Text()
+        return pytesseract.image_to_string(image, lang=_lang)
+    except Exception as e:
+        # Some engine errors cannot be pickled back to the parent process
+        raise RuntimeError(str(e)) from None
+
+
+def _engine_args():
+    return (settings.TESSERACT_CMD, settings.OCR_LANG, settings.TESSDATA_PREFIX)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if tesserocr is None:
+            logger.warning(
+                "tesserocr is not installed; OCR pool of %d workers falls back to "
+                "pytesseract and starts a tesseract process per image (see requirements.txt)",
+                settings.OCR_WORKERS,
+            )
+        else:
+            logger.info(
+                "OCR pool of %d workers using tesserocr (engine loaded once per worker)",
+                settings.OCR_WORKERS,
+            )
+        # Spawned workers do not inherit the parent's DB connections, locks or threads
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.OCR_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=_engine_args(),
+        )
+    return _executor
+
+
+def shutdown():
+    """Stop the OCR workers; the pool is recreated on next use"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def _prepare(image):
+    """Uploaded files cannot be pickled; hand the workers raw bytes instead"""
+    if isinstance(image, (Image.Image, bytes, bytearray)):
+        return image
+    image.seek(0)
+    return image.read()
+
+
+def ocr_images(images):
+    """OCR a batch of images (PIL images, bytes or file objects), returning texts in order"""
+    images = [_prepare(image) for image in images]
+    if not images:
+        return []
+
+    if settings.OCR_WORKERS <= 0:
+        # In-process mode, e.g. for debugging; the engine is still loaded once
+        if not _initialized:
+            _init_worker(*_engine_args())
+        return [_ocr(image) for image in images]
+
+    return list(_get_executor().map(_ocr, images))
+
+
+def ocr_image(image):
+    return ocr_images([image])[0]
+
+
+def ocr_document(image):
+    """
+    OCR a photo or scan of a whole report page.
+
+    The image is cleaned up and split into tiles first (see
+    ``analyzer.utils.image_preprocess``); tiles are OCR'd in parallel and
+    stitched back in reading order. Returns ``(text, timings)``.
+    """
+    if not settings.OCR_PREPROCESS:
+        started = time.perf_counter()
+        text = ocr_image(image)
+        return text, {"ocr": time.perf_counter() - started}
+
+    with _to_image(_prepare(image)) as original:
+        tiles, timings = preprocess_for_ocr(original)
+
+    started = time.perf_counter()
+    texts = ocr_images(tiles)
+    timings["ocr"] = time.perf_counter() - started
+
+    logger.debug(
+        "OCR of %d tile(s): %s", len(tiles),
+        ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items()),
+    )
+    return "\n".join(text.strip("\n") for text in texts), timings
@@ -4,6 +4,7 @@ from weasyprint import HTML, CSS
 from weasyprint.text.fonts import FontConfiguration
 import tempfile
 from datetime import datetime
+from .catalog import get_catalog
 
 
 def generate_pdf_report(blood_report, recommendation, allergy_info):
@@ -35,6 +36,22 @@ def generate_pdf_report(blood_report, recommendation, allergy_info):
     foods_to_avoid = parse_list(recommendation.foods_to_avoid)
     daily_habits = parse_list(recommendation.daily_habits)
     
+    # Lab results with reference ranges from the parameter catalog
+    catalog = get_catalog()
+    lab_values = []
+    for value in blood_report.bloodreportvalue_set.all():
+        param = catalog.by_id.get(value.parameter_id)
+        if param is None:
+            continue
+        lab_values.append({
+            'name': param.name,
+            'value': value.value,
+            'unit': value.unit or param.unit,
+            'normal_min': param.normal_min,
+            'normal_max': param.normal_max,
+            'status': catalog.status(param.id, value.value),
+        })
+    
     # Get allergies
     user_allergies = allergy_info.user_mentioned_allergies
     common_allergies = [
@@ -49,6 +66,7 @@ def generate_pdf_report(blood_report, recommendation, allergy_info):
         'recommendation': recommendation,
         'allergy_info': allergy_info,
         'user': blood_report.user,
+        'lab_values': lab_values,
         'analysis_points': analysis_points,
         'foods_to_eat': foods_to_eat,
         'foods_to_avoid': foods_to_avoid,
@@ -0,0 +1,168 @@
+"""
+Reading percentiles per blood parameter.
+
+Every reading added to a user's series is also summarized in one KLL
+quantile sketch per parameter (``ParameterSketch``), so "higher than N% of
+readings" is a lookup in a few kilobytes instead of a scan of
+BloodReportValue. The rank is among readings, not users: someone with ten
+reports counts ten times. Writers build a sketch of their own readings and merge it
+into the stored one under a row lock, so any number of worker processes can
+add to it.
+
+Each process keeps the decoded sketches in memory and, like the parameter
+catalog, reloads them when the shared version stamp moves.
+
+Sketches only grow: a deleted reading, or the old value of a re-extracted
+one, stays counted until ``manage.py rebuild_sketches`` recomputes them from
+stored values.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BloodReportValue, ParameterSketch
+from .utils.quantile_sketch import KLLSketch
+
+
+VERSION_CACHE_KEY = "analyzer:parameter_sketch_version"
+
+# Seconds between checks of the shared version stamp
+VERSION_CHECK_INTERVAL = 2.0
+
+
+def _sketch_of(values):
+    sketch = KLLSketch(settings.QUANTILE_SKETCH_K)
+    for value in values:
+        sketch.update(value)
+    return sketch
+
+
+def add_readings(readings):
+    """Merge ``{parameter_id: [values]}`` into the stored sketches"""
+    deltas = {parameter_id: _sketch_of(values) for parameter_id, values in readings.items() if values}
+    if not deltas:
+        return
+    now = timezone.now()
+
+    with transaction.atomic():
+        stored = {
+            row.parameter_id: row
+            for row in ParameterSketch.objects.select_for_update().filter(parameter_id__in=deltas)
+        }
+        created, updated = [], []
+        for parameter_id, delta in deltas.items():
+            row = stored.get(parameter_id)
+            if row is None:
+                row = ParameterSketch(parameter_id=parameter_id)
+                created.append(row)
+                sketch = delta
+            else:
+                updated.append(row)
+                sketch = KLLSketch.from_bytes(row.sketch).merge(delta)
+            row.sketch = sketch.to_bytes()
+            row.count = sketch.count
+            row.updated_at = now
+
+        ParameterSketch.objects.bulk_create(created)
+        ParameterSketch.objects.bulk_update(updated, ["sketch", "count", "updated_at"])
+    _changed()
+
+
+def rebuild_sketches(parameter_ids=None):
+    """
+    Recompute sketches from the readings of users' reports, for all
+    parameters or ``parameter_ids``. Returns the number of sketches written.
+    """
+    rows = BloodReportValue.objects.filter(report__user__isnull=False)
+    existing = ParameterSketch.objects.all()
+    if parameter_ids is not None:
+        rows = rows.filter(parameter_id__in=parameter_ids)
+        existing = existing.filter(parameter_id__in=parameter_ids)
+
+    sketches = {}
+    for parameter_id, value in rows.values_list("parameter_id", "value").iterator(chunk_size=5000):
+        sketch = sketches.get(parameter_id)
+        if sketch is None:
+            sketch = sketches[parameter_id] = KLLSketch(settings.QUANTILE_SKETCH_K)
+        sketch.update(value)
+
+    with transaction.atomic():
+        existing.delete()
+        ParameterSketch.objects.bulk_create([
+            ParameterSketch(parameter_id=parameter_id, sketch=sketch.to_bytes(), count=sketch.count)
+            for parameter_id, sketch in sketches.items()
+        ])
+    _changed()
+    return len(sketches)
+
+
+_lock = threading.Lock()
+_sketches = None
+_version = None
+_checked_at = 0.0
+
+
+def _shared_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        # Another process may have set it first; theirs wins
+        if not cache.add(VERSION_CACHE_KEY, version, timeout=None):
+            version = cache.get(VERSION_CACHE_KEY, version)
+    return version
+
+
+def get_sketches():
+    """``{parameter_id: KLLSketch}``, reloaded only when the shared version changes"""
+    global _sketches, _version, _checked_at
+
+    sketches = _sketches
+    now = time.monotonic()
+    if sketches is not None and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return sketches
+
+    version = _shared_version()
+    if sketches is not None and _version == version:
+        _checked_at = now
+        return sketches
+
+    with _lock:
+        if _sketches is None or _version != version:
+            _sketches = {
+                parameter_id: KLLSketch.from_bytes(data)
+                for parameter_id, data in ParameterSketch.objects.values_list("parameter_id", "sketch")
+            }
+            _version = version
+        _checked_at = now
+        return _sketches
+
+
+def invalidate_sketches():
+    """Drop the local copy and tell every other process to reload"""
+    global _sketches
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+    with _lock:
+        _sketches = None
+
+
+def _changed():
+    global _sketches
+    # This process sees its own writes at once; others once they commit
+    _sketches = None
+    transaction.on_commit(invalidate_sketches)
+
+
+def reading_percentile(parameter_id, value):
+    """
+    Percentile (0-100) of ``value`` among every stored reading of the
+    parameter, or None while there are too few readings to say.
+    """
+    sketch = get_sketches().get(parameter_id)
+    if sketch is None or sketch.count < settings.PERCENTILE_MIN_READINGS:
+        return None
+    return round(sketch.rank(value) * 100)
@@ -0,0 +1,152 @@
+"""
+Recommendations in two steps.
+
+The allergy-independent analysis is produced in the background right after
+ingestion (by the consolidated analysis call, or by an ``analyze`` job when
+that is off or failed) and stored on ``BloodReport.analysis``. Submitting
+the allergy form then only runs a local keyword filter over the
+recommendations, plus one small LLM screen for free-text allergies the
+keywords do not cover, so the page does not wait for the full analysis.
+"""
+import re
+
+from .gemini_service import analyze_blood_report, find_allergen_lines
+
+
+# Keywords per allergy checkbox on AllergyForm; plurals are matched too
+ALLERGEN_KEYWORDS = {
+    'dairy': [
+        'dairy', 'milk', 'cheese', 'yogurt', 'yoghurt', 'butter', 'cream',
+        'curd', 'paneer', 'ghee', 'whey', 'kefir', 'lassi', 'lactose',
+        'casein', 'milkshake', 'latte', 'custard',
+    ],
+    'nuts': [
+        'nut', 'peanut', 'almond', 'walnut', 'cashew', 'pistachio', 'pecan',
+        'hazelnut', 'macadamia', 'trail mix', 'granola', 'muesli', 'praline',
+        'marzipan', 'nougat', 'pesto', 'nutella',
+    ],
+    'shellfish': [
+        'shellfish', 'shrimp', 'prawn', 'crab', 'lobster', 'clam', 'mussel',
+        'oyster', 'scallop',
+    ],
+    'eggs': ['egg', 'omelette', 'omelet', 'mayonnaise'],
+    'soy': ['soy', 'soya', 'tofu', 'tempeh', 'edamame', 'miso'],
+    # The form's checkbox is "Wheat/Gluten", so gluten grains are included
+    'wheat': [
+        'wheat', 'bread', 'pasta', 'semolina', 'couscous', 'bulgur', 'seitan',
+        'roti', 'chapati', 'noodle', 'pastry', 'pastries', 'gluten', 'celiac',
+        'coeliac', 'barley', 'rye', 'malt', 'spelt', 'cereal', 'cracker',
+        'biscuit', 'muesli', 'granola',
+    ],
+    'fish': [
+        'fish', 'salmon', 'tuna', 'sardine', 'mackerel', 'cod', 'trout',
+        'anchovy', 'anchovies', 'tilapia',
+    ],
+}
+
+
+def _keyword_pattern(keywords):
+    words = sorted({re.escape(k.lower()) for k in keywords}, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(words) + r")(?:s|es)?\b", re.IGNORECASE)
+
+
+ALLERGEN_PATTERNS = {name: _keyword_pattern(words) for name, words in ALLERGEN_KEYWORDS.items()}
+
+
+NO_ALLERGY_ANSWERS = {"none", "nil", "n/a", "no", "nothing", "no allergies", "not known"}
+
+
+def allergy_terms(user_mentioned):
+    """Individual allergies from the free-text field ("peanuts, milk and kiwi")"""
+    parts = re.split(r"[,;\n]|\band\b|\bor\b", (user_mentioned or "").lower())
+    terms = [part.strip(" .") for part in parts]
+    return [term for term in terms if len(term) >= 3 and term not in NO_ALLERGY_ANSWERS]
+
+
+def allergen_pattern(common, user_mentioned):
+    """
+    Regex matching any food the user must avoid, a label per allergy, and
+    the free-text allergies no keyword group covers (those need the LLM
+    screen); ``(None, [], [])`` when nothing was reported.
+    """
+    labels = [name for name, has_it in (common or {}).items() if has_it and name in ALLERGEN_KEYWORDS]
+    keywords = [word for name in labels for word in ALLERGEN_KEYWORDS[name]]
+    unmatched = []
+
+    for term in allergy_terms(user_mentioned):
+        labels.append(term)
+        keywords.append(term)
+        # "peanuts" or "lactose" also rule out everything in their group
+        groups = [name for name, pattern in ALLERGEN_PATTERNS.items() if pattern.search(term)]
+        for name in groups:
+            keywords.extend(ALLERGEN_KEYWORDS[name])
+        if not groups:
+            unmatched.append(term)
+
+    if not keywords:
+        return None, [], []
+    return _keyword_pattern(keywords), labels, unmatched
+
+
+# Everything the user is told to eat or do; the foods to avoid stay whole
+FILTERED_SECTIONS = ['foods_to_eat', 'daily_habits', 'detailed_analysis']
+
+
+def apply_allergies(analysis, common, user_mentioned):
+    """
+    Copy of ``analysis`` with every point mentioning the user's allergies
+    removed and a reminder added to the foods to avoid. Raises ``LLMError``
+    or ``ValueError`` if free-text allergies needed the LLM screen and it
+    failed, so unscreened advice is never shown.
+    """
+    pattern, labels, unmatched = allergen_pattern(common, user_mentioned)
+    result = dict(analysis)
+    if pattern is None:
+        return result
+
+    points = [
+        (name, line)
+        for name in FILTERED_SECTIONS
+        for line in analysis.get(name, '').splitlines()
+        if line.strip() and not pattern.search(line)
+    ]
+    if unmatched and points:
+        unsafe = find_allergen_lines([line for _, line in points], unmatched)
+        points = [point for i, point in enumerate(points) if i not in unsafe]
+
+    for name in FILTERED_SECTIONS:
+        if name in analysis:
+            result[name] = "".join(f"{line}\n" for section, line in points if section == name)
+    reminder = f"- Anything containing {', '.join(labels)} (your allergies)\n"
+    result['foods_to_avoid'] = reminder + analysis.get('foods_to_avoid', '')
+    return result
+
+
+def ensure_analysis(blood_report):
+    """
+    Produce and save the allergy-independent analysis unless the report
+    already has one; raises ``LLMError`` if the model is unavailable.
+    """
+    if blood_report.analysis:
+        return False
+    blood_report.analysis = analyze_blood_report(
+        blood_report.extracted_text, {'user_mentioned': '', 'common': {}}
+    )
+    blood_report.save(update_fields=['analysis'])
+    return True
+
+
+def recommendation_fields(blood_report, allergy_info):
+    """HealthRecommendation fields for a report and the user's allergies"""
+    ensure_analysis(blood_report)
+    analysis = apply_allergies(
+        blood_report.analysis,
+        allergy_info.common_allergies_response,
+        allergy_info.user_mentioned_allergies,
+    )
+    return {
+        'detailed_analysis': analysis['detailed_analysis'],
+        'foods_to_eat': analysis['foods_to_eat'],
+        'foods_to_avoid': analysis['foods_to_avoid'],
+        'daily_habits': analysis['daily_habits'],
+    }
@@ -0,0 +1,229 @@
+"""
+Per-user parameter history as packed arrays.
+
+Each ``ParameterSeries`` row holds one user's readings of one parameter as
+three parallel ``array`` buffers (report ids, upload timestamps, values)
+ordered by upload time, so a chart's whole history is a single indexed
+lookup instead of a join over every report the user uploaded.
+
+Writes are read-modify-writes of the packed blobs, so each row carries a
+``version`` and is only written back if it is unchanged since it was read;
+otherwise the whole write is retried from a fresh read.
+
+Rows are kept current where values are written (``save_values``,
+``reuse_cached_extraction`` and the BloodReportValue signals) and can be
+rebuilt from BloodReportValue with ``manage.py rebuild_series``. Readings
+new to a series are also passed on to the reading percentile sketches.
+"""
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BloodReportValue, ParameterSeries
+from .percentile_service import add_readings
+
+
+def unpack(series):
+    """``(report_ids, timestamps, values)`` arrays of a series row"""
+    return (
+        array("q", bytes(series.report_ids)),
+        array("d", bytes(series.timestamps)),
+        array("d", bytes(series.values)),
+    )
+
+
+def pack(series, report_ids, timestamps, values):
+    series.report_ids = report_ids.tobytes()
+    series.timestamps = timestamps.tobytes()
+    series.values = values.tobytes()
+
+
+def _remove(arrays, report_id):
+    report_ids, timestamps, values = arrays
+    try:
+        i = report_ids.index(report_id)
+    except ValueError:
+        return False
+    del report_ids[i], timestamps[i], values[i]
+    return True
+
+
+def _insert(arrays, report_id, timestamp, value):
+    """
+    Add or replace the reading for ``report_id``, keeping upload order.
+    Returns True if it replaced one.
+    """
+    report_ids, timestamps, values = arrays
+    replaced = _remove(arrays, report_id)
+    key = (timestamp, report_id)
+    i = len(report_ids)
+    # New uploads are the latest, so this loop usually exits at once
+    while i > 0 and (timestamps[i - 1], report_ids[i - 1]) > key:
+        i -= 1
+    report_ids.insert(i, report_id)
+    timestamps.insert(i, timestamp)
+    values.insert(i, value)
+    return replaced
+
+
+class _Conflict(Exception):
+    """A series changed between being read and written"""
+
+
+MAX_ATTEMPTS = 10
+
+
+def _with_retry(write):
+    """Run ``write`` again from a fresh read if another writer got in between"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return write()
+        except (_Conflict, IntegrityError):
+            # IntegrityError: another writer created the same series first
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+
+def _save(series, fields):
+    """
+    Write ``series`` if nobody else has since it was read. SQLite ignores
+    SELECT ... FOR UPDATE, so the version check is what keeps two
+    read-modify-writes of the same blobs from losing one of them.
+    """
+    written = ParameterSeries.objects.filter(id=series.id, version=series.version).update(
+        version=F("version") + 1, **{field: getattr(series, field) for field in fields}
+    )
+    if not written:
+        raise _Conflict(series.id)
+
+
+def record_points(report, points):
+    """
+    Add a report's readings to its owner's series.
+
+    ``points`` maps parameter id to ``(value, unit)``. One query per series
+    the user already has, plus a fixed number however many are new.
+    """
+    if report.user_id is None or not points:
+        return
+    timestamp = report.uploaded_at.timestamp()
+
+    def write():
+        now = timezone.now()
+        existing = {
+            series.parameter_id: series
+            for series in ParameterSeries.objects.filter(user_id=report.user_id, parameter_id__in=points)
+        }
+        created, added = [], {}
+        for parameter_id, (value, unit) in points.items():
+            series = existing.get(parameter_id)
+            if series is None:
+                series = ParameterSeries(user_id=report.user_id, parameter_id=parameter_id)
+                created.append(series)
+            arrays = unpack(series)
+            if not _insert(arrays, report.id, timestamp, value):
+                added[parameter_id] = [value]
+            pack(series, *arrays)
+            series.unit = unit
+            # update() does not apply auto_now; analytics keys its cache on it
+            series.updated_at = now
+
+        with transaction.atomic():
+            for series in existing.values():
+                _save(series, ["report_ids", "timestamps", "values", "unit", "updated_at"])
+            ParameterSeries.objects.bulk_create(created)
+            # Re-extracted readings were counted the first time
+            add_readings(added)
+
+    _with_retry(write)
+
+
+def remove_points(report_id, parameter_ids=None):
+    """Drop a report's readings from its owner's series"""
+    def write():
+        series_rows = ParameterSeries.objects.filter(user__bloodreport=report_id)
+        if parameter_ids is not None:
+            series_rows = series_rows.filter(parameter_id__in=parameter_ids)
+
+        changed = []
+        for series in series_rows:
+            arrays = unpack(series)
+            if _remove(arrays, report_id):
+                pack(series, *arrays)
+                series.updated_at = timezone.now()
+                changed.append(series)
+
+        with transaction.atomic():
+            for series in changed:
+                _save(series, ["report_ids", "timestamps", "values", "updated_at"])
+
+    _with_retry(write)
+
+
+def rebuild_series(user_ids=None, batch_size=500):
+    """
+    Recompute series from BloodReportValue, for all users or ``user_ids``.
+    Returns the number of series written.
+    """
+    rows = BloodReportValue.objects.filter(report__user__isnull=False)
+    existing = ParameterSeries.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(report__user_id__in=user_ids)
+        existing = existing.filter(user_id__in=user_ids)
+    rows = (
+        rows
+        .order_by("report__user_id", "parameter_id", "report__uploaded_at", "report_id")
+        .values_list("report__user_id", "parameter_id", "report_id", "report__uploaded_at", "value", "unit")
+        .iterator(chunk_size=2000)
+    )
+
+    written = 0
+    with transaction.atomic():
+        existing.delete()
+        batch, series, arrays = [], None, None
+        for user_id, parameter_id, report_id, uploaded_at, value, unit in rows:
+            if series is None or (series.user_id, series.parameter_id) != (user_id, parameter_id):
+                if series is not None:
+                    pack(series, *arrays)
+                    batch.append(series)
+                series = ParameterSeries(user_id=user_id, parameter_id=parameter_id)
+                arrays = (array("q"), array("d"), array("d"))
+            # Rows arrive in upload order, so appending keeps the series sorted
+            arrays[0].append(report_id)
+            arrays[1].append(uploaded_at.timestamp())
+            arrays[2].append(value)
+            series.unit = unit
+            if len(batch) >= batch_size:
+                ParameterSeries.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if series is not None:
+            pack(series, *arrays)
+            batch.append(series)
+        ParameterSeries.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def day_label(timestamp):
+    return datetime.fromtimestamp(timestamp, dt_timezone.utc).strftime("%Y-%m-%d")
+
+
+def series_points(user_id, parameter_id, start=None, end=None):
+    """
+    ``(timestamps, values, unit)`` of one series, limited to readings with
+    ``start <= timestamp < end`` (Unix seconds), or None if the user has no
+    readings of the parameter.
+    """
+    series = ParameterSeries.objects.filter(user_id=user_id, parameter_id=parameter_id).first()
+    if series is None:
+        return None
+    _, timestamps, values = unpack(series)
+    # Timestamps are sorted, so the range is two binary searches
+    lo = 0 if start is None else bisect_left(timestamps, start)
+    hi = len(timestamps) if end is None else bisect_left(timestamps, end)
+    return timestamps[lo:hi].tolist(), values[lo:hi].tolist(), series.unit
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .catalog import catalog_changed
+from .chat_service import invalidate_chat_context
+from .models import BloodParameter, BloodReportValue
+from .series_service import record_points, remove_points
+
+@receiver(post_save, sender=BloodParameter)
+@receiver(post_delete, sender=BloodParameter)
+def parameter_changed(sender, instance, **kwargs):
+    catalog_changed()
+
+# Bulk writes (report_parser.save_values) bypass these and refresh the context
+# and series themselves
+@receiver(post_save, sender=BloodReportValue)
+def value_saved(sender, instance, **kwargs):
+    invalidate_chat_context(instance.report_id)
+    record_points(instance.report, {instance.parameter_id: (instance.value, instance.unit)})
+
+@receiver(post_delete, sender=BloodReportValue)
+def value_deleted(sender, instance, **kwargs):
+    invalidate_chat_context(instance.report_id)
+    remove_points(instance.report_id, [instance.parameter_id])
@@ -1,3 +1,1566 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from PIL import Image, ImageChops, ImageDraw
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .analytics import cohort_trends, describe_trend, user_trends
+from .catalog import VERSION_CACHE_KEY, ParameterCatalog, ParameterEntry, get_catalog
+from .chat_service import (
+    CONTEXT_CACHE_KEY, conversation_contents, get_chat_context, history_page, save_exchange, update_summary,
+)
+from .ingestion_service import (
+    claim_next_job, enqueue_analysis, enqueue_report, find_cached_report, requeue_stale_jobs, run_job,
+)
+from . import llm_client, llm_gateway, ocr_service
+from .gemini_service import parse_report_analysis
+from .llm_backends import BackendError, FakeBackend, GeminiBackend, HTTPBackend
+from .llm_cache import LLMCache, cached_generate
+from .llm_gateway import CircuitBreaker, CircuitOpenError, LLMError, LLMGateway, LLMTimeoutError
+from .management.commands.reextract_reports import _reextract_chunk
+from .models import (
+    AllergyInfo, BloodParameter, BloodReport, BloodReportValue, ChatMessage, ChatSummary, HealthRecommendation,
+    IngestionJob, ParameterSeries, ParameterSketch,
+)
+from .pdf_service import generate_pdf_report
+from .percentile_service import get_sketches, reading_percentile, rebuild_sketches
+from .recommendation_service import apply_allergies
+from .series_service import rebuild_series, record_points, series_points, unpack
+from .templatetags.custom_filters import count_items
+from .utils import pdf_extractor
+from .utils.downsample import lttb
+from .utils.image_preprocess import downscale, estimate_skew, preprocess_for_ocr, row_profile, split_tiles
+from .utils.pdf_extractor import PDFTooLargeError, iter_pdf_text
+from .utils.quantile_sketch import KLLSketch
+from .utils.report_parser import (
+    EXTRACTOR_VERSION, AliasMatcher, ensure_summary, extract_values_from_text, parse_values, save_values, set_summary,
+    summary_is_current,
+)
+from .views import chat_with_report
+
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class TempMediaMixin:
+    """Uploaded files go to a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+def create_hemoglobin():
+    return BloodParameter.objects.create(
+        name="Hemoglobin", category="CBC", common_names="Hb", unit="g/dL", normal_min=13.0, normal_max=17.0,
+    )
+
+
+def add_report(user, readings, days_ago=0):
+    """
+    A report by ``user`` uploaded ``days_ago`` days ago, with ``readings``
+    (``{parameter: value}``) saved the way ingestion saves them
+    """
+    report = BloodReport.objects.create(user=user, report_file="blood_reports/r.pdf")
+    # uploaded_at is auto_now_add, so backdate it afterwards
+    BloodReport.objects.filter(id=report.id).update(uploaded_at=timezone.now() - timedelta(days=days_ago))
+    report.refresh_from_db()
+    values = {parameter.id: (value, "local") for parameter, value in readings.items()}
+    save_values(report, values, get_catalog(), update_report=False)
+    return report
+
+
+@override_settings(CACHES=LOCMEM_CACHE, INGESTION_RETRY_DELAY=0, INGESTION_MAX_ATTEMPTS=2)
+class IngestionJobTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user("uploader", password="secret")
+
+    def upload(self, name, content):
+        report = BloodReport.objects.create(user=self.user, report_file=SimpleUploadedFile(name, content))
+        return report, enqueue_report(report)
+
+    def test_claim_takes_each_runnable_job_once(self):
+        _, later = self.upload("later.pdf", b"later")
+        IngestionJob.objects.filter(id=later.id).update(run_after=timezone.now() + timedelta(hours=1))
+        _, job = self.upload("now.pdf", b"now")
+
+        claimed = claim_next_job()
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual((claimed.status, claimed.attempts), (IngestionJob.STATUS_EXTRACTING, 1))
+        self.assertIsNone(claim_next_job())
+
+    def test_stale_jobs_are_requeued_until_out_of_attempts(self):
+        jobs = [self.upload(f"{i}.pdf", str(i).encode())[1] for i in range(3)]
+        for job in jobs:
+            claim_next_job()
+        long_ago = timezone.now() - timedelta(hours=1)
+        IngestionJob.objects.filter(id=jobs[0].id).update(locked_at=long_ago)
+        IngestionJob.objects.filter(id=jobs[1].id).update(locked_at=long_ago, attempts=2)
+
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 2)
+        statuses = [IngestionJob.objects.get(id=job.id).status for job in jobs]
+        self.assertEqual(statuses, [IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_FAILED, IngestionJob.STATUS_EXTRACTING])
+
+    def test_parsed_report_queues_the_analysis_prefetch(self):
+        report, job = self.upload("report.pdf", b"report")
+        with mock.patch("analyzer.ingestion_service.extract_report_text", return_value="hb 14"), \
+                mock.patch("analyzer.ingestion_service.extract_values_from_text") as extract_values, \
+                mock.patch("analyzer.ingestion_service.ensure_summary"):
+            run_job(claim_next_job())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), (IngestionJob.STATUS_DONE, ""))
+        extract_values.assert_called_once_with(report)
+        self.assertEqual(
+            list(report.ingestion_jobs.values_list("kind", "status")),
+            [(IngestionJob.KIND_EXTRACT, IngestionJob.STATUS_DONE), (IngestionJob.KIND_ANALYZE, IngestionJob.STATUS_QUEUED)],
+        )
+
+    def test_extraction_error_is_retried_then_fails(self):
+        report, job = self.upload("truncated.pdf", b"%PDF-1.4\n1 0 obj")
+
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (IngestionJob.STATUS_QUEUED, 1))
+        self.assertIn("EOF", job.last_error)
+
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        self.assertIsNone(claim_next_job())
+
+        # The error never becomes report text, and the report stays unparsed
+        report.refresh_from_db()
+        self.assertEqual(report.extracted_text, "")
+        self.assertIsNone(report.extractor_version)
+
+    def test_identical_upload_reuses_a_parsed_report(self):
+        parameter = BloodParameter.objects.create(name="Hemoglobin", category="CBC", common_names="Hb", unit="g/dL")
+        parsed, _ = self.upload("first.pdf", b"first")
+        BloodReport.objects.filter(id=parsed.id).update(
+            content_hash="same", extracted_text="hb 14", extractor_version=EXTRACTOR_VERSION, analysis={"done": True},
+        )
+        BloodReportValue.objects.create(report=parsed, parameter=parameter, value=14.0, unit="g/dL")
+        # Failed or empty extractions are never served from the cache
+        for text in ["", "Error extracting PDF: EOF marker not found"]:
+            BloodReport.objects.create(
+                user=self.user, report_file="blood_reports/x.pdf", content_hash="same",
+                extracted_text=text, extractor_version=EXTRACTOR_VERSION,
+            )
+        IngestionJob.objects.all().delete()
+
+        # Not a readable PDF, so the job only succeeds through the cache
+        report, job = self.upload("again.pdf", b"not a pdf")
+        BloodReport.objects.filter(id=report.id).update(content_hash="same")
+        report.refresh_from_db()
+        self.assertEqual(find_cached_report("same", exclude_id=report.id), parsed)
+
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_DONE)
+        self.assertEqual(list(report.bloodreportvalue_set.values_list("value", flat=True)), [14.0])
+
+
+def make_pdf(page_texts):
+    """A minimal PDF with one line of Helvetica text per page"""
+    count = len(page_texts)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(count)), count),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(page_texts):
+        stream = b"BT /F1 12 Tf 72 720 Td (%s) Tj ET" % text.encode()
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+
+    pdf, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+class PDFExtractionTests(SimpleTestCase):
+    def setUp(self):
+        self.texts = [f"Page {i} hemoglobin {10 + i}" for i in range(9)]
+        self.pdf = make_pdf(self.texts)
+
+    def extract(self, **kwargs):
+        return [text.strip() for text in iter_pdf_text(BytesIO(self.pdf), **kwargs)]
+
+    def shutdown_pools(self):
+        while pdf_extractor._executors:
+            pdf_extractor._executors.popitem()[1].shutdown()
+
+    def test_pages_come_back_in_order(self):
+        self.assertEqual(self.extract(workers=1), self.texts)
+
+    def test_worker_pool_keeps_document_order(self):
+        self.addCleanup(self.shutdown_pools)
+        self.assertEqual(self.extract(workers=2), self.texts)
+
+    def test_page_and_size_caps(self):
+        self.assertEqual(self.extract(workers=1, max_pages=2), self.texts[:2])
+        with self.assertRaises(PDFTooLargeError):
+            self.extract(max_bytes=100)
+
+    def test_scanned_pages_are_ocrd_in_one_batch(self):
+        pages = [("typed", None), ("", b"scan-1"), ("", b"scan-2")]
+        with mock.patch("analyzer.utils.pdf_extractor.ocr_images", return_value=["ocr 1", "ocr 2"]) as ocr:
+            self.assertEqual(pdf_extractor._resolve_scans(pages), ["typed", "ocr 1", "ocr 2"])
+        ocr.assert_called_once_with([b"scan-1", b"scan-2"])
+
+        with mock.patch("analyzer.utils.pdf_extractor.ocr_images", side_effect=RuntimeError("no tesseract")):
+            self.assertEqual(pdf_extractor._resolve_scans(pages), ["typed", "", ""])
+
+
+def text_lines_image(width, height, line_gap=60, line_height=20, margin=100):
+    """White page with dark bars where lines of text would be"""
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for top in range(margin, height - margin - line_height, line_gap):
+        draw.rectangle((margin, top, width - margin, top + line_height), fill=30)
+    return image
+
+
+class OCRPoolTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ocr_service, "_executor", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(OCR_WORKERS=2)
+    def test_pool_spawns_its_workers_and_warns_without_tesserocr(self):
+        with mock.patch.object(ocr_service, "ProcessPoolExecutor") as pool, \
+                mock.patch.object(ocr_service, "tesserocr", None), \
+                self.assertLogs("analyzer.ocr_service", "WARNING") as logs:
+            self.assertIs(ocr_service._get_executor(), ocr_service._get_executor())
+        pool.assert_called_once()
+        self.assertEqual(pool.call_args.kwargs["max_workers"], 2)
+        self.assertEqual(pool.call_args.kwargs["mp_context"].get_start_method(), "spawn")
+        self.assertIn("tesserocr is not installed", logs.output[0])
+
+    @override_settings(OCR_WORKERS=2)
+    def test_pool_logs_the_warm_engine_backend(self):
+        with mock.patch.object(ocr_service, "ProcessPoolExecutor"), \
+                mock.patch.object(ocr_service, "tesserocr", mock.Mock()), \
+                self.assertLogs("analyzer.ocr_service", "INFO") as logs:
+            ocr_service._get_executor()
+        self.assertEqual(
+            logs.output, ["INFO:analyzer.ocr_service:OCR pool of 2 workers using tesserocr (engine loaded once per worker)"],
+        )
+
+    @override_settings(OCR_WORKERS=0)
+    def test_in_process_mode_keeps_input_order(self):
+        with mock.patch.object(ocr_service, "_initialized", True), \
+                mock.patch.object(ocr_service, "_ocr", side_effect=lambda image: image.decode()):
+            self.assertEqual(ocr_service.ocr_images([b"first", BytesIO(b"second")]), ["first", "second"])
+        self.assertIsNone(ocr_service._executor)
+
+
+class ImagePreprocessTests(SimpleTestCase):
+    def test_downscale_to_target_resolution(self):
+        photo = Image.new("L", (4960, 7016), 255)  # A4 at 600 dpi
+        self.assertEqual(downscale(photo, 300).width, 2481)
+        self.assertIs(downscale(photo, 1200), photo)
+
+    def test_skew_is_measured_against_the_text_lines(self):
+        page = text_lines_image(1200, 1600)
+        self.assertEqual(estimate_skew(page), 0.0)
+        tilted = page.rotate(3, resample=Image.BILINEAR, expand=True, fillcolor=255)
+        self.assertAlmostEqual(estimate_skew(tilted), -3.0, delta=0.5)
+
+    def test_tiles_are_cut_between_lines(self):
+        page = text_lines_image(800, 5000)
+        tiles = split_tiles(page, 1000)
+        self.assertGreater(len(tiles), 3)
+        self.assertEqual(sum(tile.height for tile in tiles), page.height)
+        # No line is sliced: every cut falls on a blank row
+        profile = row_profile(page)
+        cuts = np.cumsum([tile.height for tile in tiles[:-1]])
+        self.assertEqual([profile[cut] for cut in cuts], [0] * len(cuts))
+
+    def test_pipeline_returns_clean_tiles_and_timings(self):
+        photo = text_lines_image(2480, 3508).convert("RGB")
+        # A shadow across the page must not turn into ink
+        shadow = Image.linear_gradient("L").resize(photo.size).point(lambda v: v // 3)
+        photo = ImageChops.subtract(photo, Image.merge("RGB", [shadow] * 3))
+
+        tiles, timings = preprocess_for_ocr(photo, target_dpi=150, tile_height=400)
+        self.assertGreater(len(tiles), 1)
+        self.assertTrue(all(tile.mode == "L" and set(tile.getdata()) <= {0, 255} for tile in tiles))
+        self.assertEqual(
+            list(timings), ["decode", "orient", "grayscale", "downscale", "deskew", "binarize", "crop", "tile"],
+        )
+        # The margins around the printed area are cropped away
+        self.assertLess(tiles[0].width, 1240)
+
+
+class AliasMatcherTests(SimpleTestCase):
+    def test_longest_alias_wins(self):
+        matcher = AliasMatcher((("rbc", "rbc"), ("rbc count", "rbc_count"), ("rdw", "rdw")))
+        self.assertEqual(matcher.find_values("rbc count 4.5 rdw 13"), {"rbc_count": 4.5, "rdw": 13.0})
+        self.assertEqual(matcher.find_values("rbc 4.5"), {"rbc": 4.5})
+
+    def test_aliases_only_match_whole_words(self):
+        matcher = AliasMatcher((("hb", "hb"), ("hba1c", "a1c")))
+        self.assertEqual(matcher.find_values("thb 3 hba1c 5.6 hb 14"), {"a1c": 5.6, "hb": 14.0})
+        self.assertEqual(matcher.find_values("hbs 1"), {})
+
+    def test_value_is_not_taken_from_the_next_mention(self):
+        matcher = AliasMatcher((("hemoglobin", "hb"), ("wbc", "wbc")))
+        self.assertEqual(matcher.find_values("hemoglobin see below wbc 7000 hemoglobin 14"), {"wbc": 7000.0, "hb": 14.0})
+
+    def test_trie_matches_a_plain_alternation(self):
+        aliases = ["a", "ab", "abc", "abd", "b", "ba", "bad", "c d", "cd"]
+        matcher = AliasMatcher(tuple((alias, alias) for alias in aliases))
+        plain = re.compile(
+            r"(?<![a-z0-9])(?:" + "|".join(map(re.escape, sorted(aliases, key=len, reverse=True))) + r")(?![a-z0-9])"
+        )
+        rng = random.Random(0)
+        for _ in range(200):
+            text = " ".join(rng.choice(aliases + ["abcd", "x", "1", "2.5"]) for _ in range(12))
+            self.assertEqual(
+                [m.group() for m in matcher._pattern.finditer(text)], [m.group() for m in plain.finditer(text)], text,
+            )
+
+
+@override_settings(PARSER_ESCALATION_THRESHOLD=0.8)
+class TieredParsingTests(SimpleTestCase):
+    def setUp(self):
+        self.catalog = ParameterCatalog([
+            ParameterEntry(1, "Hemoglobin", "CBC", "g/dL", 13.0, 17.0, ("hemoglobin", "hb")),
+            ParameterEntry(2, "WBC", "CBC", "cells/uL", 4000, 11000, ("wbc",)),
+        ], "test")
+        self.normalize = mock.Mock(return_value="hemoglobin: 14.5 wbc: 6500")
+
+    def parse(self, text, **kwargs):
+        return parse_values(text, self.catalog, normalize=self.normalize, **kwargs)[0]
+
+    def test_confident_local_parse_skips_the_llm(self):
+        values = self.parse("Hb 14.1 g/dl WBC 7000 /ul")
+        self.assertEqual(values, {1: (14.1, "local"), 2: (7000.0, "local")})
+        self.normalize.assert_not_called()
+
+    def test_unsure_parse_escalates_and_llm_values_win(self):
+        self.normalize.return_value = "wbc: 6500"
+        values = self.parse("Hb 14.1 g/dl, white cells 7000")
+        self.normalize.assert_called_once_with("Hb 14.1 g/dl, white cells 7000")
+        # Plausible local values fill what the LLM missed
+        self.assertEqual(values, {1: (14.1, "local"), 2: (6500.0, "llm")})
+
+    def test_misreads_do_not_count_towards_confidence(self):
+        # 1410 is a dropped decimal point, far outside any plausible range
+        values = self.parse("Hb 1410 WBC 7000")
+        self.normalize.assert_called_once()
+        self.assertEqual(values, {1: (14.5, "llm"), 2: (6500.0, "llm")})
+
+    def test_llm_can_be_disabled(self):
+        self.assertEqual(self.parse("Hb 14.1", allow_llm=False), {1: (14.1, "local")})
+        self.normalize.assert_not_called()
+
+
+class ReportAnalysisParsingTests(SimpleTestCase):
+    def test_response_is_validated_and_flattened(self):
+        result = parse_report_analysis(json.dumps({
+            "parameters": [{"name": " Hemoglobin ", "value": 14.2}, {"name": "WBC", "value": "n/a"}, "junk"],
+            "summary": " All normal. ",
+            "detailed_analysis": ["Iron is fine", " ", 7, "- Already a bullet"],
+            "foods_to_eat": "Spinach\nLentils",
+            "daily_habits": [],
+        }))
+        self.assertEqual(result, {
+            "parameters": {"Hemoglobin": 14.2},
+            "summary": "All normal.",
+            "detailed_analysis": "- Iron is fine\n- Already a bullet\n",
+            "foods_to_eat": "- Spinach\n- Lentils\n",
+            "foods_to_avoid": "",
+            "daily_habits": "",
+        })
+
+    def test_malformed_responses_are_rejected(self):
+        for response in ["not json", "[]", json.dumps({"parameters": [], "summary": " "})]:
+            with self.subTest(response=response), self.assertRaises(ValueError):
+                parse_report_analysis(response)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class AnalysisRenderingTests(TestCase):
+    """Sections from the structured analysis reach every consumer"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader", password="secret")
+        analysis = parse_report_analysis(json.dumps({
+            "parameters": [],
+            "summary": "Normal report.",
+            "detailed_analysis": ["Hemoglobin is normal", "Iron stores look fine"],
+            "foods_to_eat": ["Spinach", "Lentils"],
+            "foods_to_avoid": ["Fried food"],
+            "daily_habits": ["Morning walk: 30 minutes daily", "Hydration: 8 glasses of water"],
+        }))
+        del analysis["parameters"], analysis["summary"]
+        self.report = BloodReport.objects.create(
+            user=self.user, report_file="blood_reports/r.pdf", extracted_text="hb 14", analysis=analysis,
+        )
+        AllergyInfo.objects.create(blood_report=self.report, common_allergies_response={})
+        self.client.force_login(self.user)
+        self.client.get(reverse("generate_recommendations", args=[self.report.id]))
+        self.recommendation = HealthRecommendation.objects.get(blood_report=self.report)
+
+    def test_habit_tracker_lists_each_habit(self):
+        response = self.client.get(reverse("progress_tracker", args=[self.report.id]))
+        self.assertEqual(response.context["habits_list"], ["Morning walk", "Hydration"])
+        self.assertEqual(count_items(self.recommendation.foods_to_eat), 2)
+
+    def test_pdf_lists_every_section(self):
+        with mock.patch("analyzer.pdf_service.render_to_string", return_value="") as render, \
+                mock.patch("analyzer.pdf_service.HTML"):
+            generate_pdf_report(self.report, self.recommendation, self.report.allergy_info)
+        context = render.call_args.args[1]
+        self.assertEqual(context["analysis_points"], ["Hemoglobin is normal", "Iron stores look fine"])
+        self.assertEqual(context["foods_to_eat"], ["Spinach", "Lentils"])
+        self.assertEqual(context["foods_to_avoid"], ["Fried food"])
+        self.assertEqual(context["daily_habits"], ["Morning walk: 30 minutes daily", "Hydration: 8 glasses of water"])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, LLM_CONSOLIDATED_ANALYSIS=True, PARSER_ESCALATION_THRESHOLD=0.8)
+class ConsolidatedAnalysisTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hemoglobin = create_hemoglobin()
+        BloodParameter.objects.create(name="WBC", category="CBC", common_names="wbc", unit="cells/uL")
+        self.report = BloodReport.objects.create(
+            user=User.objects.create_user("analyzed", password="secret"),
+            report_file="blood_reports/r.pdf", extracted_text="Hb 13.1 g/dl, white cells 7000",
+        )
+        self.analysis = {
+            "parameters": {"Hemoglobin": 13.1, "WBC": 7000.0},
+            "summary": "Normal report.",
+            **{name: f"{name} point\n" for name in ["detailed_analysis", "foods_to_eat", "foods_to_avoid", "daily_habits"]},
+        }
+
+    def extract(self, **patch):
+        with mock.patch("analyzer.utils.report_parser.analyze_report_structured", **patch) as analyze, \
+                mock.patch("analyzer.utils.report_parser.generate_text") as generate, \
+                mock.patch("builtins.print"):
+            extract_values_from_text(self.report)
+        generate.assert_not_called()
+        analyze.assert_called_once()
+        self.report.refresh_from_db()
+
+    def test_one_call_yields_values_summary_and_analysis(self):
+        self.extract(return_value=dict(self.analysis))
+        self.assertEqual(
+            sorted(self.report.bloodreportvalue_set.values_list("parameter__name", "value", "source")),
+            [("Hemoglobin", 13.1, "llm"), ("WBC", 7000.0, "llm")],
+        )
+        self.assertEqual(self.report.summary, "Normal report.")
+        self.assertTrue(summary_is_current(self.report))
+        self.assertEqual(self.report.analysis["foods_to_eat"], "foods_to_eat point\n")
+        self.assertNotIn("parameters", self.report.analysis)
+
+    def test_failed_analysis_keeps_local_values(self):
+        with override_settings(PARSER_ESCALATION_THRESHOLD=0.5):
+            self.extract(side_effect=ValueError("Analysis response has no summary"))
+        self.assertEqual(
+            list(self.report.bloodreportvalue_set.values_list("parameter__name", "value")), [("Hemoglobin", 13.1)],
+        )
+        self.assertEqual((self.report.summary, self.report.analysis), ("", {}))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class InvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hemoglobin = create_hemoglobin()
+
+    def test_catalog_stamp_moves_only_once_the_change_commits(self):
+        get_catalog()
+        version = cache.get(VERSION_CACHE_KEY)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.hemoglobin.normal_max = 16.0
+            self.hemoglobin.save()
+            # This process sees its own change at once; others wait for the commit
+            self.assertEqual(get_catalog().reference_range(self.hemoglobin.id), (13.0, 16.0))
+            self.assertEqual(cache.get(VERSION_CACHE_KEY), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(cache.get(VERSION_CACHE_KEY), version)
+        self.assertEqual(get_catalog().reference_range(self.hemoglobin.id), (13.0, 16.0))
+
+    def test_chat_context_is_dropped_again_at_commit(self):
+        report = BloodReport.objects.create(report_file="blood_reports/r.pdf")
+        key = CONTEXT_CACHE_KEY.format(report_id=report.id, catalog_version=get_catalog().version)
+        with self.captureOnCommitCallbacks() as callbacks:
+            BloodReportValue.objects.create(report=report, parameter=self.hemoglobin, value=12.0, unit="g/dL")
+            self.assertIsNone(cache.get(key))
+            # Another request rebuilt it from the rows it could see before the commit
+            cache.set(key, {"prompt": "stale"})
+
+        for callback in callbacks:
+            callback()
+        self.assertIn("Hemoglobin", get_chat_context(report.id)["prompt"])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatContextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hemoglobin = create_hemoglobin()
+        self.wbc = BloodParameter.objects.create(name="WBC", category="CBC", common_names="wbc", unit="cells/uL")
+        self.report = BloodReport.objects.create(
+            user=User.objects.create_user("context", password="secret"), report_file="blood_reports/r.pdf",
+        )
+
+    def save(self, values):
+        with self.captureOnCommitCallbacks(execute=True):
+            save_values(self.report, {p.id: (v, "local") for p, v in values.items()}, get_catalog())
+
+    def test_context_is_built_when_values_are_written(self):
+        self.save({self.hemoglobin: 11.2, self.wbc: 7000})
+        with self.assertNumQueries(0):
+            context = get_chat_context(self.report.id)
+        self.assertEqual(context["metrics"], "- Hemoglobin: 11.2 g/dL (low; ref 13-17)\n- WBC: 7000 cells/uL (normal)")
+        self.assertEqual(context["flags"], {"Hemoglobin": "Low"})
+        self.assertIn(context["metrics"], context["prompt"])
+
+    def test_new_values_and_ranges_replace_the_context(self):
+        self.save({self.hemoglobin: 11.2})
+        self.save({self.hemoglobin: 14.0})
+        self.assertEqual(get_chat_context(self.report.id)["flags"], {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hemoglobin.normal_min = 14.5
+            self.hemoglobin.save()
+        self.assertEqual(get_chat_context(self.report.id)["flags"], {"Hemoglobin": "Low"})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class StoredSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("summarized", password="secret")
+        self.report = self.add_report("hb 14.1")
+        patcher = mock.patch("analyzer.utils.report_parser.get_quick_summary", return_value="Fresh summary.")
+        self.get_quick_summary = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_report(self, text, summary=""):
+        report = BloodReport.objects.create(user=self.user, report_file="blood_reports/r.pdf", extracted_text=text)
+        if summary:
+            set_summary(report, summary)
+            report.save()
+        return report
+
+    def test_summary_goes_stale_with_its_text_or_prompt(self):
+        set_summary(self.report, "Old summary.")
+        self.assertTrue(summary_is_current(self.report))
+        with mock.patch("analyzer.utils.report_parser.SUMMARY_VERSION", 2):
+            self.assertFalse(summary_is_current(self.report))
+        self.report.extracted_text = "hb 9.0"
+        self.assertFalse(summary_is_current(self.report))
+
+    def test_ensure_summary_only_calls_the_llm_when_stale(self):
+        self.assertTrue(ensure_summary(self.report))
+        self.assertFalse(ensure_summary(self.report))
+        self.get_quick_summary.assert_called_once_with("hb 14.1")
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.summary, "Fresh summary.")
+
+        # A failed call leaves the report to be retried later
+        report = self.add_report("wbc 7000")
+        self.get_quick_summary.side_effect = LLMError("unavailable")
+        with mock.patch("builtins.print"):
+            self.assertFalse(ensure_summary(report))
+        report.refresh_from_db()
+        self.assertEqual(report.summary, "")
+
+    def test_backfill_regenerates_only_stale_summaries(self):
+        self.add_report("hb 15", summary="Current summary.")
+        stale = self.add_report("hb 16", summary="Stale summary.")
+        BloodReport.objects.filter(id=stale.id).update(extracted_text="hb 16.5")
+        self.add_report("")
+
+        out = StringIO()
+        call_command("backfill_summaries", stdout=out)
+        self.assertIn("2 generated, 1 already current, 0 failed", out.getvalue())
+        self.assertEqual(self.get_quick_summary.call_count, 2)
+
+    def test_allergy_page_reads_the_stored_summary(self):
+        set_summary(self.report, "Stored summary.")
+        self.report.save()
+        self.client.force_login(self.user)
+        with mock.patch("analyzer.llm_gateway.generate") as generate:
+            response = self.client.get(reverse("allergy_info", args=[self.report.id]))
+        self.assertContains(response, "Stored summary.")
+        generate.assert_not_called()
+        self.get_quick_summary.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ReextractReportsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hemoglobin = create_hemoglobin()
+        self.wbc = BloodParameter.objects.create(
+            name="WBC", category="CBC", common_names="wbc", unit="cells/uL", normal_min=4000, normal_max=11000,
+        )
+        self.user = User.objects.create_user("reextract", password="secret")
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), "checkpoint.json")
+
+    def add_report(self, text, values):
+        report = BloodReport.objects.create(user=self.user, report_file="blood_reports/r.pdf", extracted_text=text)
+        for parameter, value in values:
+            BloodReportValue.objects.create(report=report, parameter=parameter, value=value, unit=parameter.unit)
+        return report
+
+    def reextract(self, *args):
+        stderr = StringIO()
+        call_command(
+            "reextract_reports", *args, "--workers", "1", "--no-llm", "--checkpoint", self.checkpoint,
+            "--chunk-size", "1", stdout=StringIO(), stderr=stderr,
+        )
+        return stderr.getvalue()
+
+    def interrupted_run(self, *args):
+        """Run until the second chunk, as if stopped with Ctrl-C"""
+        chunks = []
+
+        def first_chunk_only(*task):
+            chunks.append(task)
+            if len(chunks) > 1:
+                raise KeyboardInterrupt
+            return _reextract_chunk(*task)
+
+        with mock.patch("analyzer.management.commands.reextract_reports._reextract_chunk", first_chunk_only):
+            self.reextract(*args)
+
+    def stored(self, report):
+        return dict(BloodReportValue.objects.filter(report=report).values_list("parameter__name", "value"))
+
+    def test_values_no_longer_found_are_removed(self):
+        # An old parser read a stray "hb" mention as 99
+        report = self.add_report("wbc 7000", [(self.hemoglobin, 99.0), (self.wbc, 5000)])
+        self.reextract()
+        self.assertEqual(self.stored(report), {"WBC": 7000.0})
+        self.assertEqual(series_points(self.user.id, self.hemoglobin.id)[1], [])
+
+    def test_targeted_run_only_touches_its_parameters(self):
+        report = self.add_report("wbc 7000", [(self.hemoglobin, 99.0), (self.wbc, 5000)])
+        self.reextract("--parameters", "WBC")
+        self.assertEqual(self.stored(report), {"Hemoglobin": 99.0, "WBC": 7000.0})
+        report.refresh_from_db()
+        self.assertIsNone(report.extractor_version)
+
+    def test_resumes_after_the_checkpoint(self):
+        done = self.add_report("hb 14", [(self.hemoglobin, 12.0)])
+        pending = self.add_report("hb 15", [(self.hemoglobin, 12.0)])
+        self.interrupted_run("--parameters", "Hemoglobin")
+        self.assertEqual(self.stored(done), {"Hemoglobin": 14.0})
+        self.assertEqual(self.stored(pending), {"Hemoglobin": 12.0})
+
+        BloodReportValue.objects.filter(report=done).update(value=12.0)
+        self.reextract("--parameters", "Hemoglobin")
+        self.assertEqual(self.stored(done), {"Hemoglobin": 12.0})
+        self.assertEqual(self.stored(pending), {"Hemoglobin": 15.0})
+        # A finished run starts over next time
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resuming_with_other_filters_needs_restart(self):
+        first = self.add_report("hb 14", [(self.hemoglobin, 12.0)])
+        self.add_report("hb 15", [(self.hemoglobin, 12.0)])
+        self.interrupted_run("--users", "someone-else", "reextract")
+        BloodReportValue.objects.filter(report=first).update(value=12.0)
+
+        with self.assertRaisesMessage(CommandError, "different filters"):
+            self.reextract()
+        self.reextract("--restart")
+        self.assertEqual(self.stored(first), {"Hemoglobin": 14.0})
+
+    def test_failures_are_reported_on_stderr(self):
+        report = self.add_report("hb 14", [])
+        with mock.patch(
+            "analyzer.management.commands.reextract_reports.parse_values", side_effect=RuntimeError("parser bug"),
+        ), mock.patch("builtins.print") as print_:
+            stderr = self.reextract()
+        self.assertIn(f"Report {report.id}: parser bug", stderr)
+        print_.assert_not_called()
+
+    def test_report_fields_are_loaded_up_front(self):
+        reports = [self.add_report("hb 14 wbc 7000", []) for _ in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            _reextract_chunk([report.id for report in reports], None, False)
+        # No deferred field is fetched report by report
+        report_reads = [q for q in queries if q["sql"].startswith('SELECT "analyzer_bloodreport"')]
+        self.assertEqual(len(report_reads), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ValueUpsertTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.parameters = [
+            create_hemoglobin(),
+            BloodParameter.objects.create(name="WBC", category="CBC", common_names="wbc", unit="cells/uL"),
+            BloodParameter.objects.create(name="Platelets", category="CBC", common_names="plt", unit="cells/uL"),
+        ]
+        self.report = BloodReport.objects.create(
+            user=User.objects.create_user("upsert", password="secret"), report_file="blood_reports/r.pdf",
+        )
+
+    def save(self, values, source="local"):
+        catalog = get_catalog()
+        with CaptureQueriesContext(connection) as queries:
+            save_values(self.report, {p.id: (v, source) for p, v in zip(self.parameters, values)}, catalog)
+        return [q["sql"] for q in queries if q["sql"].startswith('INSERT INTO "analyzer_bloodreportvalue"')]
+
+    def test_values_are_written_with_one_upsert(self):
+        self.assertEqual(len(self.save([14.0, 7000, 250000])), 1)
+        ids = dict(self.report.bloodreportvalue_set.values_list("parameter__name", "id"))
+
+        self.assertEqual(len(self.save([14.5, 6500, 260000], source="llm")), 1)
+        rows = self.report.bloodreportvalue_set.values_list("parameter__name", "id", "value", "source")
+        self.assertEqual(sorted(rows), sorted([
+            ("Hemoglobin", ids["Hemoglobin"], 14.5, "llm"),
+            ("WBC", ids["WBC"], 6500.0, "llm"),
+            ("Platelets", ids["Platelets"], 260000.0, "llm"),
+        ]))
+
+
+class DuplicateValueMigrationTests(TransactionTestCase):
+    """0009 keeps the newest of duplicate values before adding the constraint"""
+
+    before = [("analyzer", "0008_bloodreportvalue_source")]
+    after = [("analyzer", "0009_bloodreportvalue_unique_report_parameter")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_newest_duplicate_is_kept(self):
+        apps = self.migrate(self.before)
+        report = apps.get_model("analyzer", "BloodReport").objects.create(report_file="blood_reports/r.pdf")
+        Parameter = apps.get_model("analyzer", "BloodParameter")
+        hemoglobin = Parameter.objects.create(name="Hemoglobin", category="CBC")
+        wbc = Parameter.objects.create(name="WBC", category="CBC")
+        Value = apps.get_model("analyzer", "BloodReportValue")
+        for parameter, value in [(hemoglobin, 12.0), (hemoglobin, 14.0), (wbc, 7000), (hemoglobin, 13.0)]:
+            Value.objects.create(report=report, parameter=parameter, value=value)
+
+        apps = self.migrate(self.after)
+        Value = apps.get_model("analyzer", "BloodReportValue")
+        self.assertEqual(
+            sorted(Value.objects.values_list("parameter__name", "value")), [("Hemoglobin", 13.0), ("WBC", 7000.0)],
+        )
+
+
+class BulletMigrationTests(TransactionTestCase):
+    """0016 gives bare points stored by the structured analysis their bullets"""
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_only_unbulleted_sections_change(self):
+        apps = self.migrate([("analyzer", "0015_parametersketch")])
+        report = apps.get_model("analyzer", "BloodReport").objects.create(
+            report_file="blood_reports/r.pdf",
+            analysis={"foods_to_eat": "Spinach\nLentils\n", "daily_habits": "- Walk: daily\n1. Stretch\n"},
+        )
+        apps.get_model("analyzer", "HealthRecommendation").objects.create(
+            blood_report=report, foods_to_eat="Spinach\n", foods_to_avoid="", daily_habits="- Walk: daily\n",
+        )
+
+        apps = self.migrate([("analyzer", "0016_bullet_analysis_points")])
+        report = apps.get_model("analyzer", "BloodReport").objects.get(id=report.id)
+        self.assertEqual(report.analysis, {"foods_to_eat": "- Spinach\n- Lentils\n", "daily_habits": "- Walk: daily\n1. Stretch\n"})
+        recommendation = apps.get_model("analyzer", "HealthRecommendation").objects.get(blood_report_id=report.id)
+        self.assertEqual(
+            (recommendation.foods_to_eat, recommendation.foods_to_avoid, recommendation.daily_habits),
+            ("- Spinach\n", "", "- Walk: daily\n"),
+        )
+
+
+class LLMCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = LLMCache(os.path.join(directory.name, "responses.sqlite3"), ttl=60, max_bytes=10_000)
+        patcher = mock.patch("analyzer.llm_cache._cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def generate_with(self, backend, answer):
+        with mock.patch.object(llm_gateway.get_gateway(), "backend", backend):
+            return cached_generate("gemini-test", "What is my hemoglobin?", lambda: answer)
+
+    def test_backends_do_not_share_responses(self):
+        self.assertEqual(self.generate_with(FakeBackend(), "fake answer"), "fake answer")
+        self.assertEqual(self.generate_with(HTTPBackend("http://127.0.0.1:1"), "http answer"), "http answer")
+        self.assertEqual(self.generate_with(GeminiBackend(), "real answer"), "real answer")
+
+        # Each backend is then served its own response
+        self.assertEqual(self.generate_with(FakeBackend(), "unused"), "fake answer")
+        self.assertEqual(self.generate_with(GeminiBackend(), "unused"), "real answer")
+        self.assertEqual(self.cache.stats()["entries"], 3)
+
+    def test_prompt_whitespace_does_not_change_the_key(self):
+        self.cache.set("m", ["  Summarize:\n\t hb 14  "], "ok")
+        self.assertEqual(self.cache.get("m", ["Summarize: hb 14"]), "ok")
+        self.assertIsNone(self.cache.get("m", ["Summarize: hb 15"]))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_expired_entries_only_serve_as_an_outage_fallback(self):
+        clock = mock.patch("analyzer.llm_cache.time").start()
+        self.addCleanup(mock.patch.stopall)
+        clock.time.return_value = 1000.0
+        self.cache.set("m", "prompt", "old answer")
+
+        clock.time.return_value = 1000.0 + 61
+        self.assertIsNone(self.cache.get("m", "prompt"))
+
+        def outage():
+            raise LLMError("unavailable")
+
+        with mock.patch.object(llm_gateway.get_gateway(), "backend", GeminiBackend()):
+            self.assertEqual(cached_generate("m", "prompt", outage), "old answer")
+            # Long-expired entries are dropped and the error surfaces
+            clock.time.return_value = 1000.0 + 121
+            self.cache.evict()
+            with self.assertRaises(LLMError):
+                cached_generate("m", "prompt", outage)
+            # Empty responses are not stored
+            self.assertEqual(cached_generate("m", "prompt", lambda: ""), "")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_least_recently_used_entries_go_over_the_budget(self):
+        clock = mock.patch("analyzer.llm_cache.time").start()
+        self.addCleanup(mock.patch.stopall)
+        for i in range(5):
+            clock.time.return_value = 1000.0 + i
+            self.cache.set("m", f"prompt {i}", "x" * 3000)
+        clock.time.return_value = 1010.0
+        self.cache.get("m", "prompt 0")
+
+        self.assertEqual(self.cache.evict(), 2)
+        kept = [i for i in range(5) if self.cache.get("m", f"prompt {i}") is not None]
+        self.assertEqual(kept, [0, 3, 4])
+        self.assertLessEqual(self.cache.stats()["bytes"], 10_000)
+
+
+class GeminiClientTests(SimpleTestCase):
+    def setUp(self):
+        for patcher in [
+            mock.patch.object(llm_client, "_client", None),
+            mock.patch.object(llm_client, "_client_pid", None),
+            mock.patch.object(llm_client.genai, "Client", side_effect=lambda **kwargs: object()),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_one_client_per_process(self):
+        with ThreadPoolExecutor(8) as pool:
+            clients = set(map(id, pool.map(lambda _: llm_client.get_client(), range(32))))
+        self.assertEqual(len(clients), 1)
+        self.assertEqual(llm_client.genai.Client.call_count, 1)
+
+        # A forked worker builds its own instead of sharing the parent's connections
+        parent = llm_client.get_client()
+        with mock.patch.object(llm_client.os, "getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(llm_client.get_client(), parent)
+
+
+class ScriptedBackend(FakeBackend):
+    """FakeBackend failing with a fixed list of errors instead of random ones"""
+
+    def __init__(self, faults=(), latency=0):
+        super().__init__(latency=latency, error_rate=0, throttle_rate=0, seed=0)
+        self.faults = list(faults)
+        self.attempts = 0
+        self.fake.next_fault = self._next_fault
+
+    def _next_fault(self):
+        self.attempts += 1
+        return self.faults.pop(0) if self.faults else None
+
+    async def _respond(self, contents, config):
+        # The real fake reads the catalog, which tests must not do off-thread
+        return "fine"
+
+
+class LLMGatewayTests(SimpleTestCase):
+    def gateway(self, backend, rate=0, burst=1, max_retries=2, deadline=5, threshold=3, cooldown=60):
+        return LLMGateway(
+            backend=backend, max_concurrency=4, rate=rate, burst=burst, max_retries=max_retries,
+            backoff_base=0.001, backoff_max=0.01, timeout=5, deadline=deadline,
+            breaker=CircuitBreaker(threshold, cooldown),
+        )
+
+    def call(self, gateway, **kwargs):
+        return asyncio.run(gateway.generate("hello", model="fake", **kwargs))
+
+    def test_rate_limit_spaces_out_calls_beyond_the_burst(self):
+        gateway = self.gateway(ScriptedBackend(), rate=20, burst=2)
+
+        async def six_calls():
+            return await asyncio.gather(*(gateway.generate("hello", model="fake") for _ in range(6)))
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(six_calls()), ["fine"] * 6)
+        # Two calls ride the burst, the other four wait 1/20 s each
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        backend = ScriptedBackend([BackendError(503, "busy"), BackendError(429, "slow down")])
+        self.assertEqual(self.call(self.gateway(backend)), "fine")
+        self.assertEqual(backend.attempts, 3)
+
+    def test_permanent_errors_and_exhausted_retries_raise(self):
+        backend = ScriptedBackend([BackendError(400, "bad request")])
+        with self.assertRaises(LLMError):
+            self.call(self.gateway(backend))
+        self.assertEqual(backend.attempts, 1)
+
+        backend = ScriptedBackend([BackendError(503, "busy")] * 5)
+        with self.assertRaises(LLMError):
+            self.call(self.gateway(backend, max_retries=1, threshold=10))
+        self.assertEqual(backend.attempts, 2)
+
+    def test_breaker_opens_fails_fast_and_closes_after_a_probe(self):
+        backend = ScriptedBackend([BackendError(503, "busy")] * 2)
+        gateway = self.gateway(backend, max_retries=0, threshold=2, cooldown=0.05)
+        for _ in range(2):
+            with self.assertRaises(LLMError):
+                self.call(gateway)
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            self.call(gateway)
+        self.assertEqual(backend.attempts, 2)
+
+        time.sleep(0.06)
+        self.assertEqual(self.call(gateway), "fine")
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens_the_breaker(self):
+        gateway = self.gateway(ScriptedBackend([BackendError(503, "busy")]), max_retries=0, cooldown=60)
+        gateway.breaker.state, gateway.breaker.opened_at = CircuitBreaker.OPEN, 0.0
+        with self.assertRaises(LLMError):
+            self.call(gateway)
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.call(gateway)
+
+    def test_cancelled_probe_does_not_wedge_the_breaker(self):
+        gateway = self.gateway(ScriptedBackend(latency=1), cooldown=60)
+        gateway.breaker.state, gateway.breaker.opened_at = CircuitBreaker.OPEN, 0.0
+
+        async def cancel_probe(call):
+            task = asyncio.ensure_future(call)
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_probe(gateway.generate("hello", model="fake")))
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.OPEN)
+
+        async def close_stream_early():
+            chunks = gateway.stream("hello", model="fake")
+            await asyncio.wait_for(chunks.__anext__(), timeout=0.05)
+
+        gateway.backend = ScriptedBackend(latency=1)
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(close_stream_early())
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.OPEN)
+
+        # The next call becomes the probe and closes the breaker
+        gateway.backend = ScriptedBackend()
+        self.assertEqual(self.call(gateway), "fine")
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_deadline_bounds_the_whole_call(self):
+        gateway = self.gateway(ScriptedBackend(latency=1))
+        started = time.monotonic()
+        with self.assertRaises(LLMTimeoutError):
+            self.call(gateway, deadline=0.1)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+
+class AllergyFilterTests(SimpleTestCase):
+    ANALYSIS = {
+        "detailed_analysis": "Iron is low\nWalnuts support healthy cholesterol\n",
+        "foods_to_eat": "Trail mix\nGreek yogurt\nWhole wheat bread\nMixed berries\nSpinach\n",
+        "foods_to_avoid": "Sugary drinks\n",
+        "daily_habits": "Eat a handful of almonds daily\nWalk 30 minutes\n",
+    }
+
+    def filtered(self, common=None, user_mentioned=""):
+        return apply_allergies(self.ANALYSIS, common or {}, user_mentioned)
+
+    @mock.patch("analyzer.recommendation_service.find_allergen_lines")
+    def test_checkbox_allergy_filters_every_section(self, screen):
+        result = self.filtered({"nuts": True})
+        self.assertEqual(result["foods_to_eat"], "Greek yogurt\nWhole wheat bread\nMixed berries\nSpinach\n")
+        self.assertEqual(result["daily_habits"], "Walk 30 minutes\n")
+        self.assertEqual(result["detailed_analysis"], "Iron is low\n")
+        self.assertTrue(result["foods_to_avoid"].startswith("- Anything containing nuts"))
+        screen.assert_not_called()
+
+    @mock.patch("analyzer.recommendation_service.find_allergen_lines")
+    def test_free_text_allergy_in_a_keyword_group(self, screen):
+        foods = self.filtered(user_mentioned="gluten and lactose intolerance")["foods_to_eat"]
+        self.assertEqual(foods, "Trail mix\nMixed berries\nSpinach\n")
+        screen.assert_not_called()
+
+    @mock.patch("analyzer.recommendation_service.find_allergen_lines")
+    def test_unknown_free_text_allergy_is_screened_by_the_llm(self, screen):
+        screen.side_effect = lambda lines, allergies: {i for i, line in enumerate(lines) if "berries" in line}
+        result = self.filtered({"dairy": True}, "strawberries")
+
+        (lines, allergies), _ = screen.call_args
+        self.assertEqual(allergies, ["strawberries"])
+        self.assertNotIn("Greek yogurt", lines)
+        self.assertEqual(result["foods_to_eat"], "Trail mix\nWhole wheat bread\nSpinach\n")
+
+    @mock.patch("analyzer.recommendation_service.find_allergen_lines", side_effect=ValueError("malformed"))
+    def test_failed_screen_shows_nothing_unscreened(self, screen):
+        with self.assertRaises(ValueError):
+            self.filtered(user_mentioned="kiwi")
+
+    def test_no_allergies_leaves_the_analysis_alone(self):
+        self.assertEqual(self.filtered(user_mentioned="none"), self.ANALYSIS)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RecommendationPrefetchTests(TestCase):
+    ANALYSIS = {
+        "detailed_analysis": "Hemoglobin is normal\n",
+        "foods_to_eat": "Spinach\nGreek yogurt\nAlmonds\n",
+        "foods_to_avoid": "Fried food\n",
+        "daily_habits": "Walk 30 minutes\n",
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("allergic", password="secret")
+        self.report = BloodReport.objects.create(
+            user=self.user, report_file="blood_reports/r.pdf", extracted_text="hb 14.1",
+        )
+        patcher = mock.patch("analyzer.recommendation_service.analyze_blood_report", return_value=dict(self.ANALYSIS))
+        self.analyze = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_analysis_job_prefetches_once(self):
+        job = enqueue_analysis(self.report)
+        run_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_DONE)
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.analysis, self.ANALYSIS)
+
+        # Already there (e.g. the page got to it first): no second call
+        enqueue_analysis(self.report)
+        run_job(claim_next_job())
+        self.analyze.assert_called_once()
+
+    def test_recommendations_page_filters_the_prefetched_analysis(self):
+        BloodReport.objects.filter(id=self.report.id).update(analysis=self.ANALYSIS)
+        AllergyInfo.objects.create(blood_report=self.report, common_allergies_response={"dairy": True, "nuts": True})
+        self.client.force_login(self.user)
+
+        with mock.patch("analyzer.llm_gateway.generate") as generate:
+            response = self.client.get(reverse("generate_recommendations", args=[self.report.id]))
+        self.assertEqual(response.status_code, 200)
+        generate.assert_not_called()
+        self.analyze.assert_not_called()
+        self.assertEqual(HealthRecommendation.objects.get(blood_report=self.report).foods_to_eat, "Spinach\n")
+
+    def test_unavailable_llm_saves_nothing(self):
+        AllergyInfo.objects.create(blood_report=self.report, common_allergies_response={})
+        self.analyze.side_effect = LLMError("unavailable")
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("generate_recommendations", args=[self.report.id]))
+        self.assertRedirects(response, reverse("report_list"), fetch_redirect_response=False)
+        self.assertFalse(HealthRecommendation.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("chatter", password="secret")
+        self.report = BloodReport.objects.create(user=self.user, report_file="blood_reports/chat.pdf")
+
+    def test_summary_is_updated_after_the_answer_is_sent(self):
+        request = RequestFactory().post(
+            reverse("chat_with_report", args=[self.report.id]),
+            data=json.dumps({"message": "Is my iron low?"}), content_type="application/json",
+        )
+        request.user = self.user
+        with mock.patch("analyzer.llm_gateway.generate", return_value="It is normal."), \
+                mock.patch("analyzer.views.update_summary") as update_summary:
+            response = chat_with_report(request, self.report.id)
+            self.assertEqual(json.loads(response.content), {"response": "It is normal."})
+            self.assertEqual(ChatMessage.objects.filter(blood_report=self.report).count(), 2)
+            update_summary.assert_not_called()
+
+            response.close()
+            response.close()
+        update_summary.assert_called_once_with(self.report)
+
+    @override_settings(CHAT_MEMORY_ENABLED=True, CHAT_HISTORY_TURNS=2, CHAT_SUMMARY_BATCH_TURNS=2)
+    def test_older_turns_are_folded_into_the_summary_in_batches(self):
+        def chat(turns):
+            for i in turns:
+                save_exchange(self.user, self.report, f"question {i}", f"answer {i}")
+                update_summary(self.report)
+
+        with mock.patch("analyzer.llm_gateway.generate", return_value="Asked about iron twice.") as generate:
+            # Turns 0 and 1 drop out of the window with turn 3; that fills a batch
+            chat(range(3))
+            generate.assert_not_called()
+            chat([3])
+            generate.assert_called_once()
+            self.assertIn("question 1", generate.call_args.args[0])
+            self.assertNotIn("question 2", generate.call_args.args[0])
+
+        summary = ChatSummary.objects.get(blood_report=self.report)
+        self.assertEqual(summary.summarized_until.message, "answer 1")
+
+        contents = conversation_contents(self.report, "And now?")
+        self.assertIn("Asked about iron twice.", contents[-3])
+        self.assertIn("question 2", contents[-2])
+        self.assertNotIn("question 1", contents[-2])
+        self.assertEqual(contents[-1], "And now?")
+
+    def test_summary_runs_inside_the_request_and_failures_are_logged(self):
+        order = []
+        on_finished = lambda **kwargs: order.append("request_finished")
+        request_finished.connect(on_finished)
+        self.addCleanup(request_finished.disconnect, on_finished)
+
+        def failing_update(report):
+            order.append("update_summary")
+            raise RuntimeError("database is locked")
+
+        self.client.force_login(self.user)
+        with mock.patch("analyzer.llm_gateway.generate", return_value="It is normal."), \
+                mock.patch("analyzer.views.update_summary", failing_update), \
+                self.assertLogs("analyzer.views", "ERROR") as logs:
+            response = self.client.post(
+                reverse("chat_with_report", args=[self.report.id]),
+                data=json.dumps({"message": "Is my iron low?"}), content_type="application/json",
+            )
+        self.assertEqual(response.json(), {"response": "It is normal."})
+        self.assertEqual(order, ["update_summary", "request_finished"])
+        self.assertIn("database is locked", logs.output[0])
+
+    def test_history_pages_walk_back_through_equal_timestamps(self):
+        messages = ChatMessage.objects.bulk_create([
+            ChatMessage(user=self.user, blood_report=self.report, message=f"m{i}", is_bot=bool(i % 2))
+            for i in range(5)
+        ])
+        # Ties on created_at are broken by id
+        ChatMessage.objects.filter(id__in=[m.id for m in messages[1:4]]).update(created_at=messages[1].created_at)
+
+        page, cursor = history_page(self.report, limit=2)
+        self.assertEqual([m.message for m in page], ["m3", "m4"])
+        page, cursor = history_page(self.report, cursor, limit=2)
+        self.assertEqual([m.message for m in page], ["m1", "m2"])
+        page, cursor = history_page(self.report, cursor, limit=2)
+        self.assertEqual(([m.message for m in page], cursor), (["m0"], None))
+
+    def test_history_view_rejects_a_bad_cursor(self):
+        self.client.force_login(self.user)
+        url = reverse("chat_history", args=[self.report.id])
+        self.assertEqual(self.client.get(url, {"cursor": "not-a-cursor"}).status_code, 400)
+
+        data = self.client.get(url, {"limit": 1}).json()
+        self.assertEqual((data["messages"], data["next_cursor"]), ([], None))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("streamer", password="secret")
+        self.report = BloodReport.objects.create(user=self.user, report_file="blood_reports/chat.pdf")
+        self.url = reverse("chat_stream", args=[self.report.id])
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        patcher = mock.patch("analyzer.views.update_summary")
+        self.update_summary = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, client, message="Is my iron low?"):
+        return client.post(self.url, data=json.dumps({"message": message}), content_type="application/json")
+
+    def events(self, body):
+        events = []
+        for block in body.decode().strip().split("\n\n"):
+            event, data = block.split("\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return events
+
+    def test_wsgi_stream_relays_tokens_then_saves(self):
+        with mock.patch("analyzer.llm_gateway.stream", return_value=iter(["It ", "is ", "fine."])):
+            response = self.post(self.client)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            self.update_summary.assert_not_called()
+            body = b"".join(response.streaming_content)
+
+        self.assertEqual(self.events(body), [
+            ("token", {"text": "It "}), ("token", {"text": "is "}), ("token", {"text": "fine."}),
+            ("done", {"response": "It is fine."}),
+        ])
+        self.assertEqual(
+            list(ChatMessage.objects.filter(blood_report=self.report).values_list("message", "is_bot")),
+            [("Is my iron low?", False), ("It is fine.", True)],
+        )
+        self.update_summary.assert_called_once_with(self.report)
+
+    def test_failure_mid_stream_sends_an_error_and_saves_nothing(self):
+        def failing():
+            yield "It "
+            raise LLMTimeoutError("deadline exceeded")
+
+        with mock.patch("analyzer.llm_gateway.stream", return_value=failing()):
+            body = b"".join(self.post(self.client).streaming_content)
+        self.assertEqual([event for event, _ in self.events(body)], ["token", "error"])
+        self.assertFalse(ChatMessage.objects.exists())
+        self.update_summary.assert_not_called()
+
+    async def test_asgi_stream_uses_the_async_gateway(self):
+        async def chunks(contents):
+            for chunk in ["Fine", "."]:
+                yield chunk
+
+        with mock.patch("analyzer.llm_gateway.astream", chunks):
+            response = await self.post(self.async_client)
+            body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(self.events(body)[-1], ("done", {"response": "Fine."}))
+        self.assertEqual(await ChatMessage.objects.filter(blood_report=self.report).acount(), 2)
+
+    def test_requests_are_validated_before_streaming(self):
+        self.assertEqual(self.post(self.client, message="  ").status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.post(self.client).status_code, 401)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DashboardQueryBudgetTests(TestCase):
+    """The dashboard must not issue more queries as a user's history grows"""
+
+    # session, user, latest report, its values, trends data version, the
+    # series (cold cache only), streak, recommendation and today's habits
+    QUERY_BUDGET = 9
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.parameters = [
+            BloodParameter.objects.create(
+                name=name, category="CBC", common_names=name, unit=unit,
+                normal_min=low, normal_max=high,
+            )
+            for name, unit, low, high in [
+                ("Hemoglobin", "g/dL", 13.0, 17.0),
+                ("WBC", "cells/uL", 4000, 11000),
+                ("Platelets", "cells/uL", 150000, 450000),
+            ]
+        ]
+        cls.user = cls.seed_user("history", reports=300)
+        cls.new_user = cls.seed_user("newcomer", reports=2)
+
+    @classmethod
+    def seed_user(cls, username, reports):
+        user = User.objects.create_user(username, password="secret")
+        for i in range(reports):
+            add_report(user, {parameter: parameter.normal_min + i % 7 for parameter in cls.parameters}, reports - i)
+        return user
+
+    def setUp(self):
+        cache.clear()
+        # Parameter changes bump the catalog version; load it and the
+        # percentile sketches outside the budget
+        get_catalog()
+        get_sketches()
+
+    def get_dashboard(self, user):
+        self.client.force_login(user)
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.get(reverse("dashboard"))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_long_history_stays_within_budget(self):
+        response = self.get_dashboard(self.user)
+
+        charts = [param.name for param in response.context["chart_parameters"]]
+        self.assertEqual(charts, ["Hemoglobin", "WBC", "Platelets"])
+
+        # Trends are cached until the user's data changes
+        with self.assertNumQueries(self.QUERY_BUDGET - 1):
+            self.client.get(reverse("dashboard"))
+
+    def test_short_history_uses_the_same_budget(self):
+        response = self.get_dashboard(self.new_user)
+
+        self.assertEqual(len(response.context["chart_parameters"]), 3)
+        self.assertEqual(len(response.context["latest_values"]), 3)
+
+    def test_chart_data_is_downsampled(self):
+        self.client.force_login(self.user)
+        hemoglobin = self.parameters[0]
+        url = reverse("chart_data", args=[hemoglobin.id])
+
+        with self.assertNumQueries(3):
+            series = self.client.get(url, {"points": 50}).json()
+        self.assertEqual(series["total"], 300)
+        self.assertEqual(len(series["values"]), 50)
+        self.assertEqual(series["dates"], sorted(series["dates"]))
+        self.assertEqual(series["min"], 13.0)
+
+        start = (timezone.now() - timedelta(days=30)).date().isoformat()
+        recent = self.client.get(url, {"start": start}).json()
+        self.assertLessEqual(recent["total"], 31)
+        self.assertEqual(len(recent["values"]), recent["total"])
+        self.assertTrue(all(day >= start for day in recent["dates"]))
+
+        self.assertEqual(self.client.get(url, {"start": "2024-13-01"}).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ParameterSeriesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.parameter = create_hemoglobin()
+        self.user = User.objects.create_user("series", password="secret")
+        self.catalog = get_catalog()
+
+    def add_report(self, days_ago, value):
+        return add_report(self.user, {self.parameter: value}, days_ago)
+
+    def series_values(self):
+        return series_points(self.user.id, self.parameter.id)[1]
+
+    def test_save_values_keeps_series_in_upload_order(self):
+        self.add_report(days_ago=1, value=14.0)
+        older = self.add_report(days_ago=5, value=12.0)
+        self.add_report(days_ago=0, value=15.0)
+        self.assertEqual(self.series_values(), [12.0, 14.0, 15.0])
+
+        # Re-extraction replaces the reading in place
+        save_values(older, {self.parameter.id: (12.5, "local")}, self.catalog, update_report=False)
+        self.assertEqual(self.series_values(), [12.5, 14.0, 15.0])
+
+        older.delete()
+        self.assertEqual(self.series_values(), [14.0, 15.0])
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        for days_ago, value in [(3, 13.5), (9, 11.0), (1, 16.0)]:
+            self.add_report(days_ago, value)
+        maintained = [unpack(series) for series in ParameterSeries.objects.all()]
+
+        self.assertEqual(rebuild_series([self.user.id]), 1)
+        self.assertEqual([unpack(series) for series in ParameterSeries.objects.all()], maintained)
+
+    def test_interleaved_appends_keep_both_points(self):
+        self.add_report(days_ago=3, value=13.0)
+        first, second = add_report(self.user, {}, days_ago=2), add_report(self.user, {}, days_ago=1)
+        interleaved = []
+
+        def unpack_then_append(series):
+            arrays = unpack(series)
+            # Another worker appends after this one has read the series
+            if not interleaved:
+                interleaved.append(series.id)
+                record_points(second, {self.parameter.id: (15.0, "local")})
+            return arrays
+
+        with mock.patch("analyzer.series_service.unpack", side_effect=unpack_then_append):
+            record_points(first, {self.parameter.id: (14.0, "local")})
+
+        self.assertTrue(interleaved)
+        self.assertEqual(self.series_values(), [13.0, 14.0, 15.0])
+        self.assertEqual(ParameterSeries.objects.get().version, 2)
+
+
+class DownsampleTests(TestCase):
+    def test_lttb_keeps_ends_and_spikes(self):
+        xs = list(range(1000))
+        ys = [1.0] * 1000
+        ys[437] = 50.0
+        kept = lttb(xs, ys, 20)
+        self.assertEqual(len(kept), 20)
+        self.assertEqual((kept[0], kept[-1]), (0, 999))
+        self.assertIn(437, kept)
+        self.assertEqual(kept, sorted(kept))
+
+    def test_short_series_is_returned_whole(self):
+        self.assertEqual(lttb([1, 2, 3], [4, 5, 6], 10), [0, 1, 2])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TrendAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.parameter = create_hemoglobin()
+
+    def seed(self, username, readings):
+        user = User.objects.create_user(username, password="secret")
+        for days_ago, value in readings:
+            add_report(user, {self.parameter: value}, days_ago)
+        return user
+
+    def test_statistics_match_a_direct_computation(self):
+        readings = [(400, 14.0), (300, 13.5), (200, 12.8), (100, 12.5), (10, 11.0)]
+        user = self.seed("falling", readings)
+        stats = user_trends(user.id)[self.parameter.id]
+
+        days = [-d for d, _ in readings]
+        values = [v for _, v in readings]
+        expected_slope = np.polyfit(days, values, 1)[0] * 365.25
+        self.assertAlmostEqual(stats.slope_per_year, expected_slope, places=3)
+        self.assertEqual(stats.direction, "falling")
+        self.assertAlmostEqual(stats.rate_of_change, (11.0 - 12.5) / 90 * 30, places=3)
+        self.assertEqual(stats.out_of_range_streak, 3)
+        self.assertEqual(stats.longest_out_of_range_streak, 3)
+        baseline = values[:-1]
+        self.assertAlmostEqual(stats.zscore, (11.0 - np.mean(baseline)) / np.std(baseline, ddof=1), places=3)
+        self.assertIn("out of range on the last 3 reports", describe_trend("Hemoglobin", "g/dL", stats))
+
+    def test_cache_follows_new_values(self):
+        user = self.seed("steady", [(20, 14.0), (10, 14.1)])
+        self.assertEqual(user_trends(user.id)[self.parameter.id].count, 2)
+        add_report(user, {self.parameter: 14.2})
+        self.assertEqual(user_trends(user.id)[self.parameter.id].count, 3)
+
+    def test_cohort_batch_covers_every_user(self):
+        users = [self.seed(f"user{i}", [(30, 12.0 + i), (1, 15.0)]) for i in range(4)]
+        cohort = cohort_trends(self.parameter.id)
+        self.assertEqual(set(cohort), {user.id for user in users})
+        self.assertEqual(cohort[users[0].id].out_of_range_streak, 0)
+        self.assertEqual(cohort[users[0].id].longest_out_of_range_streak, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class QuantileSketchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.readings = [float(i) for i in range(20000)]
+        random.Random(0).shuffle(self.readings)
+
+    def sketch_of(self, readings, k=200):
+        sketch = KLLSketch(k)
+        for value in readings:
+            sketch.update(value)
+        return sketch
+
+    def assert_ranks_close(self, sketch, tolerance=0.02):
+        for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99):
+            self.assertAlmostEqual(sketch.quantile(q) / len(self.readings), q, delta=tolerance)
+            self.assertAlmostEqual(sketch.rank(q * len(self.readings)), q, delta=tolerance)
+
+    def test_ranks_within_error_bound(self):
+        sketch = self.sketch_of(self.readings)
+        self.assertEqual(sketch.count, 20000)
+        self.assertLess(sum(len(level) for level in sketch.levels), 3 * 200)
+        self.assertEqual((sketch.quantile(0), sketch.quantile(1)), (0.0, 19999.0))
+        self.assert_ranks_close(sketch)
+
+    def test_merged_halves_match_one_sketch(self):
+        merged = self.sketch_of(self.readings[:7000]).merge(self.sketch_of(self.readings[7000:]))
+        self.assertEqual(merged.count, 20000)
+        self.assert_ranks_close(merged)
+
+    def test_serialization_round_trip(self):
+        sketch = self.sketch_of(self.readings[:5000], k=50)
+        restored = KLLSketch.from_bytes(sketch.to_bytes())
+        self.assertEqual((restored.k, restored.count, restored.levels), (50, 5000, sketch.levels))
+        self.assertEqual(restored.rank(2500.0), sketch.rank(2500.0))
+        self.assertIsNone(KLLSketch.from_bytes(KLLSketch().to_bytes()).rank(1.0))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, PERCENTILE_MIN_READINGS=10)
+class PercentileServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.parameter = create_hemoglobin()
+        self.catalog = get_catalog()
+        self.reports = [
+            add_report(User.objects.create_user(f"user{i}", password="secret"), {self.parameter: 10.0 + i * 0.2})
+            for i in range(40)
+        ]
+
+    def test_values_are_sketched_as_they_are_saved(self):
+        self.assertEqual(ParameterSketch.objects.get(parameter=self.parameter).count, 40)
+        self.assertEqual(reading_percentile(self.parameter.id, 9.0), 0)
+        self.assertEqual(reading_percentile(self.parameter.id, 13.9), 50)
+        self.assertEqual(reading_percentile(self.parameter.id, 20.0), 100)
+
+    def test_every_report_of_a_user_counts(self):
+        add_report(self.reports[0].user, {self.parameter: 10.0})
+        self.assertEqual(get_sketches()[self.parameter.id].count, 41)
+
+    def test_re_extraction_is_not_counted_twice(self):
+        save_values(self.reports[0], {self.parameter.id: (10.1, "local")}, self.catalog, update_report=False)
+        self.assertEqual(get_sketches()[self.parameter.id].count, 40)
+
+    def test_rebuild_drops_deleted_readings(self):
+        for report in self.reports[:30]:
+            report.delete()
+        self.assertEqual(get_sketches()[self.parameter.id].count, 40)
+
+        self.assertEqual(rebuild_sketches(), 1)
+        self.assertEqual(get_sketches()[self.parameter.id].count, 10)
+        self.assertIsNone(reading_percentile(BloodParameter.objects.create(name="WBC", category="CBC").id, 5.0))
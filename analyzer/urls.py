@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path("dashboard/", views.dashboard, name="dashboard"),
+    path("dashboard/chart/<int:parameter_id>/", views.chart_data, name="chart_data"),
     
     # Authentication
     path('register/', views.register_view, name='register'),
@@ -12,10 +13,13 @@ urlpatterns = [
     
     # Blood Report Flow
     path('upload/', views.upload_report, name='upload_report'),
+    path('report/<int:report_id>/status/', views.report_status, name='report_status'),
     path('allergy/<int:report_id>/', views.allergy_info, name='allergy_info'),
     path('recommendations/<int:report_id>/', views.generate_recommendations, name='generate_recommendations'),
     path('reports/', views.report_list, name='report_list'),
     path('report/<int:report_id>/chat/', views.chat_with_report, name='chat_with_report'),
+    path('report/<int:report_id>/chat/stream/', views.chat_stream, name='chat_stream'),
+    path('report/<int:report_id>/chat/history/', views.chat_history, name='chat_history'),
 
     # Progress Tracker
     path('progress/<int:report_id>/', views.progress_tracker, name='progress_tracker'),
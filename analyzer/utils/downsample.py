@@ -0,0 +1,45 @@
+"""
+Downsampling for chart series.
+
+Largest-Triangle-Three-Buckets (Steinarsson, 2013) keeps the first and last
+points and, from each of ``threshold - 2`` equal buckets in between, the
+point forming the largest triangle with the previously kept point and the
+average of the next bucket. Peaks and dips survive, which matters for lab
+values far more than the smooth average a plain bucket mean would give.
+"""
+
+
+def lttb(xs, ys, threshold):
+    """
+    Indices of at most ``threshold`` points of the series ``(xs, ys)``.
+
+    ``xs`` must be sorted. Series already within the threshold are returned
+    whole.
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 1)]
+
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the triangle's third corner
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        count = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / count
+        avg_y = sum(ys[avg_start:avg_end]) / count
+
+        ax, ay = xs[a], ys[a]
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
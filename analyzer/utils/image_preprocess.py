@@ -0,0 +1,210 @@
+"""
+Image clean-up before OCR.
+
+Phone photos of lab reports arrive at full camera resolution, in colour,
+slightly rotated and with desk or shadow around the paper. Tesseract time
+grows with pixel count and drops sharply on clean, upright, black-on-white
+input, so every image goes through these stages first:
+
+    decode -> orient -> grayscale -> downscale -> deskew -> binarize -> crop -> tile
+
+Only Pillow is used so the stage runs anywhere the app does.
+"""
+import time
+from contextlib import contextmanager
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+from django.conf import settings
+
+
+# Lab reports are printed on A4/Letter; used to estimate the scan resolution
+PAGE_WIDTH_INCHES = 8.27
+
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.5
+DESKEW_THUMBNAIL_WIDTH = 600
+
+# Rows/columns with less ink than this fraction are treated as blank
+INK_THRESHOLD = 0.01
+CROP_MARGIN = 20
+
+
+@contextmanager
+def _timed(timings, stage):
+    started = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - started
+
+
+def downscale(image, target_dpi):
+    """Shrink the image so the page is roughly ``target_dpi`` wide"""
+    effective_dpi = image.width / PAGE_WIDTH_INCHES
+    if effective_dpi <= target_dpi:
+        return image
+    scale = target_dpi / effective_dpi
+    size = (round(image.width * scale), round(image.height * scale))
+    return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def otsu_threshold(gray):
+    """Global threshold that best separates the two modes of the histogram"""
+    histogram = gray.histogram()
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+
+    background_weight = background_sum = 0
+    best_variance, threshold = 0, 127
+    for level, count in enumerate(histogram):
+        background_weight += count
+        if background_weight == 0:
+            continue
+        foreground_weight = total - background_weight
+        if foreground_weight == 0:
+            break
+        background_sum += level * count
+        mean_background = background_sum / background_weight
+        mean_foreground = (weighted_total - background_sum) / foreground_weight
+        variance = background_weight * foreground_weight * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance, threshold = variance, level
+    return threshold
+
+
+def ink_map(gray):
+    """
+    How much darker each pixel is than its surroundings.
+
+    Subtracting a blurred background removes shadows and uneven lighting
+    from phone photos, so a single threshold works across the whole page.
+    """
+    radius = max(gray.width // 50, 5)
+    background = gray.filter(ImageFilter.BoxBlur(radius))
+    return ImageChops.subtract(background, gray)
+
+
+def binarize(gray):
+    """Black text on a white page"""
+    ink = ink_map(gray)
+    threshold = max(otsu_threshold(ink), 8)
+    return ink.point(lambda v: 0 if v > threshold else 255, mode="1").convert("L")
+
+
+def row_profile(image):
+    """Fraction of dark pixels in each row of a black-on-white image"""
+    column = image.resize((1, image.height), Image.BOX)
+    return [1 - v / 255 for v in column.getdata()]
+
+
+def column_profile(image):
+    row = image.resize((image.width, 1), Image.BOX)
+    return [1 - v / 255 for v in row.getdata()]
+
+
+def _profile_sharpness(profile):
+    return sum((a - b) ** 2 for a, b in zip(profile, profile[1:]))
+
+
+def estimate_skew(gray):
+    """
+    Angle (degrees) that makes text lines horizontal.
+
+    Text lines give the sharpest row profile when they are level, so a small
+    ink thumbnail is rotated through candidate angles and the sharpest wins.
+    """
+    scale = DESKEW_THUMBNAIL_WIDTH / gray.width
+    if scale < 1:
+        gray = gray.resize((DESKEW_THUMBNAIL_WIDTH, round(gray.height * scale)), Image.BOX)
+    ink = ImageOps.invert(ink_map(gray))
+
+    steps = int(DESKEW_MAX_ANGLE / DESKEW_STEP)
+    best_angle, best_score = 0.0, -1
+    for i in range(-steps, steps + 1):
+        angle = i * DESKEW_STEP
+        rotated = ink.rotate(angle, resample=Image.NEAREST, fillcolor=255)
+        score = _profile_sharpness(row_profile(rotated))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def deskew(gray):
+    angle = estimate_skew(gray)
+    if abs(angle) < DESKEW_STEP:
+        return gray
+    return gray.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=255)
+
+
+def _ink_bounds(profile, factor, length):
+    inked = [i for i, v in enumerate(profile) if v > INK_THRESHOLD]
+    if not inked:
+        return 0, length
+    start = inked[0] * factor - CROP_MARGIN
+    stop = (inked[-1] + 1) * factor + CROP_MARGIN
+    return max(start, 0), min(stop, length)
+
+
+def crop_to_content(binary, factor=4):
+    """
+    Drop the blank or noisy border around the printed table.
+
+    Profiles are taken on a reduced copy, which is faster and averages away
+    isolated specks that would otherwise stretch the bounding box.
+    """
+    reduced = binary.reduce(factor)
+    top, bottom = _ink_bounds(row_profile(reduced), factor, binary.height)
+    left, right = _ink_bounds(column_profile(reduced), factor, binary.width)
+    return binary.crop((left, top, right, bottom))
+
+
+def split_tiles(binary, tile_height):
+    """
+    Split a tall page into horizontal strips.
+
+    Each cut is moved to the emptiest row near its nominal position so no
+    text line is sliced in half; tiles are returned top to bottom.
+    """
+    if binary.height <= tile_height * 1.5:
+        return [binary]
+
+    profile = row_profile(binary)
+    search = tile_height // 6
+    tiles, top = [], 0
+    while binary.height - top > tile_height * 1.5:
+        nominal = top + tile_height
+        window = range(nominal - search, nominal + search)
+        cut = min(window, key=lambda row: profile[row])
+        tiles.append(binary.crop((0, top, binary.width, cut)))
+        top = cut
+    tiles.append(binary.crop((0, top, binary.width, binary.height)))
+    return tiles
+
+
+def preprocess_for_ocr(image, target_dpi=None, tile_height=None):
+    """
+    Run the full preprocessing pipeline.
+
+    Returns ``(tiles, timings)``: OCR-ready images in reading order and the
+    seconds spent in each stage.
+    """
+    target_dpi = target_dpi or settings.OCR_TARGET_DPI
+    tile_height = tile_height or settings.OCR_TILE_HEIGHT
+    timings = {}
+
+    with _timed(timings, "decode"):
+        image.load()
+    with _timed(timings, "orient"):
+        image = ImageOps.exif_transpose(image)
+    with _timed(timings, "grayscale"):
+        image = image.convert("L")
+    with _timed(timings, "downscale"):
+        image = downscale(image, target_dpi)
+    with _timed(timings, "deskew"):
+        image = deskew(image)
+    with _timed(timings, "binarize"):
+        image = binarize(image)
+    with _timed(timings, "crop"):
+        image = crop_to_content(image)
+    with _timed(timings, "tile"):
+        tiles = split_tiles(image, tile_height)
+
+    return tiles, timings
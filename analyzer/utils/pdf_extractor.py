@@ -0,0 +1,168 @@
+"""
+Page-level PDF text extraction.
+
+Pages are split into small ranges and fanned out to a process pool; results
+are yielded page by page in document order so callers never hold more than a
+few pages of text in memory. Pages without a text layer (scanned reports) are
+sent to the OCR pool instead of silently coming back empty.
+"""
+import io
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+from django.conf import settings
+
+from analyzer.ocr_service import ocr_images
+
+
+PAGES_PER_TASK = 4
+
+# Pages with less text than this are treated as scanned images
+MIN_TEXT_CHARS = 20
+
+_executors = {}
+
+
+class PDFTooLargeError(ValueError):
+    pass
+
+
+def _get_executor(workers):
+    if workers not in _executors:
+        _executors[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executors[workers]
+
+
+def _image_xobjects(page):
+    resources = page.get("/Resources") or {}
+    xobjects = resources.get("/XObject") or {}
+    xobjects = xobjects.get_object() if hasattr(xobjects, "get_object") else xobjects
+    return [
+        xobjects[name].get_object()
+        for name in xobjects
+        if xobjects[name].get_object().get("/Subtype") == "/Image"
+    ]
+
+
+def is_image_only(page, text):
+    """A page is a scan when it has almost no text but does embed images"""
+    return len(text.strip()) < MIN_TEXT_CHARS and bool(_image_xobjects(page))
+
+
+def _largest_page_image(page):
+    """Raw bytes of the largest embedded image of a scanned page"""
+    largest = None
+    try:
+        for image_file in page.images:
+            if largest is None or len(image_file.data) > len(largest.data):
+                largest = image_file
+    except Exception:
+        return None
+    return largest.data if largest else None
+
+
+_reader_cache = {}
+
+
+def _open_reader(source):
+    """Open a PdfReader, reusing it across tasks for the same file path"""
+    if isinstance(source, (bytes, bytearray)):
+        return PyPDF2.PdfReader(io.BytesIO(source))
+
+    if source not in _reader_cache:
+        _reader_cache.clear()
+        _reader_cache[source] = PyPDF2.PdfReader(source)
+    return _reader_cache[source]
+
+
+def _extract_page_range(source, start, stop, ocr):
+    """
+    Extract pages [start, stop); runs inside pool workers.
+
+    Returns ``(text, image)`` pairs where ``image`` holds the scan of a page
+    without a text layer, to be OCR'd in one batch by the caller.
+    """
+    reader = _open_reader(source)
+    pages = []
+    for index in range(start, stop):
+        page = reader.pages[index]
+        text = page.extract_text() or ""
+        image = None
+        if ocr and is_image_only(page, text):
+            image = _largest_page_image(page)
+        pages.append((text, image))
+    return pages
+
+
+def _resolve_scans(pages):
+    """Replace scanned pages with their OCR text, batching them through the OCR pool"""
+    scans = [image for _, image in pages if image]
+    if not scans:
+        return [text for text, _ in pages]
+
+    try:
+        ocr_texts = iter(ocr_images(scans))
+    except Exception:
+        ocr_texts = iter([""] * len(scans))
+    return [next(ocr_texts) if image else text for text, image in pages]
+
+
+def _read_source(pdf_file, max_bytes):
+    """Return a file path or the raw bytes of ``pdf_file``, enforcing the size cap"""
+    if isinstance(pdf_file, (str, os.PathLike)):
+        size = os.path.getsize(pdf_file)
+        source = os.fspath(pdf_file)
+    else:
+        pdf_file.seek(0)
+        source = pdf_file.read(max_bytes + 1)
+        size = len(source)
+
+    if size > max_bytes:
+        raise PDFTooLargeError(f"PDF is larger than {max_bytes // (1024 * 1024)} MB")
+    return source
+
+
+def iter_pdf_text(pdf_file, workers=None, max_pages=None, max_bytes=None, ocr=True):
+    """
+    Yield the text of each page of ``pdf_file`` in order.
+
+    ``pdf_file`` may be a path or a binary file object. Only the first
+    ``max_pages`` pages are read; files over ``max_bytes`` are rejected.
+    """
+    workers = workers or settings.PDF_EXTRACTION_WORKERS
+    max_pages = max_pages or settings.PDF_MAX_PAGES
+    max_bytes = max_bytes or settings.PDF_MAX_BYTES
+
+    source = _read_source(pdf_file, max_bytes)
+    page_count = min(len(_open_reader(source).pages), max_pages)
+
+    ranges = [
+        (start, min(start + PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PAGES_PER_TASK)
+    ]
+
+    # Short reports are cheaper to read in-process than to ship to the pool
+    if workers <= 1 or len(ranges) <= 1:
+        for start, stop in ranges:
+            yield from _resolve_scans(_extract_page_range(source, start, stop, ocr))
+        return
+
+    executor = _get_executor(workers)
+    pending = deque()
+    remaining = iter(ranges)
+
+    # Keep a bounded number of ranges in flight so memory stays flat
+    for start, stop in remaining:
+        pending.append(executor.submit(_extract_page_range, source, start, stop, ocr))
+        if len(pending) >= workers * 2:
+            break
+
+    while pending:
+        pages = pending.popleft().result()
+        next_range = next(remaining, None)
+        if next_range:
+            pending.append(executor.submit(_extract_page_range, source, *next_range, ocr))
+        yield from _resolve_scans(pages)
@@ -0,0 +1,160 @@
+"""
+Mergeable quantile sketch (KLL: Karnin, Lang and Liberty, 2016).
+
+Readings are kept in a stack of compactors. An item on level ``h`` stands
+for ``2**h`` readings; when the sketch is full, the lowest level over its
+capacity is sorted and every other item is promoted to the level above.
+Capacities shrink by 2/3 per level below the top, so the sketch stays
+under about ``3k`` items however long the stream, with a rank error of
+roughly ``1.7 / k`` (under 1% at the default ``k`` of 200).
+
+Two sketches merge by concatenating their levels and compacting again,
+which is what lets separate processes summarize their own readings and
+fold them into a shared copy. ``to_bytes`` is a short header plus one
+packed ``array('d')``.
+"""
+import math
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+DEFAULT_K = 200
+MIN_CAPACITY = 2
+
+# Format version, k, readings, levels, next compaction offset, min, max
+HEADER = struct.Struct("<BHQBBdd")
+FORMAT_VERSION = 1
+
+
+class KLLSketch:
+    """Approximate ranks and quantiles of a stream of floats"""
+
+    def __init__(self, k=DEFAULT_K):
+        if not MIN_CAPACITY <= k < 2 ** 16:
+            raise ValueError(f"k must be between {MIN_CAPACITY} and 65535")
+        self.k = k
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [[]]
+        # Alternating which half survives a compaction instead of a coin
+        # flip keeps results reproducible
+        self._offset = 0
+        self._size = 0
+        self._max_size = self._capacity(0)
+        self._cdf = None
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(MIN_CAPACITY, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _grow(self):
+        self.levels.append([])
+        self._max_size = sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self):
+        for h, items in enumerate(self.levels):
+            if len(items) < self._capacity(h):
+                continue
+            if h + 1 == len(self.levels):
+                self._grow()
+            items.sort()
+            # An odd item out stays behind at its own weight
+            leftover = [items.pop()] if len(items) % 2 else []
+            self.levels[h + 1].extend(items[self._offset::2])
+            self.levels[h] = leftover
+            self._offset ^= 1
+            self._size = sum(len(level) for level in self.levels)
+            if self._size < self._max_size:
+                return
+
+    def update(self, value):
+        value = float(value)
+        self.levels[0].append(value)
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self._size += 1
+        self._cdf = None
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other):
+        """Fold ``other`` into this sketch"""
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for h, items in enumerate(other.levels):
+            self.levels[h].extend(items)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._size = sum(len(level) for level in self.levels)
+        self._cdf = None
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def _sorted(self):
+        """Sorted items and cumulative weights, with a leading 0 weight"""
+        if self._cdf is None:
+            weighted = sorted((item, 1 << h) for h, level in enumerate(self.levels) for item in level)
+            items = array("d", (item for item, _ in weighted))
+            cumulative = array("d", [0.0])
+            total = 0.0
+            for _, weight in weighted:
+                total += weight
+                cumulative.append(total)
+            self._cdf = (items, cumulative)
+        return self._cdf
+
+    def rank(self, value):
+        """
+        Share of readings below ``value``, counting equal readings as half,
+        or None for an empty sketch.
+        """
+        if not self.count:
+            return None
+        items, cumulative = self._sorted()
+        below = cumulative[bisect_left(items, value)]
+        at_or_below = cumulative[bisect_right(items, value)]
+        return (below + at_or_below) / 2 / cumulative[-1]
+
+    def quantile(self, q):
+        """Reading at rank ``q`` (0 to 1), or None for an empty sketch"""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        items, cumulative = self._sorted()
+        i = bisect_left(cumulative, q * cumulative[-1], 1) - 1
+        return items[min(i, len(items) - 1)]
+
+    def to_bytes(self):
+        header = HEADER.pack(FORMAT_VERSION, self.k, self.count, len(self.levels), self._offset, self.min, self.max)
+        lengths = array("I", (len(level) for level in self.levels))
+        items = array("d", (item for level in self.levels for item in level))
+        return header + lengths.tobytes() + items.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        version, k, count, n_levels, offset, low, high = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported sketch format {version}")
+        sketch = cls(k)
+        lengths = array("I")
+        lengths.frombytes(data[HEADER.size:HEADER.size + n_levels * lengths.itemsize])
+        items = array("d")
+        items.frombytes(data[HEADER.size + n_levels * lengths.itemsize:])
+
+        sketch.levels, start = [], 0
+        for length in lengths:
+            sketch.levels.append(items[start:start + length].tolist())
+            start += length
+        sketch.count, sketch.min, sketch.max, sketch._offset = count, low, high, offset
+        sketch._size = len(items)
+        sketch._max_size = sum(sketch._capacity(h) for h in range(n_levels))
+        return sketch
@@ -1,7 +1,14 @@
+import hashlib
 import re
-from analyzer.models import BloodParameter, BloodReportValue
-from google import genai
+from functools import lru_cache
+from analyzer.catalog import get_catalog
+from analyzer.chat_service import refresh_chat_context
+from analyzer.gemini_service import analyze_report_structured, generate_text, get_quick_summary
+from analyzer.llm_gateway import LLMError
+from analyzer.models import BloodReportValue
+from analyzer.series_service import record_points
 from django.conf import settings
+from django.db import transaction
 
 def normalize_text(text: str) -> str:
     prompt = """
@@ -10,12 +17,11 @@ def normalize_text(text: str) -> str:
     Example: 'Vitamin B12:148'.
     """
 
-    client = genai.Client(api_key=settings.GEMINI_API_KEY)
-    response = client.models.generate_content(
-        model=settings.MODEL_NAME,
-        contents=[prompt, text]
-    )
-    text = response.text
+    return clean_text(generate_text([prompt, text]))
+
+
+def clean_text(text: str) -> str:
+    """Lowercase and fix common OCR/unit noise; no LLM involved"""
     text = text.lower()
     text=text.strip()
 
@@ -42,48 +48,281 @@ def normalize_text(text: str) -> str:
 
     # Normalize spaces
     text = re.sub(r"\s+", " ", text)
-    # print(text)
 
-    
     return text
 
+# Bump whenever extraction or parsing changes so cached results are not reused
+EXTRACTOR_VERSION = 3
+
+# Bump when the summary prompt changes so stored summaries are regenerated
+SUMMARY_VERSION = 1
+
 NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
 
-def extract_values_from_text(report):
-    text = report.extracted_text.lower()
+# How far after a mention to look for its value
+VALUE_WINDOW = 120
+
+# Values further than this factor outside the normal range are treated as misreads
+PLAUSIBLE_RANGE_FACTOR = 10
+
+
+def _trie_regex(node):
+    """Regex for all words in a prefix trie, trying longer words first"""
+    branches = [
+        re.escape(char) + _trie_regex(child)
+        for char, child in sorted(node.items())
+        if char
+    ]
+    if not branches:
+        return ""
+    if len(branches) == 1 and "" not in node:
+        return branches[0]
+
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if "" in node else pattern
+
+
+class AliasMatcher:
+    """
+    Finds every parameter mention, and the number that follows it, in one
+    pass over the text.
+
+    All aliases are compiled into a single regex, factored as a prefix trie
+    so the engine does not retry every alias at every position, and guarded
+    by word boundaries so short aliases such as "hb" no longer match inside
+    other words. Longer aliases win ("rbc count" over "rbc").
+    """
+
+    def __init__(self, aliases):
+        self._keys = {}
+        for alias, key in aliases:
+            alias = alias.strip().lower()
+            if alias:
+                self._keys.setdefault(alias, key)
 
+        trie = {}
+        for alias in self._keys:
+            node = trie
+            for char in alias:
+                node = node.setdefault(char, {})
+            node[""] = True
 
-    text = normalize_text(text)
-    parameters = BloodParameter.objects.all()
+        self._pattern = (
+            re.compile(rf"(?<![a-z0-9])(?:{_trie_regex(trie)})(?![a-z0-9])")
+            if self._keys else None
+        )
 
-    for param in parameters:
-        value_found = False
+    def find_values(self, text):
+        """Map each key to the first number after its first mention"""
+        if self._pattern is None:
+            return {}
 
-        for alias in param.aliases():
-            pos = text.find(alias)
-            if pos == -1:
+        values = {}
+        mentions = list(self._pattern.finditer(text))
+        for i, mention in enumerate(mentions):
+            key = self._keys[mention.group()]
+            if key in values:
                 continue
 
-            # Look ahead only (safe window)
-            window = text[pos:pos + 120]
+            # A value never belongs to a mention past the next one
+            end = mention.end() + VALUE_WINDOW
+            if i + 1 < len(mentions):
+                end = min(end, mentions[i + 1].start())
+
+            number = NUMBER_PATTERN.search(text, mention.end(), end)
+            if number:
+                values[key] = float(number.group())
+        return values
+
+
+@lru_cache(maxsize=8)
+def get_alias_matcher(aliases):
+    """Compiled matcher for a tuple of ``(alias, key)`` pairs"""
+    return AliasMatcher(aliases)
+
+
+def is_plausible(param, value):
+    if param.normal_min is not None and value < param.normal_min / PLAUSIBLE_RANGE_FACTOR:
+        return False
+    if param.normal_max is not None and value > param.normal_max * PLAUSIBLE_RANGE_FACTOR:
+        return False
+    return True
+
+
+def confidence_score(values, parameters):
+    """Share of the catalog found with a plausible value (0..1)"""
+    if not parameters:
+        return 0.0
+    plausible = sum(
+        1 for param in parameters
+        if param.id in values and is_plausible(param, values[param.id])
+    )
+    return plausible / len(parameters)
+
+
+def parse_values(text, catalog, allow_llm=True, normalize=None):
+    """
+    Tiered extraction: ``{parameter_id: (value, source)}`` and the normalized text.
+
+    The deterministic parser runs on the raw text first. Only when its
+    confidence is below ``PARSER_ESCALATION_THRESHOLD`` (and ``allow_llm``)
+    is the text passed to ``normalize`` (default ``normalize_text``); LLM
+    values then win and plausible local values fill the gaps.
+    """
+    matcher = get_alias_matcher(catalog.alias_index)
+
+    local_text = clean_text(text)
+    local_values = matcher.find_values(local_text)
+    score = confidence_score(local_values, catalog)
+
+    results = {
+        param.id: (local_values[param.id], BloodReportValue.SOURCE_LOCAL)
+        for param in catalog
+        if param.id in local_values and is_plausible(param, local_values[param.id])
+    }
+    if score >= settings.PARSER_ESCALATION_THRESHOLD or not allow_llm:
+        return results, local_text
+
+    llm_text = (normalize or normalize_text)(text)
+    for param_id, value in matcher.find_values(llm_text).items():
+        results[param_id] = (value, BloodReportValue.SOURCE_LLM)
+    return results, llm_text
+
+
+def save_values(report, values, catalog, update_report=True, replace=None):
+    """
+    Write all extracted values for a report in one transaction.
+
+    A single multi-row upsert on the (report, parameter) constraint replaces
+    one SELECT plus INSERT/UPDATE, each with its own commit, per parameter.
+    ``update_report=False`` leaves the report's normalized text and
+    extractor version alone, for partial re-extraction of some parameters.
+    ``replace`` names the parameter ids ``values`` is the full result for
+    (True for all); their stored rows missing from ``values`` are deleted.
+    """
+    rows = [
+        BloodReportValue(
+            report=report,
+            parameter_id=param_id,
+            value=value,
+            unit=catalog.by_id[param_id].unit,
+            source=source,
+        )
+        for param_id, (value, source) in values.items()
+    ]
+
+    with transaction.atomic():
+        if replace is not None:
+            stale = BloodReportValue.objects.filter(report=report).exclude(parameter_id__in=values)
+            if replace is not True:
+                stale = stale.filter(parameter_id__in=replace)
+            stale.delete()
+        BloodReportValue.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["report", "parameter"],
+            update_fields=["value", "unit", "source"],
+        )
+        record_points(report, {row.parameter_id: (row.value, row.unit) for row in rows})
+        if update_report:
+            report.extractor_version = EXTRACTOR_VERSION
+            report.save(update_fields=["normalized_text", "extractor_version"])
+        refresh_chat_context(report.id)
+
+
+def analysis_to_text(parameters):
+    """Render LLM parameter values in the 'name: value' form the matcher reads"""
+    return clean_text("\n".join(f"{name}: {value}" for name, value in parameters.items()))
+
+
+def text_sha256(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def summary_is_current(report):
+    """True if the stored summary was made from this text by this prompt version"""
+    return (
+        bool(report.summary)
+        and report.summary_version == SUMMARY_VERSION
+        and report.summary_source_hash == text_sha256(report.extracted_text)
+    )
+
 
-            numbers = NUMBER_PATTERN.findall(window)
+def set_summary(report, summary):
+    """Store ``summary`` on ``report`` (unsaved) stamped with its source"""
+    report.summary = summary
+    report.summary_version = SUMMARY_VERSION
+    report.summary_source_hash = text_sha256(report.extracted_text)
 
-            if numbers:
-                value = float(numbers[0])
 
-                BloodReportValue.objects.update_or_create(
-                    report=report,
-                    parameter=param,
-                    defaults={
-                        "value": value,
-                        "unit": param.unit
-                    }
-                )
+SUMMARY_FIELDS = ["summary", "summary_version", "summary_source_hash"]
+
+
+def ensure_summary(report):
+    """
+    Generate and save the report's summary unless the stored one is current.
+    Returns True if a summary was generated; a failed LLM call leaves the
+    report without one so the next run tries again.
+    """
+    if summary_is_current(report):
+        return False
+    try:
+        summary = get_quick_summary(report.extracted_text)
+    except LLMError as e:
+        print(f"[WARN] Summary failed for report {report.id}: {e}")
+        return False
+    set_summary(report, summary)
+    report.save(update_fields=SUMMARY_FIELDS)
+    return True
+
+
+def analyze_report(report, catalog):
+    """
+    Run the consolidated LLM analysis and keep its summary and sections on
+    ``report`` (unsaved). Returns the normalized parameter text, or None
+    when the call fails so parsing falls back to ``normalize_text``.
+    """
+    try:
+        analysis = analyze_report_structured(
+            report.extracted_text, [param.name for param in catalog]
+        )
+    except Exception as e:
+        print(f"[WARN] Consolidated analysis failed: {e}")
+        return None
+
+    summary = analysis.pop("summary")
+    if not summary_is_current(report):
+        set_summary(report, summary)
+    parameters = analysis.pop("parameters")
+    report.analysis = analysis
+    return analysis_to_text(parameters)
+
+
+def extract_values_from_text(report):
+    catalog = get_catalog()
+
+    normalize = None
+    analyzed = False
+    if settings.LLM_CONSOLIDATED_ANALYSIS:
+        # One call yields values, summary and analysis, so it is made even
+        # when the local parser alone would be confident
+        llm_text = analyze_report(report, catalog)
+        if llm_text is not None:
+            normalize = lambda text: llm_text
+            analyzed = True
+
+    values, report.normalized_text = parse_values(
+        report.extracted_text, catalog, normalize=normalize
+    )
 
-                print(f"[OK] {param.name} = {value}")
-                value_found = True
-                break
+    for param in catalog:
+        if param.id in values:
+            value, source = values[param.id]
+            print(f"[OK] {param.name} = {value} ({source})")
+        else:
+            print(f"[MISS] {param.name}")
 
-        if not value_found:
-            print(f"[MISS] {param.name}")
\ No newline at end of file
+    with transaction.atomic():
+        save_values(report, values, catalog)
+        if analyzed:
+            report.save(update_fields=[*SUMMARY_FIELDS, "analysis"])
@@ -9,69 +9,91 @@ from .forms import (
     UserRegisterForm, 
     UserLoginForm
 )
-from .gemini_service import (
-    extract_text_from_pdf,
-    extract_text_from_image,
-    analyze_blood_report,
-    get_quick_summary
+from .ingestion_service import (
+    SUPPORTED_EXTENSIONS,
+    enqueue_report,
+    file_extension,
+    file_sha256,
+    find_cached_report,
+    is_ingesting,
+    latest_job,
+    reuse_cached_extraction
 )
-from analyzer.utils.report_parser import extract_values_from_text
 import json
-from django.http import JsonResponse
-from .gemini_service import client
+import logging
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.utils.dateparse import parse_date
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from .catalog import get_catalog
+from .recommendation_service import recommendation_fields
+from .analytics import user_trends
+from .percentile_service import reading_percentile
+from .series_service import day_label, series_points
+from .utils.downsample import lttb
+from .chat_service import conversation_contents, history_page, save_exchange, update_summary
+from . import llm_gateway
+from .llm_gateway import LLMError
+
+
+logger = logging.getLogger(__name__)
+
 
 @login_required
 def dashboard(request):
+    """
+    Latest results, trends and today's habits.
+
+    Runs a fixed number of queries however many reports the user has: the
+    charts only list the parameters the user has history for and fetch
+    their points from chart_data as they are opened. Trend statistics come
+    from the analytics cache and reading percentiles from the in-process
+    sketches.
+    """
     user = request.user
-    reports = BloodReport.objects.filter(user=user)
+    latest_report = BloodReport.objects.filter(user=user).first()
 
-    if not reports.exists():
+    if latest_report is None:
         return render(request, "analyzer/dashboard.html", {"no_reports": True})
 
-    latest_report = reports.first()
-    latest_values = BloodReportValue.objects.filter(report=latest_report).select_related('parameter')
+    latest_values = list(BloodReportValue.objects.filter(report=latest_report))
 
-    if not latest_values.exists():
+    if not latest_values:
         return render(request, "analyzer/dashboard.html", {"no_values": True})
 
+    # Names and reference ranges come from the in-process catalog
+    catalog = get_catalog()
+    trends = user_trends(user.id, catalog)
+    for item in latest_values:
+        item.parameter_info = catalog.by_id.get(item.parameter_id)
+        item.trend = trends.get(item.parameter_id)
+        item.reading_percentile = reading_percentile(item.parameter_id, item.value)
+        item.status = catalog.status(item.parameter_id, item.value)
+        normal_min, normal_max = catalog.reference_range(item.parameter_id)
+        if normal_min is not None and normal_max is not None and normal_max > normal_min:
+            position = (item.value - normal_min) / (normal_max - normal_min) * 100
+            item.position_percentage = round(min(max(position, 0), 100))
+
     # --- NEW: Fetch Streak & Recommendation for the Dashboard ---
     streak = ProgressStreak.objects.filter(user=user, blood_report=latest_report).first()
     
     # We want to show a snippet of recommendations
     recommendation = HealthRecommendation.objects.filter(blood_report=latest_report).first()
 
-    # Progress data (Your existing chart logic)
-    progress_data = {}
-    all_values = (
-        BloodReportValue.objects
-        .filter(report__user=user)
-        .select_related("parameter", "report")
-        .order_by("report__uploaded_at")
-    )
-
-    for val in all_values:
-        param_name = val.parameter.name
-        if param_name not in progress_data:
-            progress_data[param_name] = {
-                "dates": [],
-                "values": [],
-                "unit": val.unit,
-                "min": val.parameter.normal_min, # Added for Chart Annotations
-                "max": val.parameter.normal_max  # Added for Chart Annotations
-            }
-        progress_data[param_name]["dates"].append(val.report.uploaded_at.strftime("%Y-%m-%d"))
-        progress_data[param_name]["values"].append(val.value)
+    daily_habits = list(HabitProgress.objects.filter(
+        user=user,
+        blood_report=latest_report,
+        date=date.today()
+    ))
 
-        today = date.today()
-        daily_habits = HabitProgress.objects.filter(
-            user=user, 
-            blood_report=latest_report, 
-            date=today
-        )
+    # Chart data is fetched per parameter by the page, so this stays small
+    chart_parameters = [catalog.by_id[parameter_id] for parameter_id in sorted(trends) if parameter_id in catalog.by_id]
 
     return render(request, "analyzer/dashboard.html", {
         "latest_values": latest_values,
-        "progress_data": progress_data,
+        "chart_parameters": chart_parameters,
         "streak": streak,
         "recommendation": recommendation,
         "latest_report": latest_report,
@@ -80,6 +102,46 @@ def dashboard(request):
         "daily_habits": daily_habits
     })
 
+@login_required
+def chart_data(request, parameter_id):
+    """
+    One parameter's history for the dashboard charts, downsampled with LTTB
+    to at most ``points`` readings. ``start`` and ``end`` (YYYY-MM-DD,
+    inclusive) limit the date range.
+    """
+    param = get_catalog().by_id.get(parameter_id)
+    if param is None:
+        return JsonResponse({'error': 'Unknown parameter'}, status=404)
+
+    try:
+        points = int(request.GET.get('points', settings.CHART_MAX_POINTS))
+        start, end = (parse_date(request.GET.get(name) or '') for name in ('start', 'end'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid points or date'}, status=400)
+    points = min(max(points, 3), settings.CHART_MAX_POINTS_LIMIT)
+
+    def midnight(day):
+        return datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc).timestamp()
+
+    series = series_points(
+        request.user.id,
+        parameter_id,
+        start=midnight(start) if start else None,
+        end=midnight(end + timedelta(days=1)) if end else None,
+    )
+    timestamps, values, unit = series or ([], [], param.unit)
+    kept = lttb(timestamps, values, points)
+
+    return JsonResponse({
+        'parameter': param.name,
+        'unit': unit,
+        'min': param.normal_min,
+        'max': param.normal_max,
+        'total': len(values),
+        'dates': [day_label(timestamps[i]) for i in kept],
+        'values': [values[i] for i in kept],
+    })
+
 def home(request):
     """Home page"""
     # if request.user.is_authenticated:
@@ -141,32 +203,78 @@ def upload_report(request):
     if request.method == 'POST':
         form = BloodReportUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            blood_report = form.save(commit=False)
-            blood_report.user = request.user  # Assign current user
-            
-            # Extract text from uploaded file
             file = request.FILES['report_file']
-            file_extension = file.name.split('.')[-1].lower()
-            
-            if file_extension == 'pdf':
-                blood_report.extracted_text = extract_text_from_pdf(file)
-            elif file_extension in ['jpg', 'jpeg', 'png']:
-                blood_report.extracted_text = extract_text_from_image(file)
-            else:
+            if file_extension(file.name) not in SUPPORTED_EXTENSIONS:
                 messages.error(request, 'Unsupported file format. Please upload PDF or image.')
                 return redirect('upload_report')
-            
+
+            blood_report = form.save(commit=False)
+            blood_report.user = request.user  # Assign current user
+            blood_report.content_hash = file_sha256(file)
             blood_report.save()
-            
-            extract_values_from_text(blood_report)
-            messages.success(request, 'Blood report uploaded successfully!')
-            return redirect('allergy_info', report_id=blood_report.id)
+
+            # Same file parsed before: skip OCR and LLM parsing entirely
+            cached_report = find_cached_report(blood_report.content_hash, exclude_id=blood_report.id)
+            if cached_report:
+                reuse_cached_extraction(blood_report, cached_report)
+                messages.success(request, 'Blood report uploaded successfully!')
+                return redirect('allergy_info', report_id=blood_report.id)
+
+            # Text extraction and value parsing run in the ingestion worker
+            enqueue_report(blood_report)
+            messages.success(request, 'Blood report uploaded! We are extracting your values now.')
+            return redirect(f"{reverse('upload_report')}?report={blood_report.id}")
     else:
         form = BloodReportUploadForm()
-    
-    return render(request, 'analyzer/upload_report.html', {'form': form})
 
-from django.conf import settings
+    pending_report = None
+    report_id = request.GET.get('report')
+    if report_id and report_id.isdigit():
+        pending_report = BloodReport.objects.filter(id=report_id, user=request.user).first()
+
+    return render(request, 'analyzer/upload_report.html', {
+        'form': form,
+        'pending_report': pending_report
+    })
+
+
+@login_required
+def report_status(request, report_id):
+    """Ingestion progress of an uploaded report, polled by the upload page"""
+    blood_report = get_object_or_404(BloodReport, id=report_id, user=request.user)
+    job = latest_job(blood_report)
+
+    status = job.status if job else IngestionJob.STATUS_DONE
+    data = {
+        'report_id': blood_report.id,
+        'status': status,
+        'attempts': job.attempts if job else 0,
+        'max_attempts': job.max_attempts if job else 0,
+        'error': job.last_error if job else '',
+    }
+    if status == IngestionJob.STATUS_DONE:
+        data['next_url'] = reverse('allergy_info', kwargs={'report_id': blood_report.id})
+    return JsonResponse(data)
+
+class _JsonResponseThen(JsonResponse):
+    """JsonResponse that runs ``after`` once the server has sent it"""
+
+    def __init__(self, data, after, **kwargs):
+        super().__init__(data, **kwargs)
+        self._after = after
+
+    def close(self):
+        after, self._after = self._after, None
+        try:
+            # Before super().close(), which ends the request and closes its DB connections
+            if after is not None:
+                after()
+        except Exception:
+            logger.exception("Post-response work failed")
+        finally:
+            super().close()
+
+
 @login_required
 def chat_with_report(request, report_id):
     if request.method == "POST":
@@ -174,41 +282,123 @@ def chat_with_report(request, report_id):
         data = json.loads(request.body)
         user_query = data.get('message')
 
-        # 1. Prepare Context
-        values = BloodReportValue.objects.filter(report=report)
-        metrics_summary = ", ".join([f"{v.parameter.name}: {v.value} {v.unit}" for v in values])
-        
-        # 2. Build the System Prompt
-        system_prompt = f"""
-        You are a helpful medical lab assistant. 
-        The patient's blood report results are: {metrics_summary}.
-        Rules: 
-        1. Answer based ONLY on these results. 
-        2. If they ask for a diagnosis, tell them to consult a doctor. 
-        3. Keep answers concise and supportive.
-        """
-
-        # 3. Call Gemini
-        response = client.models.generate_content(
-            model=settings.MODEL_NAME,
-            contents=[system_prompt, user_query]
-        )
-        
-        bot_response = response.text
+        # 1. Build the prompt: report values, conversation memory, question
+        contents = conversation_contents(report, user_query)
+
+        # 2. Call Gemini
+        try:
+            bot_response = llm_gateway.generate(contents)
+        except LLMError:
+            return JsonResponse({'error': 'The assistant is unavailable right now.'}, status=503)
+
+        # 3. Save to Database
+        save_exchange(request.user, report, user_query, bot_response)
+
+        # The summary may call the LLM; do it after the answer is sent
+        return _JsonResponseThen({'response': bot_response}, after=lambda: update_summary(report))
+
 
-        # 4. Save to Database
-        ChatMessage.objects.create(user=request.user, blood_report=report, message=user_query, is_bot=False)
-        ChatMessage.objects.create(user=request.user, blood_report=report, message=bot_response, is_bot=True)
+@login_required
+def chat_history(request, report_id):
+    """
+    Chat messages a page at a time, newest page first. Pass the returned
+    ``next_cursor`` as ``cursor`` to load the page before it.
+    """
+    report = get_object_or_404(BloodReport, id=report_id, user=request.user)
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        messages_page, next_cursor = history_page(report, request.GET.get('cursor'), limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+    return JsonResponse({
+        'messages': [
+            {
+                'id': message.id,
+                'message': message.message,
+                'is_bot': message.is_bot,
+                'created_at': message.created_at.isoformat(),
+            }
+            for message in messages_page
+        ],
+        'next_cursor': next_cursor,
+    })
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def chat_stream(request, report_id):
+    """
+    Streaming variant of chat_with_report: relays the answer as Server-Sent
+    Events (token, then done or error) and saves the exchange once the
+    answer is complete.
+    """
+    if request.method != "POST":
+        return JsonResponse({'error': 'POST required'}, status=405)
 
-        return JsonResponse({'response': bot_response})
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return JsonResponse({'error': 'Login required'}, status=401)
+    report = await BloodReport.objects.filter(id=report_id, user=user).afirst()
+    if report is None:
+        return JsonResponse({'error': 'Report not found'}, status=404)
+
+    user_query = (json.loads(request.body).get('message') or '').strip()
+    if not user_query:
+        return JsonResponse({'error': 'Empty message'}, status=400)
+    contents = await sync_to_async(conversation_contents)(report, user_query)
+
+    async def events():
+        parts = []
+        try:
+            async for chunk in llm_gateway.astream(contents):
+                parts.append(chunk)
+                yield _sse('token', {'text': chunk})
+        except LLMError:
+            yield _sse('error', {'error': 'The assistant is unavailable right now.'})
+            return
+        bot_response = "".join(parts)
+        await sync_to_async(save_exchange)(user, report, user_query, bot_response)
+        yield _sse('done', {'response': bot_response})
+        # After 'done' so the client is not kept waiting for the summary
+        await sync_to_async(update_summary)(report)
+
+    def sync_events():
+        # Under WSGI an async iterator would be buffered whole, so stream
+        # from the gateway's sync bridge instead
+        parts = []
+        try:
+            for chunk in llm_gateway.stream(contents):
+                parts.append(chunk)
+                yield _sse('token', {'text': chunk})
+        except LLMError:
+            yield _sse('error', {'error': 'The assistant is unavailable right now.'})
+            return
+        bot_response = "".join(parts)
+        save_exchange(user, report, user_query, bot_response)
+        yield _sse('done', {'response': bot_response})
+        update_summary(report)
+
+    is_asgi = hasattr(request, 'scope')
+    response = StreamingHttpResponse(
+        events() if is_asgi else sync_events(),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
 
 @login_required
 def allergy_info(request, report_id):
     """Collect allergy information - Step 2"""
     blood_report = get_object_or_404(BloodReport, id=report_id, user=request.user)
+
+    if is_ingesting(blood_report):
+        return redirect(f"{reverse('upload_report')}?report={blood_report.id}")
     
-    # Get quick summary of blood report
-    summary = get_quick_summary(blood_report.extracted_text)
+    # Produced once at ingestion; this page never calls the LLM
+    summary = blood_report.summary
     
     if request.method == 'POST':
         form = AllergyForm(request.POST)
@@ -259,26 +449,17 @@ def generate_recommendations(request, report_id):
         recommendation = blood_report.recommendation
         messages.info(request, 'Showing previously generated recommendations.')
     except HealthRecommendation.DoesNotExist:
-        # Generate new recommendations
-        allergies_dict = {
-            'user_mentioned': allergy_info.user_mentioned_allergies,
-            'common': allergy_info.common_allergies_response
-        }
-        
-        # Call Gemini API
-        analysis_result = analyze_blood_report(
-            blood_report.extracted_text,
-            allergies_dict
-        )
+        # The allergy-independent analysis was prefetched after ingestion, so
+        # this is normally just a local allergen filter over the points
+        try:
+            fields = recommendation_fields(blood_report, allergy_info)
+        except (LLMError, ValueError):
+            # Nothing is saved, so reloading the page retries
+            messages.error(request, 'The AI service is busy right now. Please try again in a minute.')
+            return redirect('report_list')
         
         # Save recommendations
-        recommendation = HealthRecommendation.objects.create(
-            blood_report=blood_report,
-            detailed_analysis=analysis_result['detailed_analysis'],
-            foods_to_eat=analysis_result['foods_to_eat'],
-            foods_to_avoid=analysis_result['foods_to_avoid'],
-            daily_habits=analysis_result['daily_habits']
-        )
+        recommendation = HealthRecommendation.objects.create(blood_report=blood_report, **fields)
         
         messages.success(request, 'Health recommendations generated successfully!')
     
@@ -296,7 +477,6 @@ def report_list(request):
     reports = BloodReport.objects.filter(user=request.user).order_by('-uploaded_at')
     return render(request, 'analyzer/report_list.html', {'reports': reports})
 
-from datetime import date, timedelta
 from django.db.models import Count, Q
 from .models import HabitProgress, ProgressStreak
 
@@ -0,0 +1,96 @@
+"""
+Alias matching cost as the parameter catalog grows.
+
+Compares the old per-parameter, per-alias ``text.find`` + window regex loop
+with the compiled single-pass ``AliasMatcher`` on a synthetic normalized
+report that mentions every parameter once.
+
+    python benchmarks/bench_alias_matcher.py --sizes 14 100 300 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "health_advisor.settings")
+
+import django
+django.setup()
+
+from analyzer.utils.report_parser import NUMBER_PATTERN, AliasMatcher
+
+BASE_CATALOG = [
+    ("Hemoglobin", "Hb,HGB"), ("RBC", "RBC,RBC Count"), ("WBC", "WBC,TLC"),
+    ("Platelets", "PLT,Platelet Count"), ("Hematocrit", "HCT,PCV"), ("MCV", "MCV"),
+    ("MCH", "MCH"), ("MCHC", "MCHC"), ("RDW", "RDW"), ("Neutrophils", "Neut,Neutrophils"),
+    ("Lymphocytes", "Lymph,Lymphocytes"), ("Monocytes", "Mono,Monocytes"),
+    ("Eosinophils", "Eos,Eosinophils"), ("Basophils", "Baso,Basophils"),
+]
+
+
+def build_catalog(size):
+    catalog = [(name, [a.strip().lower() for a in aliases.split(",")]) for name, aliases in BASE_CATALOG]
+    for i in range(len(catalog), size):
+        catalog.append((f"Marker {i}", [f"marker {i}", f"mk{i}", f"analyte {i} level"]))
+    return catalog[:size]
+
+
+def build_text(catalog):
+    rng = random.Random(0)
+    lines = [f"{rng.choice(aliases)}:{rng.uniform(1, 500):.1f}" for _, aliases in catalog]
+    rng.shuffle(lines)
+    return " ".join(lines)
+
+
+def legacy_match(catalog, text):
+    values = {}
+    for name, aliases in catalog:
+        for alias in aliases:
+            pos = text.find(alias)
+            if pos == -1:
+                continue
+            numbers = NUMBER_PATTERN.findall(text[pos:pos + 120])
+            if numbers:
+                values[name] = float(numbers[0])
+                break
+    return values
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[14, 100, 300, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'params':>6} {'legacy':>10} {'compile':>10} {'match':>10} {'speedup':>8}  found legacy/compiled")
+    for size in args.sizes:
+        catalog = build_catalog(size)
+        text = build_text(catalog)
+        pairs = tuple((alias, name) for name, aliases in catalog for alias in aliases)
+
+        legacy_time, legacy_values = best_of(lambda: legacy_match(catalog, text), args.repeat)
+        compile_time, matcher = best_of(lambda: AliasMatcher(pairs), args.repeat)
+        match_time, values = best_of(lambda: matcher.find_values(text), args.repeat)
+
+        print(
+            f"{size:>6} {legacy_time * 1000:>8.2f}ms {compile_time * 1000:>8.2f}ms "
+            f"{match_time * 1000:>8.2f}ms {legacy_time / match_time:>7.1f}x  "
+            f"{len(legacy_values)}/{len(values)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
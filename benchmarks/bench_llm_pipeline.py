@@ -0,0 +1,139 @@
+"""
+End-to-end latency of upload -> ingestion -> allergy page -> recommendations
+with the LLM replaced by the deterministic fake, so it runs offline and
+costs no quota.
+
+Each upload is the sample CBC report made unique with a trailing comment,
+so neither the extraction cache nor the LLM response cache short-circuits
+the pipeline (pass --llm-cache to measure with the response cache on).
+
+    python benchmarks/bench_llm_pipeline.py --reports 50 --latency 0.3 --error-rate 0.05
+
+    # Through the HTTP stand-in instead of the in-process fake
+    python manage.py run_fake_llm_server --quiet &
+    python benchmarks/bench_llm_pipeline.py --backend analyzer.llm_backends.HTTPBackend
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "health_advisor.settings")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--backend", default="analyzer.llm_backends.FakeBackend")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--llm-cache", action="store_true")
+    return parser.parse_args()
+
+
+args = parse_args()
+# Settings are read at django.setup(), so configure the fake first
+os.environ["LLM_BACKEND"] = args.backend
+os.environ["LLM_FAKE_LATENCY"] = str(args.latency)
+os.environ["LLM_FAKE_ERROR_RATE"] = str(args.error_rate)
+os.environ["LLM_FAKE_THROTTLE_RATE"] = str(args.throttle_rate)
+os.environ["LLM_CACHE_ENABLED"] = "1" if args.llm_cache else "0"
+os.environ.setdefault("GOOGLE_API_KEY", "offline")
+os.environ.setdefault("MODEL", "fake-model")
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from analyzer.ingestion_service import claim_next_job, run_job
+from analyzer.models import BloodReport, IngestionJob
+
+SAMPLE_PDF = BASE_DIR / "media" / "blood_reports" / "CBC-test-report-format-example-sample-template-Drlogy-lab-report.pdf"
+
+STAGES = ["upload", "ingest", "allergy_page", "allergy_submit", "recommendations"]
+
+
+def run_report(client, pdf_bytes, i):
+    timings = {}
+
+    started = time.perf_counter()
+    upload = SimpleUploadedFile(f"report-{i}.pdf", pdf_bytes + f"\n% bench {i}\n".encode(), "application/pdf")
+    client.post(reverse("upload_report"), {"report_file": upload})
+    timings["upload"] = time.perf_counter() - started
+    report = BloodReport.objects.latest("id")
+
+    started = time.perf_counter()
+    job = claim_next_job()
+    while job is not None:
+        run_job(job)
+        job = claim_next_job()
+    timings["ingest"] = time.perf_counter() - started
+    status = IngestionJob.objects.filter(blood_report=report).latest("id").status
+
+    started = time.perf_counter()
+    client.get(reverse("allergy_info", args=[report.id]))
+    timings["allergy_page"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    client.post(reverse("allergy_info", args=[report.id]), {"user_mentioned_allergies": ""})
+    timings["allergy_submit"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    client.get(reverse("generate_recommendations", args=[report.id]))
+    timings["recommendations"] = time.perf_counter() - started
+
+    return timings, status, report.bloodreportvalue_set.count()
+
+
+def main():
+    setup_test_environment()
+    pdf_bytes = SAMPLE_PDF.read_bytes()
+
+    with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp, INGESTION_RETRY_DELAY=0):
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tmp, "bench.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            call_command("load_parameters", stdout=open(os.devnull, "w"))
+            User.objects.create_user("bench", password="bench")
+            client = Client()
+            client.login(username="bench", password="bench")
+
+            results = {stage: [] for stage in STAGES}
+            statuses, values = [], []
+            started = time.perf_counter()
+            for i in range(args.reports):
+                timings, status, count = run_report(client, pdf_bytes, i)
+                for stage, seconds in timings.items():
+                    results[stage].append(seconds)
+                statuses.append(status)
+                values.append(count)
+            elapsed = time.perf_counter() - started
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f"backend={args.backend} latency={args.latency}s errors={args.error_rate:.0%} "
+          f"throttled={args.throttle_rate:.0%} llm_cache={'on' if args.llm_cache else 'off'}")
+    print(f"{args.reports} reports in {elapsed:.1f}s ({args.reports / elapsed:.2f} reports/s), "
+          f"{statuses.count(IngestionJob.STATUS_DONE)} ingested, "
+          f"{statistics.mean(values):.1f} values per report")
+    for stage in STAGES:
+        samples = sorted(results[stage])
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(f"  {stage:<16} p50 {statistics.median(samples) * 1000:7.0f} ms   p95 {p95 * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+OCR latency and peak memory with and without preprocessing.
+
+Runs each sample image in media/blood_reports (plus a simulated phone photo
+of each: upscaled to camera resolution and slightly rotated) through
+
+  * baseline:    Image.open -> pytesseract.image_to_string (the old path)
+  * preprocess:  ocr_service.ocr_document (clean-up, tiling, parallel OCR)
+
+Every run happens in a forked process so peak RSS (including the tesseract
+child processes) is measured per variant.
+
+    python benchmarks/bench_ocr_preprocess.py
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+from multiprocessing import get_context
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "health_advisor.settings")
+
+SAMPLES_DIR = BASE_DIR / "media" / "blood_reports"
+PHONE_WIDTH = 4032
+
+
+def _load(path, phone):
+    from PIL import Image
+    image = Image.open(path)
+    if phone:
+        height = round(image.height * PHONE_WIDTH / image.width)
+        image = image.convert("RGB").resize((PHONE_WIDTH, height)).rotate(2.0, expand=True, fillcolor=(235, 235, 235))
+    return image
+
+
+def _run(variant, path, phone, queue):
+    import django
+    django.setup()
+    import pytesseract
+    from django.conf import settings
+    from analyzer import ocr_service
+    from analyzer.ocr_service import ocr_document
+    from analyzer.utils.image_preprocess import preprocess_for_ocr
+
+    if settings.TESSERACT_CMD:
+        pytesseract.pytesseract.tesseract_cmd = settings.TESSERACT_CMD
+
+    image = _load(path, phone)
+    started = time.perf_counter()
+    error = ""
+    timings = {}
+    try:
+        if variant == "baseline":
+            pytesseract.image_to_string(image)
+        else:
+            _, timings = ocr_document(image)
+    except Exception as e:
+        error = type(e).__name__
+        if variant != "baseline":
+            # No OCR engine here: still time the preprocessing stages
+            _, timings = preprocess_for_ocr(_load(path, phone))
+    elapsed = time.perf_counter() - started
+    ocr_service.shutdown()
+
+    peak_kb = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    queue.put((elapsed, peak_kb / 1024, timings, error))
+
+
+def measure(variant, path, phone):
+    ctx = get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(variant, str(path), phone, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-phone", action="store_true", help="Skip simulated phone photos")
+    args = parser.parse_args()
+
+    samples = sorted(p for p in SAMPLES_DIR.iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg"))
+    cases = [(p, False) for p in samples]
+    if not args.no_phone:
+        cases += [(p, True) for p in samples]
+
+    for path, phone in cases:
+        label = f"{path.name}{' (phone)' if phone else ''}"
+        base_time, base_mem, _, base_error = measure("baseline", path, phone)
+        new_time, new_mem, timings, new_error = measure("preprocess", path, phone)
+
+        stages = " ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+        print(f"{label}")
+        print(f"  baseline   {base_time:7.2f}s  peak {base_mem:7.1f} MB  {base_error}")
+        print(f"  preprocess {new_time:7.2f}s  peak {new_mem:7.1f} MB  {new_error}")
+        print(f"  stages     {stages}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Wall-clock scaling of page-parallel PDF extraction with worker count.
+
+Builds a multi-page lab report by repeating the sample CBC report and times
+``iter_pdf_text`` with 1, 2, 4, ... workers up to the machine's core count.
+
+    python benchmarks/bench_pdf_extraction.py --pages 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "health_advisor.settings")
+
+import django
+django.setup()
+
+import PyPDF2
+from analyzer.utils.pdf_extractor import iter_pdf_text
+
+SAMPLE_PDF = BASE_DIR / "media" / "blood_reports" / "CBC-test-report-format-example-sample-template-Drlogy-lab-report.pdf"
+
+
+def build_report(pages, path):
+    sample = PyPDF2.PdfReader(str(SAMPLE_PDF))
+    writer = PyPDF2.PdfWriter()
+    for i in range(pages):
+        writer.add_page(sample.pages[i % len(sample.pages)])
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def worker_counts(max_workers):
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "report.pdf")
+        build_report(args.pages, path)
+        print(f"{args.pages}-page report, {os.path.getsize(path) / 1024:.0f} KB")
+
+        baseline = None
+        for workers in worker_counts(args.max_workers):
+            # Warm the pool so process start-up is not part of the timing
+            list(iter_pdf_text(path, workers=workers, max_pages=args.pages))
+
+            best = float("inf")
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                chars = sum(len(text) for text in iter_pdf_text(path, workers=workers, max_pages=args.pages))
+                best = min(best, time.perf_counter() - started)
+
+            baseline = baseline or best
+            print(
+                f"workers={workers:<3} {best:7.3f}s  "
+                f"{args.pages / best:7.1f} pages/s  speedup x{baseline / best:.2f}  ({chars} chars)"
+            )
+
+
+if __name__ == "__main__":
+    main()
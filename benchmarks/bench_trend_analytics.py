@@ -0,0 +1,163 @@
+"""
+Trend statistics for many users: Python loops over BloodReportValue versus
+the vectorized analytics module over packed series.
+
+Seeds a throwaway on-disk SQLite test database with ``users x reports``
+reports of every catalog parameter (112k value rows by default), then times
+
+  * loop:    per user, read the values joined to their reports and compute
+             slope, streaks and z-scores in plain Python
+  * vector:  analytics.user_trends per user with a cold cache
+  * cached:  analytics.user_trends per user again (data version lookup only)
+  * cohort:  analytics.cohort_trends, one batch per parameter for all users
+
+    python benchmarks/bench_trend_analytics.py --users 200 --reports 40
+
+With only a few reports per user the vector path is bound by the one query
+per user, like the loop; its advantage grows with the history length.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "health_advisor.settings")
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from analyzer.analytics import cohort_trends, user_trends
+from analyzer.catalog import get_catalog, invalidate_catalog
+from analyzer.models import BloodReport, BloodReportValue
+from analyzer.series_service import rebuild_series
+
+
+def seed(users, reports, catalog):
+    rng = random.Random(0)
+    User.objects.bulk_create(
+        [User(username=f"bench{i}") for i in range(users)], batch_size=1000
+    )
+    user_ids = list(User.objects.filter(username__startswith="bench").values_list("id", flat=True))
+
+    BloodReport.objects.bulk_create(
+        [BloodReport(user_id=user_id, report_file="bench.pdf") for user_id in user_ids for _ in range(reports)],
+        batch_size=2000,
+    )
+    created = list(BloodReport.objects.order_by("id"))
+    start = timezone.now() - timedelta(days=reports * 60)
+    for i, report in enumerate(created):
+        report.uploaded_at = start + timedelta(days=(i % reports) * 60 + rng.randint(0, 30))
+    BloodReport.objects.bulk_update(created, ["uploaded_at"], batch_size=2000)
+
+    rows = []
+    for report in created:
+        for param in catalog:
+            low, high = param.normal_min or 0, param.normal_max or 100
+            value = rng.uniform(low - (high - low) * 0.3, high + (high - low) * 0.3)
+            rows.append(BloodReportValue(report=report, parameter_id=param.id, value=value, unit=param.unit))
+    BloodReportValue.objects.bulk_create(rows, batch_size=5000)
+    rebuild_series()
+    return user_ids, len(rows)
+
+
+def loop_trends(user_id, catalog):
+    """The straightforward version: group rows per parameter, then loop"""
+    series = {}
+    rows = (
+        BloodReportValue.objects
+        .filter(report__user_id=user_id)
+        .order_by("report__uploaded_at", "report_id")
+        .values_list("parameter_id", "report__uploaded_at", "value")
+    )
+    for parameter_id, uploaded_at, value in rows:
+        series.setdefault(parameter_id, []).append((uploaded_at.timestamp() / 86400, value))
+
+    trends = {}
+    for parameter_id, points in series.items():
+        low, high = catalog.reference_range(parameter_id)
+        n = len(points)
+        mean_t = sum(t for t, _ in points) / n
+        mean_v = sum(v for _, v in points) / n
+        var_t = sum((t - mean_t) ** 2 for t, _ in points)
+        slope = sum((t - mean_t) * (v - mean_v) for t, v in points) / var_t * 365.25 if var_t else None
+
+        streak = longest = 0
+        for _, v in points:
+            out = (low is not None and v < low) or (high is not None and v > high)
+            streak = streak + 1 if out else 0
+            longest = max(longest, streak)
+
+        zscore = None
+        baseline = [v for _, v in points[:-1]]
+        if len(baseline) >= 2:
+            mean_b = sum(baseline) / len(baseline)
+            std_b = math.sqrt(sum((v - mean_b) ** 2 for v in baseline) / (len(baseline) - 1))
+            if std_b:
+                zscore = (points[-1][1] - mean_b) / std_b
+        trends[parameter_id] = (slope, streak, longest, zscore)
+    return trends
+
+
+def timed(label, rows, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<8} {elapsed:7.2f}s  {rows / elapsed:10.0f} rows/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reports", type=int, default=40)
+    args = parser.parse_args()
+
+    locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    with tempfile.TemporaryDirectory() as tmp, override_settings(CACHES=locmem):
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tmp, "bench.sqlite3")
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            call_command("load_parameters", stdout=open(os.devnull, "w"))
+            invalidate_catalog()
+            catalog = get_catalog()
+
+            started = time.perf_counter()
+            user_ids, rows = seed(args.users, args.reports, catalog)
+            print(f"seeded {rows} value rows for {len(user_ids)} users in {time.perf_counter() - started:.1f}s")
+
+            loop = timed("loop", rows, lambda: {u: loop_trends(u, catalog) for u in user_ids})
+            cache.clear()
+            vector = timed("vector", rows, lambda: {u: user_trends(u, catalog) for u in user_ids})
+            timed("cached", rows, lambda: {u: user_trends(u, catalog) for u in user_ids})
+            timed("cohort", rows, lambda: [cohort_trends(param.id, catalog=catalog) for param in catalog])
+
+            # Both paths must agree
+            for user_id in user_ids[:50]:
+                for parameter_id, (slope, streak, longest, zscore) in loop[user_id].items():
+                    stats = vector[user_id][parameter_id]
+                    assert math.isclose(stats.slope_per_year, slope, rel_tol=1e-6, abs_tol=1e-6)
+                    assert (stats.out_of_range_streak, stats.longest_out_of_range_streak) == (streak, longest)
+                    assert (stats.zscore is None) == (zscore is None)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
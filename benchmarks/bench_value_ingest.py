@@ -0,0 +1,96 @@
+"""
+Rows/sec when writing extracted values for many reports.
+
+Runs against a throwaway on-disk SQLite test database (so commit/fsync cost
+is real) and compares
+
+  * per_row:  one update_or_create per parameter, autocommit (old parser)
+  * bulk:     report_parser.save_values, one upsert transaction per report
+
+    python benchmarks/bench_value_ingest.py --reports 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "health_advisor.settings")
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+from analyzer.catalog import get_catalog, invalidate_catalog
+from analyzer.models import BloodReport, BloodReportValue
+from analyzer.utils.report_parser import save_values
+
+
+def make_reports(count):
+    BloodReport.objects.bulk_create(
+        [BloodReport(report_file=f"bench/{i}.pdf") for i in range(count)],
+        batch_size=500,
+    )
+    return list(BloodReport.objects.order_by("id"))[-count:]
+
+
+def random_values(catalog, rng):
+    return {
+        param.id: (round(rng.uniform(1, 100), 2), BloodReportValue.SOURCE_LOCAL)
+        for param in catalog
+    }
+
+
+def per_row(reports, catalog, rng):
+    for report in reports:
+        for param_id, (value, source) in random_values(catalog, rng).items():
+            BloodReportValue.objects.update_or_create(
+                report=report,
+                parameter_id=param_id,
+                defaults={"value": value, "unit": catalog.by_id[param_id].unit, "source": source},
+            )
+
+
+def bulk(reports, catalog, rng):
+    for report in reports:
+        save_values(report, random_values(catalog, rng), catalog)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tmp, "bench.sqlite3")
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            call_command("load_parameters", stdout=open(os.devnull, "w"))
+            invalidate_catalog()
+            catalog = get_catalog()
+            rng = random.Random(0)
+
+            for name, writer in (("per_row", per_row), ("bulk", bulk)):
+                # Fresh reports for inserts, then the same reports again for updates
+                reports = make_reports(args.reports)
+                for phase in ("insert", "update"):
+                    started = time.perf_counter()
+                    writer(reports, catalog, rng)
+                    elapsed = time.perf_counter() - started
+                    rows = len(reports) * len(catalog)
+                    print(f"{name:<8} {phase:<7} {rows} rows in {elapsed:6.2f}s  {rows / elapsed:9.0f} rows/s")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
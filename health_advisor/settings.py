@@ -86,9 +86,85 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Shared by all worker processes on this host (e.g. parameter catalog version)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR', BASE_DIR / '.cache'),
+    }
+}
+
 # Gemini API Key
 GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
 MODEL_NAME = os.getenv("MODEL")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))  # seconds per request
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 10))  # pooled per process
+
+# LLM gateway limits, per process (see analyzer/llm_gateway.py)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", 5))  # calls per second, 0 disables
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", 10))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))  # seconds, doubled per retry
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 8))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", 90))  # seconds per call including retries
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", 5))  # consecutive failures
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))  # seconds
+
+# Which model the gateway talks to (see analyzer/llm_backends.py). For
+# offline load tests use analyzer.llm_backends.FakeBackend, or HTTPBackend
+# together with `manage.py run_fake_llm_server`.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "analyzer.llm_backends.GeminiBackend")
+LLM_HTTP_URL = os.getenv("LLM_HTTP_URL", "http://127.0.0.1:8765")
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", 0.5))  # mean seconds per call
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", 0))  # share of calls failing with 503
+LLM_FAKE_THROTTLE_RATE = float(os.getenv("LLM_FAKE_THROTTLE_RATE", 0))  # share rejected with 429
+LLM_FAKE_SEED = int(os.getenv("LLM_FAKE_SEED", 0))
+
+# Dashboard charts: readings per chart by default, and the most a client may ask for
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", 200))
+CHART_MAX_POINTS_LIMIT = int(os.getenv("CHART_MAX_POINTS_LIMIT", 1000))
+
+# Reading percentiles: sketch size (rank error about 1.7 / k) and the
+# readings a parameter needs before the dashboard shows a percentile
+QUANTILE_SKETCH_K = int(os.getenv("QUANTILE_SKETCH_K", 200))
+PERCENTILE_MIN_READINGS = int(os.getenv("PERCENTILE_MIN_READINGS", 20))
+
+# Chat memory: recent turns verbatim, older ones in a rolling summary
+CHAT_MEMORY_ENABLED = os.getenv("CHAT_MEMORY_ENABLED", "1") == "1"
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", 6))
+CHAT_SUMMARY_BATCH_TURNS = int(os.getenv("CHAT_SUMMARY_BATCH_TURNS", 4))  # turns folded per summary update
+# One JSON-mode call per report at ingestion returns values, summary and
+# analysis together instead of three separate prompts
+LLM_CONSOLIDATED_ANALYSIS = os.getenv("LLM_CONSOLIDATED_ANALYSIS", "1") == "1"
+
+# Local cache of LLM responses (see analyzer/llm_cache.py)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", BASE_DIR / '.cache' / 'llm_responses.sqlite3')
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))  # seconds
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+
+# Report text extraction
+TESSERACT_CMD = os.getenv("TESSERACT_CMD")  # defaults to `tesseract` on PATH
+TESSDATA_PREFIX = os.getenv("TESSDATA_PREFIX")
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Both pools run alongside the web workers; keep them small by default
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", min(2, os.cpu_count() or 1)))  # 0 runs OCR in-process
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", 300))
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", 2000))  # px; taller scans are OCR'd as parallel tiles
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", min(2, os.cpu_count() or 1)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 50))
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", 20 * 1024 * 1024))
+
+# Share of the parameter catalog the local parser must read plausibly
+# before the LLM normalization step is skipped (1.0 always escalates)
+PARSER_ESCALATION_THRESHOLD = float(os.getenv("PARSER_ESCALATION_THRESHOLD", 0.8))
+
+# Background report ingestion (see `manage.py run_ingestion_worker`)
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", 3))
+INGESTION_RETRY_DELAY = int(os.getenv("INGESTION_RETRY_DELAY", 30))  # seconds, doubled per retry
+INGESTION_STALE_AFTER = int(os.getenv("INGESTION_STALE_AFTER", 600))  # seconds before a claimed job is requeued
 
 # At the end of settings.py
 